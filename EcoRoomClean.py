@@ -1,44 +1,2282 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import sqlite3
-import openpyxl
-from openpyxl.styles import PatternFill
 from datetime import datetime, timedelta
 import os
-import subprocess
 import platform
-import csv
 import shutil
 import glob
+import json
+import queue
+import threading
+import time
+import functools
+import html
+import io
+import posixpath
+import re
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
 
 # IME関連警告を抑制
 if platform.system() == "Darwin":
     os.environ['TK_SILENCE_DEPRECATION'] = '1'
 
 
-class HotelCleaningSystem:
+# ------------------------------------------------------------
+# 処理時間の計測（トレース）
+#   環境変数 ECOROOM_TRACE=1 で有効化（GUIの「処理時間」画面からも切替可）。
+#   無効時の span() は共有の空オブジェクトを返すだけなので、ほぼコストなし。
+#   有効時は各処理段階の所要時間とSQL文の時間を DB と同じフォルダの
+#   ecoroom_trace.jsonl に1行1レコード(JSON)で追記する。
+# ------------------------------------------------------------
+TRACE_ENV = "ECOROOM_TRACE"
+TRACE_LOG_NAME = "ecoroom_trace.jsonl"
+# この時間(ms)以上かかったSQL文は個別にログへ書き出す（それ未満は件数と合計のみ）
+TRACE_SQL_SLOW_MS = 2.0
+
+
+class _NullSpan:
+    """トレース無効時に返す何もしないspan"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """1つの処理段階の計測。with 文で使う。"""
+    __slots__ = ('tracer', 'name', 'attrs', 'depth', 'parent', 'start',
+                 'ms', 'sql_count', 'sql_ms')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.depth = 0
+        self.parent = None
+        self.start = 0.0
+        self.ms = 0.0
+        self.sql_count = 0
+        self.sql_ms = 0.0
+
+    def set(self, **attrs):
+        """計測中に判明した件数などを属性として追加する"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._flush_sql()
+        self.ms = (time.perf_counter() - self.start) * 1000.0
+        if exc_type is not None:
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        self.tracer._pop(self)
+        return False
+
+
+class Tracer:
+    """処理段階ごとの所要時間を記録する軽量トレーサ。
+
+    span はスレッドごとに入れ子で管理し、最上位の span が終わった時点で
+    その回の計測結果を last_run に保持する（GUIの「処理時間」画面用）。"""
+
     def __init__(self):
-        self.db_file = "hotel_cleaning.db"
+        self.enabled = False
+        self.log_path = None
+        self.last_run = []          # [(深さ, 名前, ms, 属性dict), ...]
+        self.last_run_name = None
+        self.last_run_at = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self, enabled, log_dir=None):
+        self.enabled = bool(enabled)
+        if log_dir is not None:
+            self.log_path = os.path.join(log_dir, TRACE_LOG_NAME)
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, attrs)
+
+    def event(self, name, **attrs):
+        """時間を持たない診断情報（旧デバッグprint相当）を記録する"""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        parent = stack[-1].name if stack else None
+        self._write({'type': 'event', 'name': name, 'parent': parent, **attrs})
+
+    def sql_callback(self, statement):
+        """sqlite3 の set_trace_callback に渡すコールバック。
+        コールバックは文の実行開始時にしか呼ばれないため、ひとつ前の文の
+        所要時間は「次の文の開始（または span 終了）まで」の近似値とする。"""
+        now = time.perf_counter()
+        self._flush_sql(now)
+        self._local.pending_sql = (statement, now)
+
+    # --- 内部処理 ---
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            self._local.finished = []
+            self._local.pending_sql = None
+        return stack
+
+    def _push(self, span):
+        stack = self._stack()
+        self._flush_sql()
+        if stack:
+            span.parent = stack[-1].name
+            span.depth = len(stack)
+        else:
+            self._local.finished = []
+        stack.append(span)
+
+    def _pop(self, span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        record = {'type': 'span', 'name': span.name, 'parent': span.parent,
+                  'depth': span.depth, 'ms': round(span.ms, 3)}
+        if span.sql_count:
+            record['sql_count'] = span.sql_count
+            record['sql_ms'] = round(span.sql_ms, 3)
+        record.update(span.attrs)
+        self._write(record)
+
+        finished = self._local.finished
+        finished.append((span.start, span.depth, span.name, span.ms, record))
+        if not stack:
+            # 開始順に並べ直して「前回の処理時間」として保持
+            finished.sort(key=lambda x: x[0])
+            with self._lock:
+                self.last_run = [item[1:] for item in finished]
+                self.last_run_name = span.name
+                self.last_run_at = datetime.now()
+            self._local.finished = []
+
+    def _flush_sql(self, now=None):
+        pending = getattr(self._local, 'pending_sql', None)
+        if not pending:
+            return
+        self._local.pending_sql = None
+        statement, started = pending
+        ms = ((now or time.perf_counter()) - started) * 1000.0
+        stack = self._stack()
+        if stack:
+            stack[-1].sql_count += 1
+            stack[-1].sql_ms += ms
+        if ms >= TRACE_SQL_SLOW_MS:
+            self._write({'type': 'sql', 'parent': stack[-1].name if stack else None,
+                         'ms': round(ms, 3), 'sql': ' '.join(statement.split())})
+
+    def _write(self, record):
+        if not self.log_path:
+            return
+        record = {'ts': datetime.now().isoformat(timespec='milliseconds'),
+                  'thread': threading.current_thread().name, **record}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        try:
+            with self._lock:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+        except OSError:
+            # ログが書けなくても本処理は止めない
+            pass
+
+
+# アプリ全体で共有するトレーサ
+_tracer = Tracer()
+
+
+# ------------------------------------------------------------
+# プロファイル取得（現場からの「遅い」報告の調査用）
+#   環境変数 ECOROOM_PROFILE=1（または操作名のカンマ区切り。例:
+#   "create_schedule,output_earning_table"）で対象操作を毎回プロファイルする。
+#   起動メニューで Ctrl+Shift+P を押すと、次の1回だけを対象にできる。
+#   結果は DB と同じフォルダに profile_<操作名>_<日時>.prof（cProfile）と
+#   profile_<操作名>_<日時>_alloc.txt（tracemalloc の確保量上位）で保存する。
+# ------------------------------------------------------------
+PROFILE_ENV = "ECOROOM_PROFILE"
+PROFILE_OPERATIONS = ('create_schedule', 'import_csv', 'output_earning_table')
+# _alloc.txt に書き出すメモリ確保箇所の件数
+PROFILE_TOP_ALLOCATIONS = 40
+
+
+def _profiled(op_name):
+    """HotelCleaningSystem の操作メソッドをプロファイル対象にするデコレータ。
+    プロファイル要求が無いときは元のメソッドをそのまま呼ぶだけ。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self._profile_requested(op_name):
+                return func(self, *args, **kwargs)
+            return self._run_profiled(op_name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+# ------------------------------------------------------------
+# 起動の高速化のため、openpyxl・csv・unicodedata・calendar・subprocess は
+# 使う処理（Excel出力・CSV読込・ファイルを開く）の中で import する。
+# 特に openpyxl は依存が大きく、最初の画面が出るまでの時間に直結する。
+# ------------------------------------------------------------
+
+
+# ------------------------------------------------------------
+# アーニング表テンプレートの直接書き換え
+#   xlsx/xlsm は zip 内の XML パーツの集まりなので、openpyxl で全シート・
+#   全スタイルを読み込むのではなく、【指示書用】シートの XML だけを書き換え、
+#   それ以外のパーツ（他シート・画像・マクロ vbaProject.bin 等）は
+#   圧縮データのままバイト単位でコピーする。
+#   これにより出力時間がテンプレートの他の部分の重さに左右されず、
+#   マクロや書式もテンプレートのまま保たれる。
+# ------------------------------------------------------------
+class EarningTemplateError(Exception):
+    """アーニング表テンプレートの構造を解釈できない"""
+
+
+class EarningExportError(Exception):
+    """アーニング表を出力できない（メッセージはそのまま利用者に表示する）"""
+
+
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_SHEET_DATA_RE = re.compile(r'<((?:\w+:)?)sheetData\b[^>]*?(?:/>|>(.*?)</(?:\w+:)?sheetData>)', re.S)
+_ROW_RE = re.compile(r'<(?:\w+:)?row\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?row>)', re.S)
+_CELL_RE = re.compile(r'<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.S)
+_ATTR_RE = re.compile(r'([\w:]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_VALUE_RE = re.compile(r'<(?:\w+:)?v\b[^>]*>(.*?)</(?:\w+:)?v>', re.S)
+_TEXT_RE = re.compile(r'<(?:\w+:)?t\b[^>]*?(?:/>|>(.*?)</(?:\w+:)?t>)', re.S)
+_PHONETIC_RE = re.compile(r'<(?:\w+:)?rPh\b.*?</(?:\w+:)?rPh>', re.S)
+_FORMULA_RE = re.compile(r'<(?:\w+:)?f\b([^>]*)', re.S)
+_COL_RE = re.compile(r'<(?:\w+:)?col\b([^>]*?)/?>', re.S)
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)$')
+
+# 値を変更しないことを表す印（塗りつぶしだけ変える場合）
+_KEEP_VALUE = object()
+
+
+def _normalize_argb(color):
+    """'#3cb371' / '3CB371' / 'FF3CB371' を ARGB 8桁の大文字にする（空なら None）"""
+    if not color:
+        return None
+    color = str(color).strip().lstrip('#').upper()
+    if len(color) == 6:
+        color = "FF" + color
+    if not re.fullmatch(r'[0-9A-F]{8}', color):
+        raise ValueError(f"色の指定が正しくありません: {color}")
+    return color
+
+
+def _parse_attrs(attr_text):
+    """XMLの属性文字列を順序付きの [(名前, 値), ...] にする（値はエスケープのまま）"""
+    return [(m.group(1), m.group(2) if m.group(2) is not None else m.group(3))
+            for m in _ATTR_RE.finditer(attr_text)]
+
+
+def _format_attrs(attrs):
+    return "".join(f' {name}="{value}"' for name, value in attrs)
+
+
+def _col_letter_to_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - 64)
+    return index
+
+
+def _col_index_to_letter(index):
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _xml_text(fragment):
+    """<t> 要素群の文字列を連結してテキストにする（ふりがな rPh は除く）"""
+    fragment = _PHONETIC_RE.sub("", fragment)
+    return html.unescape("".join(m.group(1) or "" for m in _TEXT_RE.finditer(fragment)))
+
+
+def _resolve_part(base_part, target):
+    """リレーションの Target をパッケージ内のパーツ名に解決する"""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+def _rels_part(part):
+    return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+
+def _read_rels(zf, part):
+    """パーツのリレーション一覧 [(Id, Type, 解決済みパーツ名), ...]"""
+    try:
+        root = ET.fromstring(zf.read(_rels_part(part)))
+    except KeyError:
+        return []
+    rels = []
+    for rel in root.iter(f"{{{_NS_PKG_REL}}}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        rels.append((rel.get("Id"), rel.get("Type", ""), _resolve_part(part, rel.get("Target", ""))))
+    return rels
+
+
+def _workbook_part(zf):
+    for _, rel_type, target in _read_rels(zf, ""):
+        if rel_type.endswith("/officeDocument"):
+            return target
+    raise EarningTemplateError("ブック本体(workbook.xml)が見つかりません")
+
+
+def _xlsx_sheet_names(path):
+    """ブックのシート名一覧を workbook.xml だけ読んで返す（セルは読み込まない）"""
+    with zipfile.ZipFile(path) as zf:
+        root = ET.fromstring(zf.read(_workbook_part(zf)))
+    return [s.get("name") for s in root.iter(f"{{{_NS_MAIN}}}sheet")]
+
+
+class _StylesPatch:
+    """styles.xml への追記（塗りつぶしと、それを使うセル書式）を管理する。
+    既存の書式は変更せず、元の書式を複製して fillId だけ差し替えたものを末尾に追加する。"""
+
+    _FILLS_RE = re.compile(r'(<(?:\w+:)?fills\b[^>]*?)(/>|>(.*?)</((?:\w+:)?)fills>)', re.S)
+    _FILL_RE = re.compile(r'<(?:\w+:)?fill\b[^>]*?(?:/>|>.*?</(?:\w+:)?fill>)', re.S)
+    _XFS_RE = re.compile(r'(<((?:\w+:)?)cellXfs\b[^>]*?)(/>|>(.*?)</(?:\w+:)?cellXfs>)', re.S)
+    _XF_RE = re.compile(r'<(?:\w+:)?xf\b[^>]*?(?:/>|>.*?</(?:\w+:)?xf>)', re.S)
+
+    def __init__(self, xml):
+        self.xml = xml
+        fills = self._FILLS_RE.search(xml)
+        xfs = self._XFS_RE.search(xml)
+        if not fills or not xfs:
+            raise EarningTemplateError("styles.xml に塗りつぶし／セル書式の定義がありません")
+        self.prefix = xfs.group(2)
+        self.fill_count = len(self._FILL_RE.findall(fills.group(3) or ""))
+        self.xfs = self._XF_RE.findall(xfs.group(4) or "")
+        self.new_fills = []       # 追加する <fill> 要素
+        self.new_xfs = []         # 追加する <xf> 要素
+        self._fill_ids = {}       # argb -> fillId
+        self._xf_ids = {}         # (元の書式番号, argb) -> 新しい書式番号
+
+    def xf_with_fill(self, style_index, argb):
+        """style_index の書式に argb の単色塗りつぶしを適用した書式番号を返す"""
+        if not (0 <= style_index < len(self.xfs)):
+            style_index = 0
+        key = (style_index, argb)
+        if key not in self._xf_ids:
+            fill_id = self._fill_id(argb)
+            base = self.xfs[style_index] if self.xfs else f'<{self.prefix}xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+            head_end = base.index(">")
+            if base[head_end - 1] == "/":
+                head_end -= 1
+            m = re.match(r'<([\w:]+)', base)
+            attrs = [(n, v) for n, v in _parse_attrs(base[m.end():head_end])
+                     if n not in ("fillId", "applyFill")]
+            attrs.append(("fillId", str(fill_id)))
+            attrs.append(("applyFill", "1"))
+            self.new_xfs.append(f"<{m.group(1)}{_format_attrs(attrs)}{base[head_end:]}")
+            self._xf_ids[key] = len(self.xfs) + len(self.new_xfs) - 1
+        return self._xf_ids[key]
+
+    def _fill_id(self, argb):
+        if argb not in self._fill_ids:
+            p = self.prefix
+            self.new_fills.append(
+                f'<{p}fill><{p}patternFill patternType="solid">'
+                f'<{p}fgColor rgb="{argb}"/><{p}bgColor rgb="{argb}"/>'
+                f'</{p}patternFill></{p}fill>'
+            )
+            self._fill_ids[argb] = self.fill_count + len(self.new_fills) - 1
+        return self._fill_ids[argb]
+
+    def serialize(self):
+        """追記を反映した styles.xml（変更が無ければ None）"""
+        if not self.new_xfs:
+            return None
+        xml = self._append(self.xml, self._FILLS_RE, self.new_fills,
+                           self.fill_count + len(self.new_fills), "fills")
+        return self._append(xml, self._XFS_RE, self.new_xfs,
+                            len(self.xfs) + len(self.new_xfs), "cellXfs")
+
+    @staticmethod
+    def _append(xml, pattern, elements, count, tag):
+        m = pattern.search(xml)
+        head = re.sub(r'\scount\s*=\s*("[^"]*"|\'[^\']*\')', "", m.group(1))
+        prefix = re.match(r'<((?:\w+:)?)', head).group(1)
+        inner = (m.group(3) if tag == "fills" else m.group(4)) or ""
+        element = f'{head} count="{count}">{inner}{"".join(elements)}</{prefix}{tag}>'
+        return xml[:m.start()] + element + xml[m.end():]
+
+
+# 解釈済みテンプレートを保持する数（施設ごとにテンプレートを使い分けても足りる程度）
+EARNING_TEMPLATE_CACHE_SIZE = 4
+# {絶対パス: ((更新時刻ns, サイズ), EarningTemplate)}（新しく使ったものほど後ろ）
+_earning_template_cache = {}
+_earning_template_lock = threading.Lock()
+
+
+class EarningTemplate:
+    """アーニング表テンプレート（xlsx/xlsm）を zip のまま扱うクラス。
+
+    読み込み時は workbook・シート一覧・共有文字列と【指示書用】シートの XML
+    だけを解釈する。export() では書き換え対象のシート XML と styles.xml
+    だけを作り直し、その他のパーツは元の圧縮データをそのまま書き出す。
+    同じテンプレートを繰り返し使うときは cached() で解釈済みのものを複製して使う。"""
+
+    @classmethod
+    def cached(cls, path):
+        """解釈済みのテンプレートをプロセス内で使い回し、複製を返す。
+        ファイルの更新時刻かサイズが変わっていれば読み直す。戻り値は (テンプレート, キャッシュから取ったか)"""
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        sig = (st.st_mtime_ns, st.st_size)
+        with _earning_template_lock:
+            hit = _earning_template_cache.pop(key, None)
+            if hit is not None and hit[0] == sig:
+                _earning_template_cache[key] = hit
+                return hit[1].clone(path), True
+        template = cls(path)
+        template.build_cell_map()   # セル位置の解析も済ませてから共有する
+        with _earning_template_lock:
+            _earning_template_cache.pop(key, None)
+            _earning_template_cache[key] = (sig, template)
+            while len(_earning_template_cache) > EARNING_TEMPLATE_CACHE_SIZE:
+                del _earning_template_cache[next(iter(_earning_template_cache))]
+        return template.clone(path), False
+
+    def clone(self, path=None):
+        """複製を返す。元の zip のバイト列・解釈済みの XML や文字列は変更しないので共有し、
+        書き換えの入れ物（シート XML の辞書）だけを分ける"""
+        twin = object.__new__(type(self))
+        twin.__dict__.update(self.__dict__)
+        twin.sheet_xml = dict(self.sheet_xml)
+        if path is not None:
+            twin.path = path
+        return twin
+
+    def __init__(self, path):
+        self.path = path
+        self.is_macro = os.path.splitext(path)[1].lower() == '.xlsm'
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        try:
+            zf = zipfile.ZipFile(io.BytesIO(self.data))
+        except zipfile.BadZipFile:
+            raise EarningTemplateError("xlsx/xlsm 形式（zip）ではありません")
+        with zf:
+            self.workbook_part = _workbook_part(zf)
+            workbook = ET.fromstring(zf.read(self.workbook_part))
+            rels = _read_rels(zf, self.workbook_part)
+            targets = {rel_id: target for rel_id, _, target in rels}
+            self.styles_part = next((t for _, typ, t in rels if typ.endswith("/styles")), None)
+            shared_part = next((t for _, typ, t in rels if typ.endswith("/sharedStrings")), None)
+
+            # シート名と XML パーツ名の対応（ブック内の並び順）
+            self.sheets = []
+            for sheet in workbook.iter(f"{{{_NS_MAIN}}}sheet"):
+                target = targets.get(sheet.get(f"{{{_NS_REL}}}id"))
+                if target:
+                    self.sheets.append((sheet.get("name"), target))
+
+            self.shared_strings = []
+            if shared_part and shared_part in zf.NameToInfo:
+                sst = zf.read(shared_part).decode("utf-8")
+                self.shared_strings = [_xml_text(si) for si in re.findall(
+                    r'<(?:\w+:)?si\b[^>]*>(.*?)</(?:\w+:)?si>|<(?:\w+:)?si\b[^>]*/>', sst, re.S)]
+
+            # 書き換え対象になりうる【指示書用】シートの XML だけ読み込む
+            self.sheet_xml = {part: zf.read(part).decode("utf-8")
+                              for name, part in self.sheets if '指示書' in name}
+            self.styles_xml = zf.read(self.styles_part).decode("utf-8") if self.styles_part else None
+        self._cell_map = None
+
+    @property
+    def sheetnames(self):
+        return [name for name, _ in self.sheets]
+
+    def build_cell_map(self):
+        """【指示書用】シートを走査し {部屋番号(int): (シートパーツ名, 行, 列)} を返す。
+        シート名に「指示書」を含むシートが対象。列レイアウト(A/D/G)に依存せず、
+        3桁以上の数字セルを部屋番号とみなして検出する。
+        結果は覚えておき、2回目からは（複製でも）走査しない。"""
+        if self._cell_map is not None:
+            return dict(self._cell_map)
+        cell_map = {}
+        for name, part in self.sheets:
+            if part not in self.sheet_xml:
+                continue
+            for row, col, attrs, content in self._iter_cells(self.sheet_xml[part]):
+                if not content or _FORMULA_RE.search(content):
+                    continue
+                v = self._cell_value(dict(attrs).get("t", "n"), content)
+                rn = None
+                if isinstance(v, int) and v >= 200:
+                    rn = v
+                elif isinstance(v, str) and v.strip().isdigit() and len(v.strip()) >= 3:
+                    rn = int(v.strip())
+                if rn is not None:
+                    cell_map[rn] = (part, row, col)
+        self._cell_map = cell_map
+        return dict(cell_map)
+
+    def export(self, patches, output_path):
+        """patches = {シートパーツ名: {(行, 列): {'value': 文字列 or _KEEP_VALUE,
+        'fill': ARGB or None}}} を反映したブックを output_path に書き出す"""
+        styles = _StylesPatch(self.styles_xml) if self.styles_xml else None
+        replaced = {}
+        formula_removed = False
+        for part, cell_patches in patches.items():
+            if not cell_patches:
+                continue
+            if styles is None and any(p.get('fill') for p in cell_patches.values()):
+                raise EarningTemplateError("styles.xml が無いため色付けできません")
+            xml, removed = self._patch_sheet(self.sheet_xml[part], cell_patches, styles)
+            replaced[part] = xml.encode("utf-8")
+            formula_removed = formula_removed or removed
+        if styles is not None:
+            styles_xml = styles.serialize()
+            if styles_xml is not None:
+                replaced[self.styles_part] = styles_xml.encode("utf-8")
+
+        with zipfile.ZipFile(io.BytesIO(self.data)) as src:
+            dropped = set()
+            if formula_removed:
+                # 数式を上書きしたセルが計算チェーンに残ると Excel が修復扱いにするため、
+                # calcChain.xml を外す（Excel が開いたときに作り直す）
+                dropped = self._drop_calc_chain(src, replaced)
+            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+                for info in src.infolist():
+                    if info.filename in dropped:
+                        continue
+                    if info.filename in replaced:
+                        out_info = zipfile.ZipInfo(info.filename, info.date_time)
+                        out_info.compress_type = zipfile.ZIP_DEFLATED
+                        out_info.external_attr = info.external_attr
+                        dst.writestr(out_info, replaced[info.filename])
+                    else:
+                        _copy_zip_entry(src, info, dst)
+
+    # --- 内部処理 ---
+    def _cell_value(self, cell_type, content):
+        """openpyxl と同じ解釈でセルの値を返す（数値は整数のみ int にする）"""
+        if cell_type == "inlineStr":
+            return _xml_text(content)
+        m = _VALUE_RE.search(content)
+        if not m:
+            return None
+        raw = html.unescape(m.group(1))
+        if cell_type == "s":
+            try:
+                return self.shared_strings[int(raw)]
+            except (ValueError, IndexError):
+                return None
+        if cell_type in ("str", "e"):
+            return raw
+        if cell_type == "n":
+            raw = raw.strip()
+            if re.fullmatch(r'-?\d+', raw):
+                return int(raw)
+        return None
+
+    @staticmethod
+    def _iter_cells(xml):
+        """sheetData 内のセルを (行, 列, 属性リスト, 中身) で列挙する"""
+        sheet_data = _SHEET_DATA_RE.search(xml)
+        if not sheet_data or not sheet_data.group(2):
+            return
+        row_num = 0
+        for row in _ROW_RE.finditer(sheet_data.group(2)):
+            row_attrs = dict(_parse_attrs(row.group(1)))
+            row_num = int(row_attrs["r"]) if "r" in row_attrs else row_num + 1
+            col = 0
+            for cell in _CELL_RE.finditer(row.group(2) or ""):
+                attrs = _parse_attrs(cell.group(1))
+                ref = dict(attrs).get("r")
+                m = _CELL_REF_RE.match(ref) if ref else None
+                col = _col_letter_to_index(m.group(1)) if m else col + 1
+                yield row_num, col, attrs, cell.group(2)
+
+    def _patch_sheet(self, xml, cell_patches, styles):
+        """シート XML の該当セルを書き換える。戻り値は (新しいXML, 数式を消したか)"""
+        sheet_data = _SHEET_DATA_RE.search(xml)
+        if not sheet_data or sheet_data.group(2) is None:
+            raise EarningTemplateError("シートにセルデータがありません")
+        prefix = sheet_data.group(1)
+        column_styles = self._column_styles(xml)
+        by_row = {}
+        for (row, col), patch in cell_patches.items():
+            by_row.setdefault(row, {})[col] = patch
+        state = {'formula_removed': False}
+
+        def build_cell(row, col, attrs, content, patch, style):
+            if patch.get('fill'):
+                style = styles.xf_with_fill(style, patch['fill'])
+            value = patch.get('value', _KEEP_VALUE)
+            keep = [(n, v) for n, v in attrs if n not in ("r", "s", "t", "cm", "vm")]
+            head = [("r", f"{_col_index_to_letter(col)}{row}")]
+            if style:
+                head.append(("s", str(style)))
+            if value is _KEEP_VALUE:
+                cell_type = dict(attrs).get("t")
+                tail = [("t", cell_type)] if cell_type else []
+                keep = [(n, v) for n, v in attrs if n not in ("r", "s", "t")]
+                if content is None:
+                    return f"<{prefix}c{_format_attrs(head + keep + tail)}/>"
+                return f"<{prefix}c{_format_attrs(head + keep + tail)}>{content}</{prefix}c>"
+            if content:
+                formula = _FORMULA_RE.search(content)
+                if formula:
+                    if 'ref=' in formula.group(1) and 'shared' in formula.group(1):
+                        raise EarningTemplateError(
+                            f"{_col_index_to_letter(col)}{row} は共有数式の基準セルのため書き換えできません")
+                    state['formula_removed'] = True
+            if value == "":
+                return f"<{prefix}c{_format_attrs(head + keep)}/>"
+            space = ' xml:space="preserve"' if value != value.strip() else ""
+            return (f"<{prefix}c{_format_attrs(head + keep)} t=\"inlineStr\">"
+                    f"<{prefix}is><{prefix}t{space}>{html.escape(value, quote=False)}</{prefix}t></{prefix}is>"
+                    f"</{prefix}c>")
+
+        def patch_row(row_num, row_attrs, inner, patches_in_row):
+            row_style = 0
+            attr_map = dict(row_attrs)
+            if attr_map.get("customFormat") in ("1", "true") and "s" in attr_map:
+                row_style = int(attr_map["s"])
+            pending = dict(patches_in_row)
+            pieces = []
+            col = 0
+            pos = 0
+            for cell in _CELL_RE.finditer(inner or ""):
+                attrs = _parse_attrs(cell.group(1))
+                ref = dict(attrs).get("r")
+                m = _CELL_REF_RE.match(ref) if ref else None
+                col = _col_letter_to_index(m.group(1)) if m else col + 1
+                pieces.append(inner[pos:cell.start()])
+                pos = cell.end()
+                for new_col in sorted(c for c in pending if c < col):
+                    pieces.append(build_cell(row_num, new_col, [], None, pending.pop(new_col),
+                                             row_style or column_styles.get(new_col, 0)))
+                if col in pending:
+                    style = int(dict(attrs).get("s", 0))
+                    pieces.append(build_cell(row_num, col, attrs, cell.group(2), pending.pop(col), style))
+                else:
+                    pieces.append(cell.group(0))
+            pieces.append((inner or "")[pos:])
+            for new_col in sorted(pending):
+                pieces.append(build_cell(row_num, new_col, [], None, pending[new_col],
+                                         row_style or column_styles.get(new_col, 0)))
+            # 新しい列を足すと spans（列範囲のヒント）と食い違うことがあるので外す
+            attrs = [(n, v) for n, v in row_attrs if n != "spans"]
+            if not any(n == "r" for n, _ in attrs):
+                attrs.insert(0, ("r", str(row_num)))
+            return f"<{prefix}row{_format_attrs(attrs)}>{''.join(pieces)}</{prefix}row>"
+
+        content = sheet_data.group(2)
+        content_start = sheet_data.start(2)
+        pieces = []
+        pos = 0
+        row_num = 0
+        for row in _ROW_RE.finditer(content):
+            row_attrs = _parse_attrs(row.group(1))
+            attr_map = dict(row_attrs)
+            row_num = int(attr_map["r"]) if "r" in attr_map else row_num + 1
+            pieces.append(content[pos:row.start()])
+            pos = row.end()
+            for new_row in sorted(r for r in by_row if r < row_num):
+                pieces.append(patch_row(new_row, [("r", str(new_row))], "", by_row.pop(new_row)))
+            if row_num in by_row:
+                pieces.append(patch_row(row_num, row_attrs, row.group(2), by_row.pop(row_num)))
+            else:
+                pieces.append(row.group(0))
+        pieces.append(content[pos:])
+        for new_row in sorted(by_row):
+            pieces.append(patch_row(new_row, [("r", str(new_row))], "", by_row[new_row]))
+
+        new_xml = xml[:content_start] + "".join(pieces) + xml[sheet_data.end(2):]
+        return new_xml, state['formula_removed']
+
+    @staticmethod
+    def _column_styles(xml):
+        """<cols> の列書式 {列番号: 書式番号}（新しくセルを作るときに引き継ぐ）"""
+        styles = {}
+        cols = re.search(r'<(?:\w+:)?cols\b[^>]*>(.*?)</(?:\w+:)?cols>', xml, re.S)
+        if not cols:
+            return styles
+        for m in _COL_RE.finditer(cols.group(1)):
+            attrs = dict(_parse_attrs(m.group(1)))
+            if "style" not in attrs:
+                continue
+            try:
+                for c in range(int(attrs["min"]), int(attrs["max"]) + 1):
+                    styles[c] = int(attrs["style"])
+            except (KeyError, ValueError):
+                continue
+        return styles
+
+    def _drop_calc_chain(self, src, replaced):
+        """calcChain.xml とその参照（ブックのリレーション・Content_Types）を外す"""
+        rels = _read_rels(src, self.workbook_part)
+        calc_parts = {t for _, typ, t in rels if typ.endswith("/calcChain")}
+        if not calc_parts:
+            return set()
+        rels_name = _rels_part(self.workbook_part)
+        rels_xml = src.read(rels_name).decode("utf-8")
+        rels_xml = re.sub(r'<(?:\w+:)?Relationship\b[^>]*calcChain[^>]*/>', "", rels_xml)
+        replaced[rels_name] = rels_xml.encode("utf-8")
+        types_xml = src.read("[Content_Types].xml").decode("utf-8")
+        for part in calc_parts:
+            types_xml = re.sub(r'<(?:\w+:)?Override\b[^>]*PartName="/' + re.escape(part) + r'"[^>]*/>',
+                               "", types_xml)
+        replaced["[Content_Types].xml"] = types_xml.encode("utf-8")
+        return calc_parts
+
+
+def _copy_zip_entry(src, info, dst):
+    """zip のエントリを再圧縮せず、圧縮データのままコピーする。
+    （zipfile に公開APIが無いため内部属性を使う。使えない環境では通常の読み書きで代替）"""
+    try:
+        if info.file_size >= zipfile.ZIP64_LIMIT or info.compress_size >= zipfile.ZIP64_LIMIT \
+                or info.flag_bits & 0x01:
+            raise ValueError("raw copy unsupported")
+        src.fp.seek(info.header_offset)
+        header = src.fp.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise ValueError("bad local header")
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        src.fp.seek(info.header_offset + 30 + name_len + extra_len)
+        raw = src.fp.read(info.compress_size)
+
+        out_info = zipfile.ZipInfo(info.filename, info.date_time)
+        out_info.compress_type = info.compress_type
+        out_info.external_attr = info.external_attr
+        out_info.create_system = info.create_system
+        out_info.flag_bits = info.flag_bits & ~0x08   # サイズ・CRCはヘッダに書く
+        out_info.CRC = info.CRC
+        out_info.compress_size = info.compress_size
+        out_info.file_size = info.file_size
+        _write_raw_zip_entry(dst, out_info, raw)
+    except (AttributeError, ValueError, OSError, struct.error):
+        dst.writestr(info, src.read(info))
+
+
+def _write_raw_zip_entry(dst, info, raw):
+    """圧縮済みデータ raw を、CRC・サイズを設定済みの info でそのまま zip に追記する"""
+    info.header_offset = dst.fp.tell()
+    dst.fp.write(info.FileHeader(False))
+    dst.fp.write(raw)
+    dst.filelist.append(info)
+    dst.NameToInfo[info.filename] = info
+    dst.start_dir = dst.fp.tell()
+    dst._didModify = True
+
+
+# ------------------------------------------------------------
+# エコ票（月別シート）の xlsx 書き出し
+#   月ごとのシート XML を直接作り、圧縮済みのまま DB の sheet_cache に保存しておく。
+#   スケジュールが変わった月だけ作り直し、それ以外は保存済みの圧縮データを
+#   そのまま zip に書き込む（_copy_zip_entry と同じ方法）。
+# ------------------------------------------------------------
+# シートのレイアウトを変えたら上げる（古いキャッシュは作り直しになる）
+SHEET_LAYOUT_VERSION = 1
+# 作り直す月がこれ以上あるときは、別プロセスで並行してシートを作る
+SHEET_PARALLEL_MIN_MONTHS = 6
+# 四半期ごとに分割するときに同時に書き出すブック数の上限
+WORKBOOK_WRITE_WORKERS = 4
+
+_SHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_ECO_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<styleSheet xmlns="{_SHEET_NS}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _inline_cell(ref, value):
+    text = html.escape(str(value), quote=False)
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c r="{ref}" t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+
+def _render_month_sheet_xml(year, month, rows):
+    """月シートの XML を作る。rows は [(氏名, 部屋番号, エコプラン, {日: ステータス}), ...]。
+    レイアウト: 3行目が見出し（A=氏名, C=部屋番号, D〜=日付, 最後=エコプラン）、4行目から部屋。"""
+    import calendar
+
+    days_in_month = calendar.monthrange(year, month)[1]
+    ecoplan_col = _col_index_to_letter(3 + days_in_month + 1)
+    letters = [_col_index_to_letter(3 + day) for day in range(days_in_month + 1)]
+
+    parts = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n',
+             f'<worksheet xmlns="{_SHEET_NS}" xmlns:r="{_REL_NS}">',
+             f'<cols><col min="1" max="1" width="12" customWidth="1"/>'
+             f'<col min="3" max="3" width="8" customWidth="1"/>'
+             f'<col min="4" max="{3 + days_in_month}" width="6" customWidth="1"/></cols>',
+             '<sheetData>']
+
+    header = [_inline_cell("A3", "氏名"), _inline_cell("C3", "部屋番号")]
+    header += [_inline_cell(f"{letters[day]}3", str(day)) for day in range(1, days_in_month + 1)]
+    header.append(_inline_cell(f"{ecoplan_col}3", "エコプラン"))
+    parts.append(f'<row r="3">{"".join(header)}</row>')
+
+    for i, (guest, room, ecoplan, days) in enumerate(rows):
+        r = 4 + i
+        cells = []
+        if guest:
+            cells.append(_inline_cell(f"A{r}", guest))
+        cells.append(_inline_cell(f"C{r}", room))
+        for day in sorted(days):
+            if days[day]:
+                cells.append(_inline_cell(f"{letters[day]}{r}", days[day]))
+        if ecoplan:
+            cells.append(_inline_cell(f"{ecoplan_col}{r}", "エコプラン"))
+        parts.append(f'<row r="{r}">{"".join(cells)}</row>')
+
+    parts.append('</sheetData></worksheet>')
+    return "".join(parts).encode("utf-8")
+
+
+# 清掃スケジュールに入れてよいステータス（編集画面・一括変更・API の入力チェック、
+# 整合性チェック、ステータス行列のコードで共通に使う）
+SCHEDULE_STATUSES = ('C/I', 'C/O', '〇', '×', 'エコドア')
+
+
+# ------------------------------------------------------------
+# 部屋 × 日 の清掃ステータス行列（NumPy があるときに使う）
+#   行列のコード 1〜 は SCHEDULE_STATUSES の順に割り当て、それ以外のステータスはその後ろに足す
+# ------------------------------------------------------------
+
+
+def _numpy():
+    """NumPy があれば返す（無ければ None。呼び出し側は従来の処理を使う）"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class OccupancyMatrix:
+    """部屋 × 日 の清掃ステータスを uint8 の2次元配列 cells で持つ。
+    cells[i, d] は rooms[i] の first_day + d 日のステータスのコードで、0 はスケジュールの
+    行が無い日、それ以外は statuses[コード]（NULL のステータスは None）。"""
+
+    def __init__(self, np, rooms, guests, ecodoor, ecoplan, first_day, cells, statuses):
+        self.np = np
+        self.rooms = rooms
+        self.guests = guests
+        self.ecodoor = ecodoor
+        self.ecoplan = ecoplan
+        self.first_day = first_day
+        self.cells = cells
+        self.statuses = statuses
+
+    @classmethod
+    def from_db(cls, conn, start=None, end=None, sort_key=None):
+        """DB の rooms と cleaning_schedule（start〜end の日、省略時は全期間）から作る。
+        NumPy が無ければ None。rooms に無い部屋のスケジュールは含めない。"""
+        np = _numpy()
+        if np is None:
+            return None
+        if start is None or end is None:
+            low, high = conn.execute("SELECT MIN(cleaning_date), MAX(cleaning_date) FROM cleaning_schedule").fetchone()
+            if low is None:
+                low = high = _day_number(datetime.now())
+            first = _day_number(start) if start is not None else low
+            last = _day_number(end) if end is not None else high
+        else:
+            first, last = _day_number(start), _day_number(end)
+
+        room_rows = conn.execute("SELECT rowid, room_number, guest_name, is_ecodoor, is_ecoplan FROM rooms").fetchall()
+        room_rows.sort(key=lambda r: (sort_key(r[1]), r[1]) if sort_key else r[1])
+        rooms = [r[1] for r in room_rows]
+        guests = [r[2] for r in room_rows]
+        ecodoor = np.array([bool(r[3]) for r in room_rows], dtype=bool)
+        ecoplan = np.array([bool(r[4]) for r in room_rows], dtype=bool)
+
+        statuses = [None] + list(SCHEDULE_STATUSES)
+        days = max(0, last - first + 1)
+        cells = np.zeros((len(rooms), days), dtype=np.uint8)
+        if rooms and days:
+            # 1行ずつ Python のタプルにすると遅いので、(rowid, 日, コード) を1つの整数にして
+            # SQLite 側でカンマ区切りの1つの文字列にまとめ、NumPy でまとめて数値に戻す
+            case = " ".join("WHEN ? THEN ?" for _ in SCHEDULE_STATUSES)
+            params = [v for code, st in enumerate(SCHEDULE_STATUSES, start=1) for v in (st, code)]
+            packed = conn.execute(
+                f"SELECT group_concat(r.rowid * 16777216 + (s.cleaning_date - ?) * 256 "
+                f"+ CASE s.cleaning_status {case} ELSE 255 END) "
+                "FROM cleaning_schedule s JOIN rooms r ON r.room_number = s.room_number "
+                "WHERE s.cleaning_date BETWEEN ? AND ?",
+                [first] + params + [first, last]).fetchone()[0]
+            if packed:
+                values = np.fromstring(packed, dtype=np.int64, sep=",")
+                # rowid → 行番号の表を作り、全ての行を1回の代入で埋める
+                rowids = np.array([r[0] for r in room_rows], dtype=np.int64)
+                index = np.full(int(rowids.max()) + 1, -1, dtype=np.int64)
+                index[rowids] = np.arange(len(rooms))
+                row_index = index[values >> 24]
+                day_index = (values >> 8) & 0xFFFF
+                cells[row_index, day_index] = values & 0xFF
+                if (cells == 255).any():
+                    cls._fill_other_statuses(conn, cells, statuses, index, first, last)
+        return cls(np, rooms, guests, ecodoor, ecoplan, first, cells, statuses)
+
+    @staticmethod
+    def _fill_other_statuses(conn, cells, statuses, index, first, last):
+        """SCHEDULE_STATUSES 以外のステータス（NULL・空文字・想定外の値）の日にコードを足す"""
+        placeholders = ",".join("?" for _ in SCHEDULE_STATUSES)
+        rows = conn.execute(
+            "SELECT r.rowid, s.cleaning_date - ?, s.cleaning_status "
+            "FROM cleaning_schedule s JOIN rooms r ON r.room_number = s.room_number "
+            f"WHERE s.cleaning_date BETWEEN ? AND ? AND (s.cleaning_status IS NULL "
+            f"OR s.cleaning_status NOT IN ({placeholders}))",
+            [first, first, last] + list(SCHEDULE_STATUSES)).fetchall()
+        codes = {}
+        for rowid, day, status in rows:
+            if status not in codes:
+                if len(statuses) >= 255:
+                    raise ValueError("ステータスの種類が多すぎるため行列にできません")
+                codes[status] = len(statuses)
+                statuses.append(status)
+            cells[index[rowid], day] = codes[status]
+
+    def _columns(self, start_day, end_day):
+        """日数の範囲（両端含む）を行列の列の範囲 (a, b) にする（行列の外は切り詰める）"""
+        a = max(start_day - self.first_day, 0)
+        b = min(end_day - self.first_day + 1, self.cells.shape[1])
+        return a, max(a, b)
+
+    def month_rows(self, year, month):
+        """エコ票の月シートの行 [(氏名, 部屋番号, エコプラン, {日: ステータス})]（その月に行のある部屋だけ）"""
+        import calendar
+
+        np = self.np
+        month_first = _day_number(datetime(year, month, 1))
+        a, b = self._columns(month_first, month_first + calendar.monthrange(year, month)[1] - 1)
+        block = self.cells[:, a:b]
+        offset = self.first_day + a - month_first + 1
+        statuses = self.statuses
+        rows = []
+        for i in np.flatnonzero(block.any(axis=1)).tolist():
+            row = block[i]
+            filled = np.flatnonzero(row)
+            rows.append((self.guests[i], self.rooms[i], bool(self.ecoplan[i]),
+                         {day + offset: statuses[code]
+                          for day, code in zip(filled.tolist(), row[filled].tolist())}))
+        return rows
+
+    def day_counts(self, start_day=None, end_day=None):
+        """日ごとのステータス別の部屋数。(最初の日数, 配列[日, コード]) を返す"""
+        np = self.np
+        a, b = self._columns(self.first_day if start_day is None else start_day,
+                             self.first_day + self.cells.shape[1] - 1 if end_day is None else end_day)
+        width = len(self.statuses)
+        block = self.cells[:, a:b].astype(np.intp) + width * np.arange(b - a)
+        counts = np.bincount(block.ravel(), minlength=width * (b - a)).reshape(b - a, width)
+        return self.first_day + a, counts
+
+    def stayover_mask(self, a=0, b=None):
+        """中日（C/I・C/O・空欄以外のステータス）のセルの真偽値の配列"""
+        np = self.np
+        block = self.cells[:, a:b]
+        stay_codes = [code for code, st in enumerate(self.statuses) if st and st not in ('C/I', 'C/O')]
+        return np.isin(block, stay_codes)
+
+    def flag_counts(self, flags, start_day=None, end_day=None):
+        """flags（部屋ごとの真偽値。ecodoor / ecoplan）が立っている部屋の、日ごとの中日の部屋数"""
+        a, b = self._columns(self.first_day if start_day is None else start_day,
+                             self.first_day + self.cells.shape[1] - 1 if end_day is None else end_day)
+        return (self.stayover_mask(a, b) & flags[:, None]).sum(axis=0)
+
+
+def _render_month_sheet(args):
+    """(年, 月, 行) から圧縮済みのシートを作る（ProcessPoolExecutor から呼ぶため関数にしている）"""
+    year, month, rows = args
+    return _deflate(_render_month_sheet_xml(year, month, rows))
+
+
+def _deflate(data):
+    """zip の ZIP_DEFLATED エントリとしてそのまま書ける形で圧縮する → (圧縮データ, CRC, 元のサイズ)"""
+    import zlib
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data)
+
+
+def _write_deflated_entry(dst, name, deflated, crc, size):
+    """_deflate で圧縮済みのデータを、再圧縮せずに zip へ書き込む"""
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o600 << 16
+    info.CRC = crc
+    info.compress_size = len(deflated)
+    info.file_size = size
+    try:
+        if size >= zipfile.ZIP64_LIMIT or len(deflated) >= zipfile.ZIP64_LIMIT:
+            raise ValueError("raw write unsupported")
+        _write_raw_zip_entry(dst, info, deflated)
+    except (AttributeError, ValueError, OSError, struct.error):
+        import zlib
+
+        dst.writestr(name, zlib.decompress(deflated, -15), zipfile.ZIP_DEFLATED)
+
+
+def _write_eco_workbook(path, sheets):
+    """sheets = [(シート名, (圧縮済みXML, CRC, サイズ)), ...] から xlsx を書き出す"""
+    sheet_entries = []
+    rels = []
+    overrides = []
+    for i, (title, _) in enumerate(sheets, start=1):
+        name = html.escape(title, quote=True)
+        sheet_entries.append(f'<sheet name="{name}" sheetId="{i}" r:id="rId{i}"/>')
+        rels.append(f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" '
+                    f'Type="{_REL_NS}/worksheet"/>')
+        overrides.append(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType='
+                         '"application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>')
+    styles_id = len(sheets) + 1
+    rels.append(f'<Relationship Id="rId{styles_id}" Target="styles.xml" Type="{_REL_NS}/styles"/>')
+
+    head = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    content_types = (
+        head + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        + "".join(overrides) + '</Types>')
+    root_rels = (head + f'<Relationships xmlns="{_PKG_REL_NS}">'
+                 f'<Relationship Id="rId1" Target="xl/workbook.xml" Type="{_REL_NS}/officeDocument"/>'
+                 '</Relationships>')
+    workbook = (head + f'<workbook xmlns="{_SHEET_NS}" xmlns:r="{_REL_NS}">'
+                '<bookViews><workbookView/></bookViews>'
+                f'<sheets>{"".join(sheet_entries)}</sheets></workbook>')
+    workbook_rels = head + f'<Relationships xmlns="{_PKG_REL_NS}">{"".join(rels)}</Relationships>'
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", content_types)
+        zf.writestr("_rels/.rels", root_rels)
+        zf.writestr("xl/workbook.xml", workbook)
+        zf.writestr("xl/_rels/workbook.xml.rels", workbook_rels)
+        zf.writestr("xl/styles.xml", _ECO_STYLES_XML)
+        for i, (_, (deflated, crc, size)) in enumerate(sheets, start=1):
+            _write_deflated_entry(zf, f"xl/worksheets/sheet{i}.xml", deflated, crc, size)
+
+
+# ------------------------------------------------------------
+# 予約CSVの高速読み込み
+#   チェーン全体の予約CSVは数百MBになるが、使うのは11列目（部屋番号）と
+#   12列目（名前＋プラン）だけなので、ファイルを mmap してバイト列のまま
+#   正規表現（C実装）で行を走査し、必要な列のバイト範囲だけをデコードする。
+#   cp932 / shift_jis の2バイト目には , " 改行 が現れないため、バイト単位で区切ってよい。
+#   使えない場合（mmap 不可など）や ECOROOM_CSV_FAST=0 のときは csv モジュールで読む。
+# ------------------------------------------------------------
+CSV_FAST_ENV = "ECOROOM_CSV_FAST"
+# mmap から一度に切り出して処理する大きさ（引用符の外の改行で区切る）
+CSV_SCAN_BLOCK = 8 * 1024 * 1024
+
+# 1フィールド: 引用符で始まらない , と改行を含まない並び、
+# "..."（"" はエスケープされた "。改行を含んでよい）、または空
+_CSV_FIELD = rb'(?:[^,"\r\n][^,\r\n]*|"[^"]*(?:""[^"]*)*"|)'
+# 必要な列より後ろの残り（列には分けず、引用符の中の改行だけ考慮して行末まで読み飛ばす）
+_CSV_REST = rb'([^"\n]*(?:"[^"]*"[^"\n]*)*\n)'
+
+
+@functools.lru_cache(maxsize=16)
+def _csv_row_regex(columns):
+    """columns（列番号のタプル）を取り出す1行分の正規表現。
+    findall で (列の値..., 行の残り) が返り、列数が足りない行は残りが空になる。"""
+    wanted = set(columns)
+    fields = [b"(" + _CSV_FIELD + b")" if i in wanted else _CSV_FIELD
+              for i in range(max(columns) + 1)]
+    full = b",".join(fields) + b"(?=[,\r\n])" + _CSV_REST
+    # 列数が足りない行も引用符の中の改行では区切らない（閉じていない引用符はブロックの最後まで）
+    return re.compile(full + rb'|[^"\n]*(?:"[^"]*"[^"\n]*)*(?:\n|"[^"]*\Z)')
+
+
+def _csv_safe_cut(block):
+    """block の中で、引用符の外にある最後の改行の直後の位置を返す（無ければ 0）。
+    block の先頭はレコードの先頭であること。"""
+    quotes = block.count(b'"')
+    cut = block.rfind(b"\n")
+    while cut >= 0:
+        tail = block.count(b'"', cut)
+        if (quotes - tail) % 2 == 0:
+            return cut + 1
+        quotes -= tail
+        block = block[:cut]
+        cut = block.rfind(b"\n")
+    return 0
+
+
+def _csv_unquote(value):
+    if value[:1] == '"':
+        return value[1:-1].replace('""', '"')
+    return value
+
+
+def scan_csv_columns(path, columns, encoding, start=0, end=None):
+    """CSV の指定列だけを (列の値, ...) のタプル（columns の順）で順に返すジェネレータ。
+    列数が足りない行は返さない。start / end はバイト位置（レコードの先頭であること）。
+    ファイルを mmap してブロックごとに正規表現の findall（C実装）で列を取り出し、
+    取り出した列のバイト列だけをまとめてデコードする。
+    mmap できないときや改行が \r だけのファイルは OSError / ValueError を送出する
+    （呼び出し側で csv モジュールの読み込みへ切り替える）。"""
+    import mmap
+
+    # 正規表現はファイル上の列順で取り出すので、指定順と違うときは並べ替えて返す
+    columns = tuple(columns)
+    ordered = tuple(sorted(set(columns)))
+    pattern = _csv_row_regex(ordered)
+    width = len(ordered)
+    pick = None if ordered == columns else [ordered.index(c) for c in columns]
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = size if end is None else end
+            if mm.find(b"\n", start, end) < 0 and mm.find(b"\r", start, end) >= 0:
+                raise ValueError("改行が CR のみのファイルには対応していません")
+            pos = start
+            while pos < end:
+                length = CSV_SCAN_BLOCK
+                while True:
+                    block = mm[pos:min(pos + length, end)]
+                    if pos + len(block) >= end:
+                        break
+                    cut = _csv_safe_cut(block)
+                    if cut:
+                        block = block[:cut]
+                        break
+                    # ブロックより長いレコード：次の安全な改行まで広げる
+                    length *= 2
+                pos += len(block)
+                if not block.endswith(b"\n"):
+                    block += b"\n"
+
+                raw = []
+                for row in pattern.findall(block):
+                    if row[-1]:
+                        raw.extend(row[:width])
+                if not raw:
+                    continue
+                joined = b"\x00".join(raw)
+                decoded = joined.decode(encoding).split("\x00")
+                if len(decoded) != len(raw):
+                    # 値そのものに NUL が含まれていた場合
+                    decoded = [value.decode(encoding) for value in raw]
+                if b'"' in joined:
+                    decoded = [_csv_unquote(value) for value in decoded]
+                rows = zip(*[iter(decoded)] * width)
+                if pick is None:
+                    yield from rows
+                else:
+                    for row in rows:
+                        yield tuple(row[i] for i in pick)
+
+
+def csv_chunk_bounds(path, parts):
+    """CSV をおおよそ parts 等分した (開始, 終了) バイト位置のリストを返す。
+    区切りは引用符の外にある改行の直後（レコードの先頭）に合わせる。
+    引用符の数の偶奇で、その改行が引用符の中かどうかを判定する。"""
+    import mmap
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+        if parts <= 1:
+            return [(0, size)]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            bounds = []
+            start = 0
+            for i in range(1, parts):
+                target = size * i // parts
+                if target <= start:
+                    continue
+                quotes = mm[start:target].count(b'"')
+                pos = target
+                cut = size
+                while True:
+                    newline = mm.find(b"\n", pos)
+                    if newline < 0:
+                        break
+                    quotes += mm[pos:newline + 1].count(b'"')
+                    pos = newline + 1
+                    if quotes % 2 == 0:
+                        cut = pos
+                        break
+                if cut >= size:
+                    break
+                bounds.append((start, cut))
+                start = cut
+            bounds.append((start, size))
+    return bounds
+
+
+# 予約CSVの同じ部屋の行が複数あるときにどれを採るか
+#   last : ファイルの後ろにある予約（既定）
+#   first: ファイルの前にある予約
+YOYAKU_MERGE_RULES = ('last', 'first')
+# 予約CSVがこれ以上の大きさのときは、分割して別プロセスで並行に読む
+CSV_PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+# 並行に読むプロセス数（None のときは CPU 数）
+CSV_PARSE_WORKERS = None
+
+
+def _merge_guest_rows(guest_map, rows, merge):
+    """(部屋番号, 宿泊者情報) の並びを merge の規則で guest_map に取り込む"""
+    if merge == 'first':
+        for room_number, entry in rows:
+            guest_map.setdefault(room_number, entry)
+    else:
+        guest_map.update(rows)
+    return guest_map
+
+
+def _parse_yoyaku_chunk(args):
+    """予約CSVの start〜end の範囲を読み、部屋番号→{'name', 'is_ecoplan', ...} を返す
+    （ProcessPoolExecutor から呼ぶため関数にしている）。
+    名前の正規化とエコプラン判定もここで行う。"""
+    path, start, end, encoding, columns, merge = args
+    entry = HotelCleaningSystem._guest_entry
+    rows = ((fields[0], entry(*fields[1:]))
+            for fields in scan_csv_columns(path, columns, encoding, start, end))
+    return _merge_guest_rows({}, rows, merge)
+
+
+# アーニング表の一括出力: これ以上の日数のときは別プロセスで並行に書き出す
+EARNING_BATCH_MIN_DAYS = 4
+# 並行に書き出すプロセス数（None のときは CPU 数）
+EARNING_BATCH_WORKERS = None
+# 一括出力の各プロセスで使う準備済みの内容（テンプレート・区分表など）
+_earning_batch_context = None
+
+
+def _init_earning_batch(context):
+    """一括出力の別プロセスの初期化（準備済みの内容をプロセスごとに1回だけ受け取る）"""
+    global _earning_batch_context
+    _earning_batch_context = context
+
+
+def _earning_batch_job(args):
+    """1日分のアーニング表を書き出す → (CSVのパス, 結果 or None, エラーメッセージ or None)
+    （ProcessPoolExecutor から呼ぶため関数にしている）"""
+    csv_path, output_path = args
+    try:
+        room_status, file_date = HotelCleaningSystem._read_earning_csv(csv_path)
+        return csv_path, HotelCleaningSystem._write_earning(
+            _earning_batch_context, room_status, file_date, output_path), None
+    except EarningExportError as e:
+        return csv_path, None, str(e)
+    except Exception as e:
+        return csv_path, None, f"{type(e).__name__}: {e}"
+
+
+_CSV_DATE_FORMATS = ('%Y%m%d', '%Y/%m/%d', '%Y-%m-%d')
+
+
+def _parse_csv_date(text):
+    """CSV の日付（20261019 / 2026/10/19 / 2026-10-19、時刻付きも可）を datetime にする。
+    読めないときは None"""
+    text = (text or '').strip().split(' ')[0]
+    for fmt in _CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+# ------------------------------------------------------------
+# DB接続の管理
+#   書き込みは専用スレッドが持つ1本の接続に集約し、キューで順番に実行する。
+#   参照は WAL モードの読み取り専用接続のプールから借りて並行に実行する。
+#   これにより、エクスポートや一覧表示が編集と同時に走っても
+#   "database is locked" にならない。
+# ------------------------------------------------------------
+DB_READ_POOL_SIZE = 3
+DB_BUSY_TIMEOUT = 10
+
+# スキーマの版（PRAGMA user_version）。
+#   1: cleaning_schedule.cleaning_date を 'YYYY-MM-DD' 文字列から
+#      1970-01-01 からの日数（整数）に変更し、日付範囲用の索引を追加
+#   2: 整理で削除した部屋の履歴（rooms_history / cleaning_schedule_history）と
+#      日別集計（daily_stats）を追加
+#   3: エコ票の月別シートのキャッシュ（sheet_cache）と、変更された月に印を付けるトリガを追加
+#   4: 履歴を archive_id で引く索引を追加（操作ジャーナルからの復元で履歴を出し入れするため）
+#   5: DB に反映済みの操作ジャーナルの通し番号（journal_state）を追加
+SCHEMA_VERSION = 5
+
+# sheet_cache の period（年*100+月）を cleaning_date（日数）から求める SQL 式
+_PERIOD_SQL = "CAST(strftime('%Y%m', {} * 86400, 'unixepoch') AS INTEGER)"
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def _day_number(d):
+    """日付（datetime / date）を DB 保存用の日数（1970-01-01 起点）にする"""
+    return d.toordinal() - _EPOCH_ORDINAL
+
+
+def _from_day_number(n):
+    """DB の日数を datetime に戻す"""
+    return datetime.fromordinal(n + _EPOCH_ORDINAL)
+
+
+@functools.lru_cache(maxsize=4096)
+def _day_label(n):
+    """DB の日数を画面・エコ票で使う "M/D" 表記にする"""
+    d = datetime.fromordinal(n + _EPOCH_ORDINAL)
+    return f"{d.month}/{d.day}"
+
+
+class _WriteRequest:
+    """書き込みキューに積む1件分の処理と、その結果の受け渡し"""
+
+    def __init__(self, func):
+        self.func = func
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ConnectionManager:
+    """SQLite の書き込み用接続1本と、読み取り専用接続のプールを管理する。
+
+    write(func): func(conn) を書き込みスレッドで実行し、成功すれば commit、
+                 例外なら rollback して呼び出し元に例外を投げ直す。
+    read(func) : プールから借りた読み取り専用接続で func(conn) を実行する。
+    """
+
+    def __init__(self, db_file, setup=None, read_pool_size=DB_READ_POOL_SIZE):
+        self.db_file = db_file
+        self.read_pool_size = read_pool_size
+        self._trace_callback = None
+        self._queue = queue.Queue()
+        self._readers = queue.LifoQueue()
+        self._all_readers = []
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+        ready = _WriteRequest(setup)
+        self._thread = threading.Thread(target=self._writer_loop, args=(ready,),
+                                        name="ecoroom-db-writer", daemon=True)
+        self._thread.start()
+        ready.done.wait()
+        if ready.error is not None:
+            raise ready.error
+
+    # --- 書き込み ---
+    def _writer_loop(self, ready):
+        try:
+            conn = sqlite3.connect(self.db_file, timeout=DB_BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if ready.func is not None:
+                ready.func(conn)
+                conn.commit()
+        except Exception as e:
+            ready.error = e
+            ready.done.set()
+            return
+        self._conn = conn
+        ready.done.set()
+
+        while True:
+            request = self._queue.get()
+            if request is None:
+                break
+            try:
+                request.result = request.func(conn)
+                conn.commit()
+            except BaseException as e:
+                conn.rollback()
+                request.error = e
+            request.done.set()
+        conn.close()
+
+    def write(self, func):
+        """func(conn) を書き込みスレッドで実行して結果を返す（1件ずつ直列に実行）"""
+        if threading.current_thread() is self._thread:
+            # 書き込み処理の中からの呼び出しは、同じトランザクションでそのまま実行する
+            return func(self._conn)
+        if self._closed:
+            raise sqlite3.ProgrammingError("データベース接続は閉じられています")
+        request = _WriteRequest(func)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    # --- 参照 ---
+    def _open_reader(self):
+        """プールに空きが無ければ上限まで新しい読み取り接続を開く（上限なら None）"""
+        with self._readers_lock:
+            if len(self._all_readers) >= self.read_pool_size:
+                return None
+            conn = self.open_readonly(self.db_file, check_same_thread=False)
+            conn.set_trace_callback(self._trace_callback)
+            self._all_readers.append(conn)
+            return conn
+
+    def read(self, func):
+        """読み取り専用接続を1本借りて func(conn) を実行する"""
+        if threading.current_thread() is self._thread:
+            # 書き込み中の処理からは、未コミットの変更が見える書き込み用接続で読む
+            return func(self._conn)
+        if self._closed:
+            raise sqlite3.ProgrammingError("データベース接続は閉じられています")
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._open_reader() or self._readers.get()
+        try:
+            return func(conn)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @staticmethod
+    def open_readonly(path, check_same_thread=True):
+        """読み取り専用で開く（バックアップの確認などで、誤ってファイルを作らないように）"""
+        uri = "file:" + os.path.abspath(path).replace("\\", "/") + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT,
+                               check_same_thread=check_same_thread)
+
+    # --- その他 ---
+    def set_trace_callback(self, callback):
+        """全ての接続に SQL トレースのコールバックを設定する"""
+        self._trace_callback = callback
+        self.write(lambda conn: conn.set_trace_callback(callback))
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.set_trace_callback(callback)
+
+    def backup_to(self, path):
+        """WAL の内容も含めた整合の取れたコピーを path に作る"""
+        def copy(conn):
+            dst = sqlite3.connect(path)
+            try:
+                conn.backup(dst)
+                # バックアップは単体ファイルで扱えるよう通常のジャーナルに戻す
+                dst.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                dst.close()
+        self.write(copy)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # 書き込み用接続を最後に閉じる（最後の接続が WAL を本体に書き戻して片付ける）
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers.clear()
+        self._queue.put(None)
+        self._thread.join()
+
+
+# ------------------------------------------------------------
+# 変更の単位（Unit of Work）
+#   部屋の登録・編集・削除・ステータス変更は UnitOfWork を通して DB に書き、
+#   変わった行を (変更前, 変更後) の差分として覚えておく。
+#   コミット後にその差分だけをメモリ上のモデル（records / existing_rooms）へ反映し、
+#   変更通知を受ける側（画面の更新など）にも差分を渡す。
+# ------------------------------------------------------------
+class UnitOfWork:
+    """1回の操作で変わった行の差分。書き込みスレッドのトランザクション内で使う。
+
+    rooms   : {部屋番号: (変更前, 変更後)}  行は (氏名, C/I日, 泊数, エコドア, エコプラン)、無ければ None
+    schedule: {(部屋番号, 日数): (変更前, 変更後)}  ステータス、無ければ None
+    meta    : 行の差分以外の情報（履歴テーブルに入れた行 'archived' / 消した行 'unarchived' など）
+    どちらも最初に触ったときの内容を「変更前」として残す。
+    """
+
+    def __init__(self, cursor, op):
+        self.cursor = cursor
+        self.op = op
+        self.rooms = {}
+        self.schedule = {}
+        self.meta = {}
+        # 操作ジャーナルに書いたときの通し番号
+        self.seq = None
+
+    @staticmethod
+    def merge_history(meta, key, rows):
+        """履歴の行 {'rooms': [...], 'schedule': [...]} を meta[key] に追加する"""
+        if rows['rooms'] or rows['schedule']:
+            merged = meta.setdefault(key, {'rooms': [], 'schedule': []})
+            merged['rooms'] += rows['rooms']
+            merged['schedule'] += rows['schedule']
+
+    @staticmethod
+    def room_row(record):
+        """メモリ上のレコードを rooms テーブルの行（部屋番号を除く）にする"""
+        return (record['guest'], record['date'].strftime('%Y-%m-%d'), int(record['days']),
+                int(bool(record['ecodoor'])), int(bool(record['ecoplan'])))
+
+    def _load_rooms(self, room_numbers):
+        """{部屋番号: (行, {日数: ステータス})} を DB から読む"""
+        room_numbers = list(room_numbers)
+        loaded = {room: (None, {}) for room in room_numbers}
+        for i in range(0, len(room_numbers), 500):
+            chunk = room_numbers[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for room, *row in self.cursor.execute(
+                    "SELECT room_number, guest_name, check_in_date, cleaning_days, is_ecodoor, is_ecoplan"
+                    f" FROM rooms WHERE room_number IN ({placeholders})", chunk):
+                loaded[room] = (tuple(row[:3]) + (int(bool(row[3])), int(bool(row[4]))), loaded[room][1])
+            for room, day, status in self.cursor.execute(
+                    "SELECT room_number, cleaning_date, cleaning_status FROM cleaning_schedule"
+                    f" WHERE room_number IN ({placeholders})", chunk):
+                loaded[room][1][day] = status
+        return loaded
+
+    def _note_room(self, room, old, new):
+        if room in self.rooms:
+            old = self.rooms[room][0]
+        self.rooms[room] = (old, new)
+
+    def _write_room_row(self, room, row):
+        if row is None:
+            self.cursor.execute("DELETE FROM rooms WHERE room_number = ?", (room,))
+        else:
+            self.cursor.execute("INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?, ?, ?)", (room,) + tuple(row))
+
+    def change_cells(self, cells):
+        """[(部屋番号, 日数, 変更前, 変更後)] のステータスを書き換える（None は行が無い）"""
+        inserts, updates, deletes = [], [], []
+        for room, day, old, new in cells:
+            if old == new:
+                continue
+            if old is None:
+                inserts.append((room, day, new))
+            elif new is None:
+                deletes.append((room, day))
+            else:
+                updates.append((new, room, day))
+            key = (room, day)
+            if key in self.schedule:
+                old = self.schedule[key][0]
+            self.schedule[key] = (old, new)
+        if deletes:
+            self.cursor.executemany(
+                "DELETE FROM cleaning_schedule WHERE room_number = ? AND cleaning_date = ?", deletes)
+        if updates:
+            self.cursor.executemany(
+                "UPDATE cleaning_schedule SET cleaning_status = ? WHERE room_number = ? AND cleaning_date = ?",
+                updates)
+        if inserts:
+            self.cursor.executemany("INSERT INTO cleaning_schedule VALUES (?, ?, ?)", inserts)
+
+    def put_room(self, record, schedule_rows):
+        """部屋情報を保存し、スケジュールを schedule_rows（[(日付, ステータス)]）で置き換える。
+        変わった日の行だけを書き換える。"""
+        room = record['room']
+        old_row, old_schedule = self._load_rooms([room])[room]
+        new_row = self.room_row(record)
+        new_schedule = {_day_number(d): status for d, status in schedule_rows}
+        if new_row != old_row:
+            self._write_room_row(room, new_row)
+            self._note_room(room, old_row, new_row)
+        self.change_cells([(room, day, old_schedule.get(day), new_schedule.get(day))
+                           for day in old_schedule.keys() | new_schedule.keys()])
+
+    def delete_rooms(self, room_numbers):
+        """部屋とそのスケジュールを削除する。削除した部屋数を返す"""
+        deleted = 0
+        for room, (row, schedule) in self._load_rooms(room_numbers).items():
+            if row is None and not schedule:
+                continue
+            if row is not None:
+                self._write_room_row(room, None)
+                self._note_room(room, row, None)
+                deleted += 1
+            self.change_cells([(room, day, status, None) for day, status in schedule.items()])
+        return deleted
+
+    def restore(self, rooms, cells):
+        """rooms {部屋番号: 行 or None} と cells {(部屋番号, 日数): ステータス or None} の状態にする
+        （ジャーナルの変更前・変更後の内容を書き戻すときに使う）"""
+        current = self._load_rooms(set(rooms) | {room for room, _ in cells})
+        for room, row in rooms.items():
+            old = current[room][0]
+            if old != row:
+                self._write_room_row(room, row)
+                self._note_room(room, old, row)
+        self.change_cells([(room, day, current[room][1].get(day), status)
+                           for (room, day), status in cells.items()])
+
+    def matches(self, rooms, cells):
+        """DB の今の内容が rooms / cells（restore と同じ形）と一致するか"""
+        current = self._load_rooms(set(rooms) | {room for room, _ in cells})
+        return (all(current[room][0] == row for room, row in rooms.items())
+                and all(current[room][1].get(day) == status for (room, day), status in cells.items()))
+
+    def to_entry(self):
+        """操作ジャーナルに書く形（JSON にできる dict）"""
+        rooms, schedule = self.changed()
+        entry = {
+            'op': self.op,
+            'rooms': [[room, old, new] for room, (old, new) in rooms.items()],
+            'cells': [[room, day, old, new] for (room, day), (old, new) in schedule.items()],
+        }
+        if self.meta:
+            entry['meta'] = self.meta
+        return entry
+
+    def changed(self):
+        """実際に変わった行だけを残した (rooms, schedule)"""
+        rooms = {room: diff for room, diff in self.rooms.items() if diff[0] != diff[1]}
+        schedule = {key: diff for key, diff in self.schedule.items() if diff[0] != diff[1]}
+        return rooms, schedule
+
+    def __bool__(self):
+        rooms, schedule = self.changed()
+        return bool(rooms or schedule or self.meta)
+
+
+# ------------------------------------------------------------
+# 整合性チェック
+#   書き込みのたびに、変わった部屋だけを裏のスレッドで検査する（起動時は全件）。
+#   検査は読み取り専用接続で、idx_schedule_room（部屋番号, 日付, ステータス）と
+#   rooms の主キーだけを使う SQL で行うので、DB が大きくても書き込みを妨げない。
+# ------------------------------------------------------------
+INTEGRITY_ENV = "ECOROOM_INTEGRITY"
+# 検査の種類と表示名
+INTEGRITY_KINDS = {
+    'duplicate': "同じ日の重複",
+    'unknown_status': "不明なステータス",
+    'orphan': "部屋の無いスケジュール",
+    'no_schedule': "スケジュールの無い部屋",
+    'gap': "日付の抜け",
+    'span': "泊数と日程の不一致",
+    'checkout_before_checkin': "C/Iより前のC/O",
+}
+
+
+class IntegrityChecker:
+    """部屋・清掃スケジュールの整合性を裏のスレッドで検査する。
+
+    schedule(rooms) で検査対象の部屋（None は全件）を積むと、溜まった分をまとめて
+    検査し、その部屋の結果だけを入れ替える。結果が変わるたびに
+    on_report(問題のリスト) を検査スレッドから呼ぶ。
+    問題は {'kind', 'room', 'day'（日数 or None）, 'detail'} の dict。"""
+
+    def __init__(self, db, on_report=None):
+        self.db = db
+        self.on_report = on_report
+        self._issues = {}         # {部屋番号: [問題, ...]}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = threading.Thread(target=self._run, name="ecoroom-integrity", daemon=True)
+        self._thread.start()
+
+    def schedule(self, rooms=None):
+        """rooms（部屋番号の集合。None は全件）の検査を依頼する"""
+        self._idle.clear()
+        self._queue.put(set(rooms) if rooms is not None else None)
+
+    def issues(self):
+        """現在の問題の一覧（部屋番号・日付順）"""
+        with self._lock:
+            found = [issue for issues in self._issues.values() for issue in issues]
+        return sorted(found, key=lambda i: (HotelCleaningSystem._room_sort_key(i['room']), i['room'],
+                                            i['day'] if i['day'] is not None else -1, i['kind']))
+
+    def wait(self, timeout=None):
+        """依頼済みの検査が終わるまで待つ（終わっていれば True）"""
+        return self._idle.wait(timeout)
+
+    def close(self):
+        self._queue.put(False)
+        self._thread.join(5)
+
+    def _run(self):
+        while True:
+            rooms = self._queue.get()
+            if rooms is False:
+                return
+            # 溜まっている依頼はまとめて1回で検査する
+            stop = False
+            while True:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is False:
+                    stop = True
+                    break
+                rooms = None if rooms is None or more is None else rooms | more
+            try:
+                if rooms is None or rooms:
+                    self._check(rooms)
+            except sqlite3.ProgrammingError:
+                pass   # DB が閉じられている（復元中など。開き直したときに全件を検査し直す）
+            except Exception as e:
+                _tracer.event("integrity", error=f"{type(e).__name__}: {e}")
+            finally:
+                if self._queue.empty():
+                    self._idle.set()
+            if stop:
+                return
+
+    def _check(self, rooms):
+        with _tracer.span("integrity_check", rooms="all" if rooms is None else len(rooms)) as span:
+            found = self.db.read(lambda conn: self.find_issues(conn, rooms))
+            by_room = {}
+            for issue in found:
+                by_room.setdefault(issue['room'], []).append(issue)
+            with self._lock:
+                before = self._issues
+                if rooms is None:
+                    self._issues = by_room
+                else:
+                    self._issues = {room: issues for room, issues in before.items() if room not in rooms}
+                    self._issues.update(by_room)
+                changed = self._issues != before
+            span.set(issues=len(found), changed=changed)
+        # 全件の検査は変化が無くても知らせる（再検査の完了を表示するため）
+        if (changed or rooms is None) and self.on_report is not None:
+            self.on_report(self.issues())
+
+    @staticmethod
+    def find_issues(conn, rooms=None):
+        """rooms（None は全件）の問題を SQL で探してリストで返す"""
+        issues = []
+
+        def add(kind, room, day, detail):
+            issues.append({'kind': kind, 'room': room, 'day': day, 'detail': detail})
+
+        known = ','.join('?' * len(SCHEDULE_STATUSES))
+        if rooms is None:
+            chunks = [None]
+        else:
+            rooms = sorted(rooms)
+            chunks = [rooms[i:i + 500] for i in range(0, len(rooms), 500)]
+        for chunk in chunks:
+            params = list(chunk or ())
+
+            def where(keyword, column="room_number"):
+                """部屋を絞り込む条件（全件のときは空）"""
+                return f" {keyword} {column} IN ({','.join('?' * len(chunk))})" if chunk else ""
+
+            # 同じ部屋・同じ日の行が複数ある（cleaning_schedule に一意の制約が無いため）
+            for room, day, count, statuses in conn.execute(
+                    "SELECT room_number, cleaning_date, COUNT(*), group_concat(cleaning_status, '・')"
+                    " FROM cleaning_schedule" + where("WHERE") + " GROUP BY room_number, cleaning_date"
+                    " HAVING COUNT(*) > 1", params):
+                add('duplicate', room, day, f"{_day_label(day)} が{count}行あります（{statuses}）")
+
+            # 規定外のステータス（空白・NULL は起動時の整理で部屋ごと削除される）
+            for room, day, status in conn.execute(
+                    "SELECT room_number, cleaning_date, cleaning_status FROM cleaning_schedule"
+                    f" WHERE (cleaning_status IS NULL OR cleaning_status NOT IN ({known}))" + where("AND"),
+                    list(SCHEDULE_STATUSES) + params):
+                if status is None or status == "":
+                    add('unknown_status', room, day,
+                        f"{_day_label(day)} のステータスが空白です（整理で部屋ごと削除されます）")
+                else:
+                    add('unknown_status', room, day, f"{_day_label(day)} のステータス「{status}」は規定外です")
+
+            # 部屋ごとの日程（最初・最後の日、日数、C/I・C/O の日）と rooms の登録内容の突き合わせ
+            gap_rooms = []
+            for (room, first, last, days, last_ci, first_co,
+                 registered, check_in, nights) in conn.execute(
+                    "SELECT s.room_number, s.first, s.last, s.days, s.last_ci, s.first_co,"
+                    " r.room_number IS NOT NULL, CAST(julianday(r.check_in_date) - 2440587.5 AS INTEGER),"
+                    " r.cleaning_days"
+                    " FROM (SELECT room_number, MIN(cleaning_date) AS first, MAX(cleaning_date) AS last,"
+                    "        COUNT(DISTINCT cleaning_date) AS days,"
+                    "        MAX(CASE WHEN cleaning_status = 'C/I' THEN cleaning_date END) AS last_ci,"
+                    "        MIN(CASE WHEN cleaning_status = 'C/O' THEN cleaning_date END) AS first_co"
+                    "       FROM cleaning_schedule" + where("WHERE") + " GROUP BY room_number) s"
+                    " LEFT JOIN rooms r ON r.room_number = s.room_number", params):
+                if not registered:
+                    add('orphan', room, first,
+                        f"rooms に無い部屋のスケジュールが{days}日分あります"
+                        f"（{_day_label(first)}〜{_day_label(last)}）")
+                if days < last - first + 1:
+                    gap_rooms.append(room)
+                if last_ci is not None and first_co is not None and first_co < last_ci:
+                    add('checkout_before_checkin', room, first_co,
+                        f"C/O（{_day_label(first_co)}）が C/I（{_day_label(last_ci)}）より前です")
+                if registered and check_in is not None and nights is not None \
+                        and (first != check_in or last != check_in + int(nights)):
+                    add('span', room, first,
+                        f"C/I日 {_day_label(check_in)}・{nights}泊に対し、"
+                        f"スケジュールは {_day_label(first)}〜{_day_label(last)} です")
+
+            # 日付の抜け（翌日の行が無い日と、その次にある日）
+            for i in range(0, len(gap_rooms), 500):
+                part = gap_rooms[i:i + 500]
+                for room, day, following in conn.execute(
+                        "SELECT room_number, cleaning_date, following FROM ("
+                        " SELECT s.room_number, s.cleaning_date,"
+                        "  (SELECT MIN(t.cleaning_date) FROM cleaning_schedule t"
+                        "   WHERE t.room_number = s.room_number AND t.cleaning_date > s.cleaning_date) AS following"
+                        " FROM cleaning_schedule s"
+                        f" WHERE s.room_number IN ({','.join('?' * len(part))})"
+                        "  AND NOT EXISTS (SELECT 1 FROM cleaning_schedule t"
+                        "   WHERE t.room_number = s.room_number AND t.cleaning_date = s.cleaning_date + 1))"
+                        " WHERE following IS NOT NULL", part):
+                    missing = following - day - 1
+                    add('gap', room, day + 1,
+                        f"{_day_label(day + 1)}" + (f"〜{_day_label(following - 1)}" if missing > 1 else "")
+                        + f" のスケジュールがありません（{missing}日）")
+
+            # スケジュールが1日も無い部屋（起動時の整理で削除される）
+            for (room,) in conn.execute(
+                    "SELECT r.room_number FROM rooms r WHERE NOT EXISTS"
+                    " (SELECT 1 FROM cleaning_schedule s WHERE s.room_number = r.room_number)"
+                    + where("AND", "r.room_number"), params):
+                add('no_schedule', room, None, "スケジュールがありません（整理で削除されます）")
+        return issues
+
+
+# ------------------------------------------------------------
+# 操作ジャーナル
+#   DB への変更（UnitOfWork の差分）と、まだ保存していない新規登録を
+#   1行1操作の JSON で追記し、操作ごとに fsync する。
+#   DB の変更はコミットの前に書く（write-ahead）ので、次回起動時に
+#   コミットされていなかった操作をやり直せる。差分には変更前の内容も
+#   あるため、任意の操作の直後の状態まで戻すこともできる。
+# ------------------------------------------------------------
+JOURNAL_ENV = "ECOROOM_JOURNAL"
+JOURNAL_SUFFIX = ".journal.jsonl"
+# 起動時にこれより大きければ .1 に回して新しいファイルにする（戻せるのは今のファイルの範囲）
+JOURNAL_MAX_BYTES = 16 * 1024 * 1024
+# これより前には戻れない区切り（DB 全体の入れ替え）と、起動時のやり直しの起点
+JOURNAL_BARRIERS = ('restore',)
+JOURNAL_CHECKPOINTS = ('checkpoint', 'restore')
+# 元に戻せる操作と、戻せる回数
+UNDO_OPS = ('register', 'edit', 'delete', 'bulk', 'cleanup')
+UNDO_DEPTH = 50
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+class OperationJournal:
+    """追記専用の操作ジャーナル。同じファイルはプロセス内で1つのインスタンスを共有する。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self.seq = self._last_seq()
+
+    @classmethod
+    def for_db(cls, db_file):
+        path = os.path.splitext(os.path.abspath(db_file))[0] + JOURNAL_SUFFIX
+        with _journals_lock:
+            journal = _journals.get(path)
+            if journal is None:
+                journal = _journals[path] = cls(path)
+            return journal
+
+    def _last_seq(self):
+        """ファイル末尾の完全な行から最後の通し番号を読む（書きかけの行は無視する）"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            chunk = 64 * 1024
+            while True:
+                f.seek(max(0, size - chunk))
+                lines = f.read().splitlines()
+                for line in reversed(lines[1:] if size > chunk else lines):
+                    try:
+                        return int(json.loads(line)['seq'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                if chunk >= size:
+                    return 0
+                chunk *= 4
+
+    def append(self, entry):
+        """1操作を追記して fsync し、通し番号を返す"""
+        with self._lock:
+            self.seq += 1
+            entry = dict(entry, seq=self.seq, ts=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            data = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n").encode("utf-8")
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._fd, data)
+            getattr(os, 'fdatasync', os.fsync)(self._fd)
+            return self.seq
+
+    def advance(self, seq):
+        """通し番号を seq 以上にする（ジャーナルを消したり回したりしても DB の記録と重ならないように）"""
+        with self._lock:
+            self.seq = max(self.seq, seq)
+
+    def entries(self):
+        """全ての操作を順に返す。最後の DB 全体の入れ替え（restore）より前は含めない"""
+        entries = []
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 書きかけで終わった行
+                        continue
+                    if entry.get('op') in JOURNAL_BARRIERS:
+                        entries = []
+                    entries.append(entry)
+        return entries
+
+    def checkpoint(self):
+        """起動時のやり直しの起点を書く。大きくなっていればファイルを回し、
+        未保存の新規登録（最後の pending）は新しいファイルへ引き継ぐ。"""
+        with self._lock:
+            rotate = os.path.exists(self.path) and os.path.getsize(self.path) > JOURNAL_MAX_BYTES
+        pending = None
+        if rotate:
+            pending = next((e for e in reversed(self.entries()) if e.get('op') == 'pending'), None)
+            with self._lock:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                os.replace(self.path, self.path + ".1")
+        seq = self.append({'op': 'checkpoint'})
+        if pending and pending.get('records'):
+            self.append({'op': 'pending', 'records': pending['records']})
+        return seq
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+# ---------------------------------------------------------------------------
+# 列指向エクスポート（分析用）
+# ---------------------------------------------------------------------------
+
+# DB から一度に読み込んで書き出す行数（メモリ使用量の上限を決める）
+COLUMNAR_CHUNK_ROWS = 65536
+COLUMNAR_FORMATS = ('parquet', 'npz', 'csv')
+# 形式ごとに必要なモジュール（無ければ次の形式を使う）
+_COLUMNAR_MODULES = {'parquet': 'pyarrow.parquet', 'npz': 'numpy'}
+
+
+def _columnar_format(fmt=None):
+    """fmt の指定が無ければ pyarrow があれば parquet、NumPy があれば npz、どちらも無ければ csv"""
+    if fmt:
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"形式は {COLUMNAR_FORMATS} のいずれかです: {fmt}")
+        module = _COLUMNAR_MODULES.get(fmt)
+        if module:
+            try:
+                __import__(module)
+            except ImportError:
+                raise ValueError(f"{fmt} 形式で書き出すには {module.split('.')[0]} が必要です")
+        return fmt
+    for name, module in _COLUMNAR_MODULES.items():
+        try:
+            __import__(module)
+            return name
+        except ImportError:
+            continue
+    return 'csv'
+
+
+class _ParquetSink:
+    """Parquet（pyarrow）へ行のかたまりごとに書き足す。日付は date32"""
+
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        types = {'str': pa.string(), 'int': pa.int32(), 'day': pa.date32(), 'bool': pa.bool_()}
+        self.columns = columns
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        pa = self._pa
+        arrays = []
+        for (name, kind), values in zip(self.columns, zip(*rows)):
+            if kind == 'day':
+                arrays.append(pa.array(values, type=pa.int32()).cast(pa.date32()))
+            elif kind == 'bool':
+                # SQLite は真偽値を 0/1 の整数で返すため、そのままでは bool 列にできない
+                arrays.append(pa.array([None if v is None else bool(v) for v in values], type=pa.bool_()))
+            else:
+                arrays.append(pa.array(values, type=self.schema.field(name).type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class _NpzSink:
+    """NumPy の .npz へ書き出す。列ごとに一時ファイルへ書き足し、最後に1つの zip にまとめる。
+    文字列の列は uint32 のコード（<列名>.npy）と値の一覧（<列名>_values.npy）、
+    日付は 1970-01-01 からの日数（int32）、欠損は -1 で表す。"""
+
+    DTYPES = {'str': 'uint32', 'int': 'int32', 'day': 'int32', 'bool': 'bool'}
+
+    def __init__(self, path, columns):
+        import tempfile
+        import numpy as np
+
+        self._np = np
+        self.path = path
+        self.columns = columns
+        self.count = 0
+        self._tmp = tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path)))
+        self._files = {name: open(os.path.join(self._tmp.name, name), 'wb') for name, _ in columns}
+        self._codes = {name: {} for name, kind in columns if kind == 'str'}
+
+    def write(self, rows):
+        np = self._np
+        for (name, kind), values in zip(self.columns, zip(*rows)):
+            if kind == 'str':
+                codes = self._codes[name]
+                array = np.fromiter((codes.setdefault('' if v is None else v, len(codes)) for v in values),
+                                    dtype=np.uint32, count=len(values))
+            elif kind == 'bool':
+                array = np.fromiter((bool(v) for v in values), dtype=bool, count=len(values))
+            else:
+                array = np.fromiter((-1 if v is None else v for v in values), dtype=np.int32, count=len(values))
+            self._files[name].write(array.tobytes())
+        self.count += len(rows)
+
+    def close(self):
+        np = self._np
+        fmt = np.lib.format
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                for name, kind in self.columns:
+                    self._files[name].close()
+                    dtype = np.dtype(self.DTYPES[kind])
+                    with zf.open(f"{name}.npy", 'w', force_zip64=True) as out:
+                        fmt.write_array_header_1_0(out, {'descr': fmt.dtype_to_descr(dtype),
+                                                         'fortran_order': False, 'shape': (self.count,)})
+                        with open(os.path.join(self._tmp.name, name), 'rb') as f:
+                            shutil.copyfileobj(f, out, 1024 * 1024)
+                    if kind == 'str':
+                        with zf.open(f"{name}_values.npy", 'w') as out:
+                            fmt.write_array(out, np.array(list(self._codes[name]), dtype=str))
+        finally:
+            self._tmp.cleanup()
+
+
+class _CsvSink:
+    """pyarrow も NumPy も無いとき用の UTF-8 CSV（日付は YYYY-MM-DD）"""
+
+    def __init__(self, path, columns):
+        import csv
+
+        self.columns = columns
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in columns])
+        self._days = [i for i, (_, kind) in enumerate(columns) if kind == 'day']
+
+    def write(self, rows):
+        if self._days:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i in self._days:
+                    if row[i] is not None:
+                        row[i] = _from_day_number(row[i]).strftime('%Y-%m-%d')
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+_COLUMNAR_SINKS = {'parquet': (_ParquetSink, ".parquet"), 'npz': (_NpzSink, ".npz"), 'csv': (_CsvSink, ".csv")}
+
+
+class FileLauncher:
+    """ファイルを既定のアプリで開く処理と、書き出し処理のキュー。
+
+    書き出し（submit）は1本のワーカースレッドで登録順に実行する。開く処理（open）は
+    Popen で起動するだけで、アプリの終了は別スレッドで待つ。完了時の
+    callback(result, error) は dispatch(func, *args) を通して呼ぶ
+    （画面があるときは Tk のスレッドで呼ばれるようにするため）。"""
+
+    def __init__(self, dispatch=None):
+        self.dispatch = dispatch or (lambda func, *args: func(*args))
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    @staticmethod
+    def opener_command(path):
+        if platform.system() == "Darwin":
+            return ("open", path)
+        return ("xdg-open", path)
+
+    def open(self, path, callback=None):
+        """path を既定のアプリで開く（待たない）。callback(終了コード, error)"""
+        try:
+            if platform.system() == "Windows":
+                # startfile は元から起動を待たない
+                os.startfile(path)
+                self._done(callback, 0, None)
+                return
+            import subprocess
+
+            process = subprocess.Popen(self.opener_command(path), stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                       start_new_session=True)
+        except Exception as e:
+            self._done(callback, None, e)
+            return
+        threading.Thread(target=self._wait, args=(process, path, callback),
+                         name="ecoroom-open", daemon=True).start()
+
+    def _wait(self, process, path, callback):
+        returncode = process.wait()
+        error = None if returncode == 0 else OSError(f"{os.path.basename(path)} を開くコマンドが失敗しました（終了コード {returncode}）")
+        self._done(callback, returncode, error)
+
+    def submit(self, job, callback=None):
+        """job() を書き出しキューに入れる。終わったら callback(戻り値, error)"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_jobs, name="ecoroom-export", daemon=True)
+                self._worker.start()
+        self._jobs.put((job, callback))
+
+    def _run_jobs(self):
+        while True:
+            job, callback = self._jobs.get()
+            result = error = None
+            try:
+                result = job()
+            except Exception as e:
+                error = e
+            self._done(callback, result, error)
+            self._jobs.task_done()
+
+    def join(self):
+        """キューに入っている書き出しが全て終わるまで待つ（ヘッドレスでの一括処理用）"""
+        self._jobs.join()
+
+    def _done(self, callback, result, error):
+        if callback is not None:
+            self.dispatch(callback, result, error)
+        elif error is not None:
+            _tracer.event("launcher", error=f"{type(error).__name__}: {error}")
+
+
+class HotelCleaningSystem:
+    def __init__(self, headless=False, db_file=None):
+        """headless=True のときは画面を作らず、DBだけを開いた状態で使う
+        （サービスモードや一括処理からエンジンとして利用するため）。"""
+        self.headless = headless
+        self.db_file = db_file or "hotel_cleaning.db"
         self.excel_file = "hotel_cleaning_now.xlsx"
         self.backup_prefix = "hotel_cleaning_backup_"
         self.records = []
         self.existing_rooms = set()
+        # records / existing_rooms を DB から読み込み済みか（ヘッドレス時は読み込まない）
+        self._model_loaded = False
+        # 変更通知を受け取る関数 listener(uow)。uow が None のときはモデル全体の読み直し
+        self.change_listeners = []
+        # 元に戻す／やり直すための操作の差分（UnitOfWork.to_entry() の形。新しいものが末尾）
+        self.undo_stack = []
+        self.redo_stack = []
+        # エコ票の分割（None: 1冊にまとめる / 'quarter': 四半期ごとに別ブック）
+        self.excel_split = None
         # 直前のCSV読込で使った部屋状態CSVのパス（エコ票作成→アーニング表出力の再利用用）
         self.last_room_status_csv = None
 
+        # プロファイル設定（常時対象の操作名集合／次の1回だけの対象）
+        env_profile = os.environ.get(PROFILE_ENV, "").strip()
+        if env_profile in ("1", "all"):
+            self.profile_always = set(PROFILE_OPERATIONS)
+        else:
+            self.profile_always = {op.strip() for op in env_profile.split(",")
+                                   if op.strip() in PROFILE_OPERATIONS}
+        self.profile_next = set()
+        self._profiling_active = False
+
+        # 処理時間トレース（環境変数 ECOROOM_TRACE=1 で有効。ログはDBと同じフォルダ）
+        _tracer.configure(os.environ.get(TRACE_ENV) == "1",
+                          os.path.dirname(os.path.abspath(self.db_file)))
+
+        if headless:
+            self.root = None
+            self.launcher = FileLauncher()
+            self.init_database()
+            self._open_journal()
+            if self.journal is not None:
+                self.journal.checkpoint()
+            self._start_integrity()
+            return
+
         # GUI設定
         self.root = tk.Tk()
         self.root.title("客室清掃管理システム")
-        self.root.geometry("420x200")
+        self.root.geometry("420x230")
+        # 別スレッドからの完了通知は Tk のスレッドでまとめて呼ぶ
+        self._ui_calls = queue.SimpleQueue()
+        self.launcher = FileLauncher(self._call_in_ui)
+        self.root.after(50, self._drain_ui_calls)
 
         self.init_database()
+        self._open_journal()
+        self._start_integrity()
 
         # 起動時にチェックアウト削除を実行（バックアップは手動）
         self.startup_cleanup()
 
         self.setup_gui()
         self.load_data()
+        # 前回保存されずに終わった新規登録をジャーナルから戻す
+        restored = self.restore_pending_from_journal()
+        if self.journal is not None:
+            self.journal.checkpoint()
         self.update_room_count_display()
+        if restored:
+            self._notify("info", "復元", f"前回「エコ票作成」で保存されていなかった登録を{restored}件復元しました。")
 
     def startup_cleanup(self):
         """起動時のチェックアウト削除（バックアップは手動で行う方針のため自動作成しない）"""
@@ -168,6 +2406,14 @@ class HotelCleaningSystem:
         ttk.Button(manage_btn_frame, text="部屋編集", command=open_edit_room, width=14).pack(side="left", padx=8, pady=5)
         ttk.Button(manage_btn_frame, text="バックアップ管理", command=open_backup_management, width=14).pack(side="left", padx=8, pady=5)
 
+        # 隠しメニュー：Ctrl+Shift+P で次回の処理をプロファイル（サポート調査用）
+        def open_profile_menu(event=None):
+            self.show_profile_menu(dialog)
+            return "break"
+
+        dialog.bind("<Control-Shift-P>", open_profile_menu)
+        dialog.bind("<Control-P>", open_profile_menu)
+
         # ダイアログが閉じられるまで待機
         dialog.wait_window()
 
@@ -175,21 +2421,25 @@ class HotelCleaningSystem:
 
     def cleanup_checkout_rooms(self, checkout_date):
         """指定日より前にC/Oステータスの部屋と空白の部屋を削除"""
-        cursor = self.conn.cursor()
+        with _tracer.span("cleanup_checkout_rooms"):
+            return self.unit_of_work("cleanup", lambda uow: self._cleanup_checkout_rooms(uow, checkout_date))
+
+    def _cleanup_checkout_rooms(self, uow, checkout_date):
+        cursor = uow.cursor
 
         # 指定日以前にC/Oステータスの部屋を検索
-        checkout_date_str = checkout_date.strftime('%Y-%m-%d')
+        checkout_day = _day_number(checkout_date)
         cursor.execute("""
                        SELECT DISTINCT room_number
                        FROM cleaning_schedule
                        WHERE cleaning_date <= ?
                          AND cleaning_status = 'C/O'
-                       """, (checkout_date_str,))
+                       """, (checkout_day,))
 
         checkout_rooms = [row[0] for row in cursor.fetchall()]
 
-        # デバッグ：C/O部屋を表示
-        print(f"C/O部屋: {checkout_rooms}")
+        # 診断：C/O部屋を記録
+        _tracer.event("cleanup_checkout_rooms", kind="checkout", rooms=checkout_rooms)
 
         # 清掃スケジュールが空白（全く登録されていない）部屋を検索
         cursor.execute("""
@@ -201,8 +2451,8 @@ class HotelCleaningSystem:
 
         empty_rooms = [row[0] for row in cursor.fetchall()]
 
-        # デバッグ：空白部屋を表示
-        print(f"空白部屋: {empty_rooms}")
+        # 診断：空白部屋を記録
+        _tracer.event("cleanup_checkout_rooms", kind="empty", rooms=empty_rooms)
 
         # さらに、cleaning_statusが空文字列やNULLの部屋も検索
         cursor.execute("""
@@ -213,23 +2463,25 @@ class HotelCleaningSystem:
                        """)
 
         null_or_empty_rooms = [row[0] for row in cursor.fetchall()]
-        print(f"空文字列/NULL部屋: {null_or_empty_rooms}")
+        _tracer.event("cleanup_checkout_rooms", kind="null_or_empty", rooms=null_or_empty_rooms)
 
         # 全ての空白パターンを統合
         rooms_to_delete = list(set(checkout_rooms + empty_rooms + null_or_empty_rooms))
 
-        # デバッグ：削除対象の部屋を表示
-        print(f"削除対象の部屋: {rooms_to_delete}")
+        # 診断：削除対象の部屋を記録
+        _tracer.event("cleanup_checkout_rooms", kind="delete", rooms=rooms_to_delete)
 
         if rooms_to_delete:
-            # rooms テーブルから削除
-            placeholders = ','.join(['?' for _ in rooms_to_delete])
-            cursor.execute(f"DELETE FROM rooms WHERE room_number IN ({placeholders})", rooms_to_delete)
-
-            # cleaning_schedule テーブルからも削除
-            cursor.execute(f"DELETE FROM cleaning_schedule WHERE room_number IN ({placeholders})", rooms_to_delete)
+            # 削除する前に履歴へ移し、日別集計に加算する
+            reasons = {room: 'blank' for room in null_or_empty_rooms}
+            reasons.update({room: 'empty' for room in empty_rooms})
+            reasons.update({room: 'checkout' for room in checkout_rooms})
+            archive_ids = self._archive_rooms(cursor, rooms_to_delete, reasons)
+            # 履歴に入れた行も差分として残す（ジャーナルからの復元で出し入れする）
+            UnitOfWork.merge_history(uow.meta, 'archived', self._history_rows(cursor, archive_ids))
 
-            self.conn.commit()
+            # rooms / cleaning_schedule テーブルから削除（差分はメモリ上のモデルにも反映される）
+            uow.delete_rooms(rooms_to_delete)
 
             # 削除の内訳を返す
             return {
@@ -241,11 +2493,114 @@ class HotelCleaningSystem:
 
         return {'total': 0, 'checkout': 0, 'empty': 0, 'null_or_empty': 0}
 
+    @staticmethod
+    def _archive_rooms(cursor, room_numbers, reasons):
+        """部屋と清掃スケジュールを履歴テーブルにコピーし、daily_stats に加算する
+        （削除は呼び出し側。履歴は追記のみで、集計は移した分だけ増える）。
+        追加した履歴の archive_id のリストを返す。"""
+        archived_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        archive_ids = []
+        for room in room_numbers:
+            cursor.execute("""INSERT INTO rooms_history
+                              (room_number, guest_name, check_in_date, cleaning_days,
+                               is_ecodoor, is_ecoplan, archived_at, reason)
+                              SELECT room_number, guest_name, check_in_date, cleaning_days,
+                                     is_ecodoor, is_ecoplan, ?, ?
+                              FROM rooms WHERE room_number = ?""",
+                           (archived_at, reasons.get(room), room))
+            if cursor.rowcount == 0:
+                # スケジュールだけ残っていた部屋
+                cursor.execute("INSERT INTO rooms_history (room_number, archived_at, reason) VALUES (?, ?, ?)",
+                               (room, archived_at, reasons.get(room)))
+            archive_ids.append(cursor.lastrowid)
+            cursor.execute("""INSERT INTO cleaning_schedule_history
+                              SELECT ?, room_number, cleaning_date, cleaning_status
+                              FROM cleaning_schedule WHERE room_number = ?""",
+                           (cursor.lastrowid, room))
+
+        placeholders = ','.join(['?' for _ in room_numbers])
+        cursor.execute(f"""INSERT INTO daily_stats (stat_date, cleaning_status, rooms, ecodoor_rooms, ecoplan_rooms)
+                           SELECT s.cleaning_date, s.cleaning_status, COUNT(*),
+                                  COALESCE(SUM(r.is_ecodoor), 0), COALESCE(SUM(r.is_ecoplan), 0)
+                           FROM cleaning_schedule s LEFT JOIN rooms r ON r.room_number = s.room_number
+                           WHERE s.room_number IN ({placeholders})
+                             AND s.cleaning_status IS NOT NULL AND s.cleaning_status != ''
+                           GROUP BY s.cleaning_date, s.cleaning_status
+                           ON CONFLICT (stat_date, cleaning_status) DO UPDATE SET
+                               rooms = rooms + excluded.rooms,
+                               ecodoor_rooms = ecodoor_rooms + excluded.ecodoor_rooms,
+                               ecoplan_rooms = ecoplan_rooms + excluded.ecoplan_rooms""",
+                       list(room_numbers))
+        return archive_ids
+
+    @staticmethod
+    def _history_rows(cursor, archive_ids):
+        """履歴の行 {'rooms': [rooms_history の行], 'schedule': [cleaning_schedule_history の行]}"""
+        rows = {'rooms': [], 'schedule': []}
+        archive_ids = list(archive_ids)
+        for i in range(0, len(archive_ids), 500):
+            chunk = archive_ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows['rooms'] += [list(r) for r in cursor.execute(
+                f"SELECT * FROM rooms_history WHERE archive_id IN ({placeholders})", chunk)]
+            rows['schedule'] += [list(r) for r in cursor.execute(
+                f"SELECT * FROM cleaning_schedule_history WHERE archive_id IN ({placeholders})", chunk)]
+        return rows
+
+    @staticmethod
+    def _adjust_daily_stats(cursor, archive_ids, sign):
+        """履歴にある archive_ids の分を daily_stats に加算（sign=1）または減算（sign=-1）する"""
+        archive_ids = list(archive_ids)
+        for i in range(0, len(archive_ids), 500):
+            chunk = archive_ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            totals = cursor.execute(f"""SELECT s.cleaning_date, s.cleaning_status, COUNT(*),
+                                               COALESCE(SUM(h.is_ecodoor), 0), COALESCE(SUM(h.is_ecoplan), 0)
+                                        FROM cleaning_schedule_history s
+                                        JOIN rooms_history h ON h.archive_id = s.archive_id
+                                        WHERE s.archive_id IN ({placeholders})
+                                          AND s.cleaning_status IS NOT NULL AND s.cleaning_status != ''
+                                        GROUP BY s.cleaning_date, s.cleaning_status""", chunk).fetchall()
+            cursor.executemany("""INSERT INTO daily_stats (stat_date, cleaning_status, rooms, ecodoor_rooms, ecoplan_rooms)
+                                  VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT (stat_date, cleaning_status) DO UPDATE SET
+                                      rooms = rooms + excluded.rooms,
+                                      ecodoor_rooms = ecodoor_rooms + excluded.ecodoor_rooms,
+                                      ecoplan_rooms = ecoplan_rooms + excluded.ecoplan_rooms""",
+                               [(day, status, sign * n, sign * e, sign * p) for day, status, n, e, p in totals])
+        cursor.execute("DELETE FROM daily_stats WHERE rooms <= 0")
+
+    def _set_history(self, uow, history):
+        """history {archive_id: 履歴の行 or None} の通りに履歴を入れる／消す（daily_stats も合わせる）。
+        実際に消した行は uow.meta['unarchived']、入れた行は uow.meta['archived'] に残す。"""
+        cursor = uow.cursor
+        wanted = {aid for aid, rows in history.items() if rows is not None}
+        present = {aid for (aid,) in cursor.execute(
+            "SELECT archive_id FROM rooms_history WHERE archive_id IN "
+            f"({','.join('?' * len(history))})", list(history))} if history else set()
+        remove = [aid for aid, rows in history.items() if rows is None and aid in present]
+        add = [aid for aid in wanted if aid not in present]
+        if remove:
+            UnitOfWork.merge_history(uow.meta, 'unarchived', self._history_rows(cursor, remove))
+            self._adjust_daily_stats(cursor, remove, -1)
+            placeholders = ','.join('?' * len(remove))
+            cursor.execute(f"DELETE FROM cleaning_schedule_history WHERE archive_id IN ({placeholders})", remove)
+            cursor.execute(f"DELETE FROM rooms_history WHERE archive_id IN ({placeholders})", remove)
+        if add:
+            added = {'rooms': [], 'schedule': []}
+            for aid in add:
+                added['rooms'] += history[aid]['rooms']
+                added['schedule'] += history[aid]['schedule']
+            cursor.executemany("INSERT INTO rooms_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", added['rooms'])
+            cursor.executemany("INSERT INTO cleaning_schedule_history VALUES (?, ?, ?, ?)", added['schedule'])
+            self._adjust_daily_stats(cursor, add, 1)
+            UnitOfWork.merge_history(uow.meta, 'archived', added)
+
     def create_database_backup_silent(self):
         """サイレントバックアップ作成（メッセージなし）"""
         try:
             backup_name = f"{self.backup_prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-            shutil.copy2(self.db_file, backup_name)
+            self.db.backup_to(backup_name)
             return backup_name
         except Exception as e:
             print(f"バックアップエラー: {e}")
@@ -306,7 +2661,7 @@ class HotelCleaningSystem:
     def get_backup_room_count(self, backup_file):
         """バックアップファイル内の部屋数を取得"""
         try:
-            conn = sqlite3.connect(backup_file)
+            conn = ConnectionManager.open_readonly(backup_file)
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM rooms")
             count = cursor.fetchone()[0]
@@ -498,11 +2853,74 @@ class HotelCleaningSystem:
         # 下部に余白を追加
         ttk.Label(frame, text="").pack(pady=5)
 
+    JOURNAL_OP_LABELS = {'register': "登録", 'edit': "編集", 'delete': "削除", 'bulk': "一括変更",
+                         'cleanup': "チェックアウト削除", 'recover': "履歴から復元", 'replay': "起動時のやり直し",
+                         'undo': "元に戻す", 'redo': "やり直す",
+                         'checkpoint': "起動", 'restore': "バックアップ復元"}
+
+    def show_journal_dialog(self):
+        """操作ジャーナルの一覧から、選んだ操作の直後の状態に戻すダイアログ"""
+        positions = self.journal_positions()
+        if not positions:
+            messagebox.showinfo("情報", "戻せる操作の記録がありません。")
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("操作履歴から復元")
+        dialog.geometry("560x480")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        frame = ttk.Frame(dialog, padding="15")
+        frame.pack(fill="both", expand=True)
+        ttk.Label(frame, text="選んだ操作の直後の状態に戻します（それより後の操作は取り消されます）。",
+                  font=("", 10)).pack(pady=(0, 10))
+
+        list_frame = ttk.Frame(frame)
+        list_frame.pack(fill="both", expand=True)
+        columns = ("seq", "time", "op", "rooms", "cells")
+        tree = ttk.Treeview(list_frame, columns=columns, show="headings", height=15)
+        for column, text, width in (("seq", "番号", 60), ("time", "日時", 170), ("op", "操作", 130),
+                                    ("rooms", "部屋", 60), ("cells", "日数", 60)):
+            tree.heading(column, text=text)
+            tree.column(column, width=width, anchor="center")
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        # 新しい操作を上に表示する
+        for seq, ts, op, rooms, cells in reversed(positions):
+            tree.insert("", "end", iid=str(seq),
+                        values=(seq, ts.replace("T", " "), self.JOURNAL_OP_LABELS.get(op, op), rooms, cells))
+
+        def recover():
+            selection = tree.selection()
+            if not selection:
+                messagebox.showwarning("警告", "戻す位置を選択してください。")
+                return
+            seq = int(selection[0])
+            if not messagebox.askyesno("復元の確認", f"番号 {seq} の操作の直後の状態に戻しますか？", icon='warning'):
+                return
+            try:
+                undone = self.recover_to(seq)
+            except Exception as e:
+                messagebox.showerror("エラー", f"復元に失敗しました: {e}")
+                return
+            dialog.destroy()
+            self.update_room_count_display()
+            messagebox.showinfo("完了", f"{undone}件の操作を取り消しました。")
+
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(fill="x", pady=(10, 0))
+        ttk.Button(button_frame, text="この時点に戻す", command=recover).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="閉じる", command=dialog.destroy).pack(side="right", padx=5)
+
     def restore_from_backup(self, backup_file):
         """バックアップファイルからデータベースを復元"""
         try:
             # バックアップファイルの検証
-            test_conn = sqlite3.connect(backup_file)
+            test_conn = ConnectionManager.open_readonly(backup_file)
             test_cursor = test_conn.cursor()
 
             # 必要なテーブルが存在するか確認
@@ -518,24 +2936,31 @@ class HotelCleaningSystem:
 
             test_conn.close()
 
-            # 現在の接続を閉じる
-            self.conn.close()
-
             # 復元前に現在のデータベースのバックアップを作成
             pre_restore_backup = f"{self.backup_prefix}pre_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-            shutil.copy2(self.db_file, pre_restore_backup)
-            print(f"復元前バックアップ作成: {pre_restore_backup}")
+            self.db.backup_to(pre_restore_backup)
+            _tracer.event("restore_from_backup", pre_restore_backup=pre_restore_backup,
+                          backup_file=backup_file)
+
+            # 現在の接続を閉じる（WAL の内容は本体に書き戻される）
+            self.db.close()
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.db_file + suffix):
+                    os.remove(self.db_file + suffix)
 
             # バックアップファイルで上書き
             shutil.copy2(backup_file, self.db_file)
 
             # データベースに再接続
-            self.conn = sqlite3.connect(self.db_file)
+            self.init_database()
+            if self.journal is not None:
+                # これより前の操作はやり直し・復元の対象にしない
+                barrier = self.journal.append({'op': 'restore', 'backup': os.path.basename(backup_file)})
+                self._set_journal_applied_seq(barrier)
 
-            # データを再読み込み
-            self.records.clear()
-            self.existing_rooms.clear()
-            self.load_data()
+            # DB 全体が入れ替わったのでモデルを読み直す
+            with _tracer.span("restore_from_backup"):
+                self.reload_model()
 
             return True
 
@@ -543,7 +2968,8 @@ class HotelCleaningSystem:
             print(f"復元エラー: {e}")
             # エラー時はデータベースに再接続を試みる
             try:
-                self.conn = sqlite3.connect(self.db_file)
+                if self.db._closed:
+                    self.init_database()
             except:
                 pass
             return False
@@ -552,6 +2978,8 @@ class HotelCleaningSystem:
         """バックアップ管理メニューを表示"""
         menu = tk.Menu(self.root, tearoff=0)
         menu.add_command(label="バックアップから復元...", command=self.show_restore_dialog)
+        if self.journal is not None:
+            menu.add_command(label="操作履歴から復元...", command=self.show_journal_dialog)
         menu.add_command(label="今すぐバックアップ作成", command=self.create_manual_backup)
         menu.add_separator()
         menu.add_command(label="古いバックアップを削除...", command=self.cleanup_old_backups_dialog)
@@ -605,7 +3033,7 @@ class HotelCleaningSystem:
                     return
 
             try:
-                shutil.copy2(self.db_file, filename)
+                self.db.backup_to(filename)
                 dialog.destroy()
                 messagebox.showinfo("完了", f"バックアップを作成しました。\n\nファイル名: {filename}")
             except Exception as e:
@@ -686,8 +3114,9 @@ class HotelCleaningSystem:
         frame = ttk.Frame(self.root, padding="10")
         frame.pack(fill="both", expand=True)
 
-        # 登録済み部屋数の表示
+        # 登録済み部屋数の表示（部屋の登録・削除の通知で更新する）
         self.room_count_var = tk.StringVar(value="登録部屋数: 0件")
+        self.add_change_listener(lambda uow: self.update_room_count_display())
         ttk.Label(frame, textvariable=self.room_count_var, font=("", 12)).pack(pady=(10, 5))
 
         # ステータス表示
@@ -702,6 +3131,123 @@ class HotelCleaningSystem:
         ttk.Button(btn_frame, text="アーニング表出力", command=self.output_earning_table).pack(side="left", padx=5)
         ttk.Button(btn_frame, text="起動メニュー", command=self.show_startup_menu).pack(side="left", padx=5)
 
+        # 一括処理・レポート・診断（処理時間）・エコ票の分割設定
+        sub_frame = ttk.Frame(frame)
+        sub_frame.pack()
+        ttk.Button(sub_frame, text="一括変更", command=self.show_bulk_edit_dialog).pack(side="left", padx=5)
+        ttk.Button(sub_frame, text="実績レポート", command=self.show_report_dialog).pack(side="left", padx=5)
+        ttk.Button(sub_frame, text="アーニング一括", command=self.output_earning_batch).pack(side="left", padx=5)
+        ttk.Button(sub_frame, text="処理時間", command=self.show_timings_panel).pack(side="left", padx=5)
+
+        # 元に戻す／やり直す（Ctrl+Z / Ctrl+Y）
+        undo_frame = ttk.Frame(frame)
+        undo_frame.pack(pady=(5, 0))
+        ttk.Button(undo_frame, text="元に戻す", command=self.undo_last).pack(side="left", padx=5)
+        ttk.Button(undo_frame, text="やり直す", command=self.redo_last).pack(side="left", padx=5)
+        ttk.Button(undo_frame, text="整合性チェック", command=self.show_integrity_dialog).pack(side="left", padx=5)
+
+        # 整合性チェックの結果（書き込みのたびに裏で検査される）
+        self.integrity_var = tk.StringVar()
+        self._integrity_refresh = None
+        ttk.Label(frame, textvariable=self.integrity_var, font=("", 9)).pack(pady=(5, 0))
+        self.update_integrity_display()
+        self.root.bind("<Control-z>", lambda e: self.undo_last())
+        self.root.bind("<Control-y>", lambda e: self.redo_last())
+
+        # エコ票を四半期ごとの別ブックに分ける（通年で長期滞在がある場合向け）
+        split_var = tk.BooleanVar(value=self.excel_split == 'quarter')
+        ttk.Checkbutton(sub_frame, text="四半期ごとに分割", variable=split_var,
+                        command=lambda: setattr(self, 'excel_split',
+                                                'quarter' if split_var.get() else None)
+                        ).pack(side="left", padx=5)
+
+    def undo_last(self):
+        self._run_step(self.undo, "元に戻す操作がありません", "を元に戻しました")
+
+    def redo_last(self):
+        self._run_step(self.redo, "やり直す操作がありません", "をやり直しました")
+
+    def _run_step(self, step, empty_message, done_suffix):
+        try:
+            op = step()
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
+            return
+        if op is None:
+            self.status_var.set(empty_message)
+            return
+        self.status_var.set(f"「{self.JOURNAL_OP_LABELS.get(op, op)}」{done_suffix}")
+
+    def update_integrity_display(self):
+        """整合性チェックの結果の表示を更新（開いていれば一覧も）"""
+        if not hasattr(self, 'integrity_var'):
+            return   # 画面を作る前の通知（作るときに表示する）
+        if self.integrity is None:
+            self.integrity_var.set("")
+            return
+        issues = self.integrity.issues()
+        self.integrity_var.set(f"⚠ データの不整合: {len(issues)}件（「整合性チェック」で確認）"
+                               if issues else "データの整合性: 問題なし")
+        if self._integrity_refresh is not None:
+            self._integrity_refresh()
+
+    def show_integrity_dialog(self):
+        """整合性チェックで見つかった問題の一覧（ダブルクリックで部屋の編集）"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("整合性チェック")
+        dialog.geometry("640x420")
+        dialog.transient(self.root)
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill="both", expand=True)
+
+        header_var = tk.StringVar()
+        ttk.Label(frame, textvariable=header_var, font=("", 11, "bold")).pack(anchor="w", pady=(0, 8))
+
+        columns = ("room", "date", "kind", "detail")
+        tree = ttk.Treeview(frame, columns=columns, show="headings", height=14)
+        for column, text, width in (("room", "部屋", 60), ("date", "日付", 90),
+                                    ("kind", "種類", 150), ("detail", "内容", 320)):
+            tree.heading(column, text=text)
+            tree.column(column, width=width, anchor="w")
+        tree.pack(fill="both", expand=True)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            if self.integrity is None:
+                header_var.set(f"整合性チェックは無効です（環境変数 {INTEGRITY_ENV}=0）")
+                return
+            issues = self.integrity.issues()
+            header_var.set(f"問題 {len(issues)}件" if issues else "問題は見つかっていません")
+            for issue in issues:
+                day = issue['day']
+                tree.insert("", "end", values=(
+                    issue['room'], _from_day_number(day).strftime('%Y/%m/%d') if day is not None else "",
+                    INTEGRITY_KINDS.get(issue['kind'], issue['kind']), issue['detail']))
+
+        def rescan():
+            if self.integrity is not None:
+                header_var.set("全件を検査しています...")
+                self.integrity.schedule()
+
+        def open_room(event):
+            selected = tree.selection()
+            if selected:
+                self.open_edit_dialog(str(tree.item(selected[0], "values")[0]))
+
+        def close():
+            self._integrity_refresh = None
+            dialog.destroy()
+
+        tree.bind("<Double-1>", open_room)
+        bottom = ttk.Frame(frame)
+        bottom.pack(fill="x", pady=(8, 0))
+        ttk.Button(bottom, text="閉じる", command=close).pack(side="right", padx=5)
+        ttk.Button(bottom, text="全件を再検査", command=rescan).pack(side="right", padx=5)
+        dialog.protocol("WM_DELETE_WINDOW", close)
+        self._integrity_refresh = refresh
+        refresh()
+
     def update_room_count_display(self):
         """登録部屋数の表示を更新"""
         count = len(self.records)
@@ -711,6 +3257,340 @@ class HotelCleaningSystem:
         else:
             self.status_var.set("CSVを読み込んでください")
 
+    def show_report_dialog(self):
+        """月別・年別の清掃実績（連泊日数・エコ率・エコドア/エコプラン）を表示"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("実績レポート")
+        dialog.geometry("640x420")
+        dialog.transient(self.root)
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill="both", expand=True)
+
+        option_frame = ttk.Frame(frame)
+        option_frame.pack(fill="x", pady=(0, 8))
+        by_var = tk.StringVar(value='month')
+        active_var = tk.BooleanVar(value=True)
+
+        columns = ("stayover", "eco", "clean", "rate", "ecodoor", "ecoplan", "ci", "co")
+        headings = ("連泊(室日)", "エコ", "清掃", "エコ率", "エコドア", "エコプラン", "C/I", "C/O")
+        tree = ttk.Treeview(frame, columns=columns, show="tree headings", height=14)
+        tree.heading("#0", text="期間")
+        tree.column("#0", width=90, anchor="w")
+        for col, text in zip(columns, headings):
+            tree.heading(col, text=text)
+            tree.column(col, width=62, anchor="e")
+        tree.pack(fill="both", expand=True)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            for entry in self.occupancy_report(by_var.get(), include_active=active_var.get()):
+                rate = entry['eco_rate']
+                tree.insert("", "end", text=entry['period'], values=(
+                    entry['stayover'], entry['eco'], entry['clean'],
+                    f"{rate * 100:.1f}%" if rate is not None else "-",
+                    entry['ecodoor_rooms'], entry['ecoplan_rooms'],
+                    entry['statuses'].get('C/I', 0), entry['statuses'].get('C/O', 0)))
+
+        ttk.Radiobutton(option_frame, text="月別", variable=by_var, value='month',
+                        command=refresh).pack(side="left", padx=5)
+        ttk.Radiobutton(option_frame, text="年別", variable=by_var, value='year',
+                        command=refresh).pack(side="left", padx=5)
+        ttk.Checkbutton(option_frame, text="登録中の部屋を含める", variable=active_var,
+                        command=refresh).pack(side="left", padx=15)
+        ttk.Button(frame, text="閉じる", command=dialog.destroy).pack(pady=(8, 0))
+
+        refresh()
+
+    def show_bulk_edit_dialog(self):
+        """階・プラン・期間で部屋を絞り込み、期間内のステータスをまとめて変更する"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("一括変更")
+        dialog.transient(self.root)
+
+        frame = ttk.Frame(dialog, padding="15")
+        frame.pack(fill="both", expand=True)
+
+        # 絞り込み条件
+        filter_frame = ttk.LabelFrame(frame, text="対象の部屋", padding="10")
+        filter_frame.pack(fill="x", pady=(0, 10))
+
+        ttk.Label(filter_frame, text="階（カンマ区切り・空欄で全て）:").grid(row=0, column=0, sticky="w", pady=3)
+        floor_var = tk.StringVar()
+        ttk.Entry(filter_frame, textvariable=floor_var, width=16).grid(row=0, column=1, sticky="w", pady=3)
+
+        plan_labels = {"すべて": None, "エコプラン": 'ecoplan', "エコドア": 'ecodoor', "通常": 'normal'}
+        ttk.Label(filter_frame, text="プラン:").grid(row=1, column=0, sticky="w", pady=3)
+        plan_var = tk.StringVar(value="すべて")
+        ttk.Combobox(filter_frame, textvariable=plan_var, values=tuple(plan_labels),
+                     state="readonly", width=12).grid(row=1, column=1, sticky="w", pady=3)
+
+        # 期間（既定は翌日）
+        tomorrow = datetime.now() + timedelta(days=1)
+        date_vars = {}
+        for row, (key, label) in enumerate((('start', "開始日:"), ('end', "終了日:")), start=2):
+            ttk.Label(filter_frame, text=label).grid(row=row, column=0, sticky="w", pady=3)
+            date_frame = ttk.Frame(filter_frame)
+            date_frame.grid(row=row, column=1, sticky="w", pady=3)
+            date_vars[key] = {}
+            for part, width, unit in (('year', 6, "年"), ('month', 4, "月"), ('day', 4, "日")):
+                var = tk.StringVar(value=str(getattr(tomorrow, part)))
+                date_vars[key][part] = var
+                ttk.Entry(date_frame, textvariable=var, width=width).pack(side="left")
+                ttk.Label(date_frame, text=unit).pack(side="left", padx=(0, 5))
+
+        # 変更内容
+        change_frame = ttk.LabelFrame(frame, text="変更内容", padding="10")
+        change_frame.pack(fill="x", pady=(0, 10))
+        ttk.Label(change_frame, text="ステータス:").grid(row=0, column=0, sticky="w", pady=3)
+        status_var = tk.StringVar(value="エコドア")
+        ttk.Combobox(change_frame, textvariable=status_var, values=('〇', '×', 'エコドア'),
+                     state="readonly", width=10).grid(row=0, column=1, sticky="w", pady=3)
+        keep_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(change_frame, text="C/I・C/O の日は変更しない",
+                        variable=keep_var).grid(row=1, column=0, columnspan=2, sticky="w", pady=3)
+
+        target_var = tk.StringVar(value="")
+        ttk.Label(frame, textvariable=target_var, wraplength=420, justify="left").pack(fill="x", pady=(0, 10))
+
+        def read_conditions():
+            """入力を (条件の辞書) にする。不正な入力はメッセージを出して None"""
+            try:
+                floors = {int(f) for f in floor_var.get().replace("、", ",").split(",") if f.strip()}
+            except ValueError:
+                messagebox.showerror("エラー", "階は数字をカンマ区切りで入力してください。", parent=dialog)
+                return None
+            try:
+                start, end = (datetime(int(v['year'].get()), int(v['month'].get()), int(v['day'].get()))
+                              for v in (date_vars['start'], date_vars['end']))
+            except ValueError:
+                messagebox.showerror("エラー", "正しい日付を入力してください。", parent=dialog)
+                return None
+            if end < start:
+                messagebox.showerror("エラー", "終了日は開始日以降にしてください。", parent=dialog)
+                return None
+            return {'floor': floors or None, 'plan': plan_labels[plan_var.get()], 'start': start, 'end': end}
+
+        def preview():
+            conditions = read_conditions()
+            if conditions is None:
+                return None
+            rooms = self.bulk_target_rooms(**conditions)
+            shown = ", ".join(rooms[:30]) + (" ほか" if len(rooms) > 30 else "")
+            target_var.set(f"対象: {len(rooms)}部屋" + (f"（{shown}）" if rooms else ""))
+            return conditions, rooms
+
+        def apply():
+            checked = preview()
+            if checked is None:
+                return
+            conditions, rooms = checked
+            if not rooms:
+                messagebox.showinfo("情報", "条件に合う部屋がありません。", parent=dialog)
+                return
+            period = f"{conditions['start'].strftime('%m/%d')}〜{conditions['end'].strftime('%m/%d')}"
+            if not messagebox.askyesno("確認", f"{len(rooms)}部屋の {period} を「{status_var.get()}」に変更しますか？",
+                                       parent=dialog):
+                return
+            try:
+                result = self.bulk_set_status(status_var.get(), keep_endpoints=keep_var.get(), **conditions)
+            except Exception as e:
+                messagebox.showerror("エラー", f"一括変更に失敗しました: {e}", parent=dialog)
+                return
+            dialog.destroy()
+            messagebox.showinfo("完了", f"{result['rooms']}部屋・{result['days']}日分のステータスを変更しました。\n\n"
+                                      "「エコ票作成」ボタンでExcelを生成してください。")
+            self.update_room_count_display()
+
+        button_frame = ttk.Frame(frame)
+        button_frame.pack()
+        ttk.Button(button_frame, text="対象を確認", command=preview).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="変更する", command=apply).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="閉じる", command=dialog.destroy).pack(side="left", padx=5)
+
+    def show_timings_panel(self):
+        """前回の処理（CSV読込／エコ票作成／アーニング表出力など）の段階別所要時間を表示"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("前回の処理時間")
+        dialog.geometry("520x420")
+        dialog.transient(self.root)
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill="both", expand=True)
+
+        header_var = tk.StringVar()
+        ttk.Label(frame, textvariable=header_var, font=("", 11, "bold")).pack(anchor="w", pady=(0, 8))
+
+        columns = ("ms", "sql", "detail")
+        tree = ttk.Treeview(frame, columns=columns, show="tree headings", height=14)
+        tree.heading("#0", text="処理段階")
+        tree.heading("ms", text="時間(ms)")
+        tree.heading("sql", text="SQL")
+        tree.heading("detail", text="詳細")
+        tree.column("#0", width=200, anchor="w")
+        tree.column("ms", width=80, anchor="e")
+        tree.column("sql", width=50, anchor="center")
+        tree.column("detail", width=160, anchor="w")
+        tree.pack(fill="both", expand=True)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            if not _tracer.last_run:
+                header_var.set("計測結果がありません（計測を有効にして処理を実行してください）")
+                return
+            header_var.set(f"{_tracer.last_run_name}  "
+                           f"（{_tracer.last_run_at.strftime('%Y/%m/%d %H:%M:%S')}）")
+            parents = {}
+            for depth, name, ms, record in _tracer.last_run:
+                detail = ", ".join(f"{k}={v}" for k, v in record.items()
+                                   if k not in ('type', 'name', 'parent', 'depth', 'ms',
+                                                'sql_count', 'sql_ms', 'ts', 'thread'))
+                item = tree.insert(parents.get(depth - 1, ""), "end", text=name, open=True,
+                                   values=(f"{ms:.1f}", record.get('sql_count', ''), detail))
+                parents[depth] = item
+
+        enabled_var = tk.BooleanVar(value=_tracer.enabled)
+
+        def toggle():
+            self.set_tracing(enabled_var.get())
+            refresh()
+
+        bottom = ttk.Frame(frame)
+        bottom.pack(fill="x", pady=(8, 0))
+        ttk.Checkbutton(bottom, text="計測を有効にする", variable=enabled_var,
+                        command=toggle).pack(side="left")
+        ttk.Button(bottom, text="閉じる", command=dialog.destroy).pack(side="right", padx=5)
+        ttk.Button(bottom, text="更新", command=refresh).pack(side="right", padx=5)
+        ttk.Label(frame, text=f"ログ: {_tracer.log_path}", font=("", 8),
+                  foreground="gray").pack(anchor="w", pady=(6, 0))
+
+        refresh()
+
+    def set_tracing(self, enabled):
+        """処理時間トレースの有効／無効を切り替える（SQLの計測も連動）"""
+        _tracer.configure(enabled)
+        self._attach_sql_trace()
+
+    def show_profile_menu(self, parent):
+        """プロファイル用の隠しメニュー（次の1回だけ対象にする操作を選ぶ）"""
+        labels = {
+            'create_schedule': "エコ票作成",
+            'import_csv': "CSV読込",
+            'output_earning_table': "アーニング表出力",
+        }
+
+        def arm(ops):
+            self.profile_next = set(ops)
+            names = "・".join(labels[op] for op in ops)
+            messagebox.showinfo(
+                "プロファイル",
+                f"次回の「{names}」をプロファイルします。\n\n"
+                f"保存先: {self._profile_dir()}",
+                parent=parent
+            )
+
+        menu = tk.Menu(parent, tearoff=0)
+        for op in PROFILE_OPERATIONS:
+            menu.add_command(label=f"次回の{labels[op]}をプロファイル",
+                             command=lambda op=op: arm([op]))
+        menu.add_command(label="次回の全操作をプロファイル",
+                         command=lambda: arm(PROFILE_OPERATIONS))
+        menu.add_separator()
+        menu.add_command(label="プロファイル予約を解除",
+                         command=lambda: self.profile_next.clear())
+        try:
+            menu.tk_popup(parent.winfo_pointerx(), parent.winfo_pointery())
+        finally:
+            menu.grab_release()
+
+    def _profile_dir(self):
+        """プロファイル結果の保存先（DBと同じフォルダ）"""
+        return os.path.dirname(os.path.abspath(self.db_file))
+
+    def _profile_requested(self, op_name):
+        # 入れ子の呼び出しは外側のプロファイルに含める
+        if self._profiling_active:
+            return False
+        return op_name in self.profile_always or op_name in self.profile_next
+
+    def _profiled_job(self, op_name, job):
+        """書き出しキューに入れる job を、op_name のプロファイル要求があればプロファイル付きで包む。
+        エコ票作成・アーニング表出力は重い書き出しを別スレッドのキューで行うため、
+        画面側の操作メソッドではなく job を計測する（cProfile はスレッドごとに計測される）。"""
+        if not self._profile_requested(op_name):
+            return job
+        # 「次回の1回」はキューに入れた時点で消費する
+        self.profile_next.discard(op_name)
+
+        def run():
+            if self._profiling_active:
+                # 別の操作（CSV読込など）をプロファイル中は二重に計測できない
+                return job()
+            return self._run_profiled(op_name, lambda _self: job(), (), {})
+        return run
+
+    def _run_profiled(self, op_name, func, args, kwargs):
+        """cProfile と tracemalloc を有効にして操作を1回実行し、結果を保存する"""
+        import cProfile
+        import tracemalloc
+
+        self.profile_next.discard(op_name)
+        self._profiling_active = True
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        base = os.path.join(self._profile_dir(), f"profile_{op_name}_{stamp}")
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(10)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                profiler.disable()
+        finally:
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            self._profiling_active = False
+            try:
+                profiler.dump_stats(base + ".prof")
+                self._write_allocation_report(base + "_alloc.txt", op_name, snapshot,
+                                              elapsed, current, peak)
+                _tracer.event("profile_saved", operation=op_name, path=base + ".prof")
+                if hasattr(self, 'status_var'):
+                    # 書き出しキューのスレッドからも呼ばれるため、表示は Tk のスレッドで更新する
+                    self._call_in_ui(self.status_var.set, f"プロファイル保存: {os.path.basename(base)}.prof")
+            except Exception as e:
+                print(f"プロファイル保存エラー: {e}")
+
+    def _write_allocation_report(self, path, op_name, snapshot, elapsed, current, peak):
+        """tracemalloc のスナップショットから確保量上位の箇所をテキストで保存"""
+        import tracemalloc
+
+        # tracemalloc 自身と import 処理の確保は除外する
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        stats = snapshot.statistics('lineno')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"操作: {op_name}\n")
+            f.write(f"日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"所要時間: {elapsed:.3f} 秒（CSV読込はダイアログ操作の待ち時間を含む）\n")
+            f.write(f"メモリ: 現在 {self.format_file_size(current)} / "
+                    f"ピーク {self.format_file_size(peak)}\n\n")
+            f.write(f"確保量の多い箇所（上位{PROFILE_TOP_ALLOCATIONS}件）\n")
+            for i, stat in enumerate(stats[:PROFILE_TOP_ALLOCATIONS], 1):
+                frame = stat.traceback[0]
+                f.write(f"{i:3d}. {self.format_file_size(stat.size):>10}  "
+                        f"{stat.count:8d}個  {frame.filename}:{frame.lineno}\n")
+
     def show_startup_menu(self):
         """起動メニューを再表示（データ整理・CSV読込・部屋編集・バックアップ）"""
         checkout_date = self.show_checkout_cleanup_dialog()
@@ -728,16 +3608,18 @@ class HotelCleaningSystem:
 
                 messagebox.showinfo("整理完了", message)
 
-            # データ再読み込み
-            self.records.clear()
-            self.existing_rooms.clear()
-            self.load_data()
-
         self.update_room_count_display()
 
     def init_database(self):
-        self.conn = sqlite3.connect(self.db_file)
-        cursor = self.conn.cursor()
+        self.db = ConnectionManager(self.db_file, setup=self._create_schema)
+        self._attach_sql_trace()
+        if getattr(self, 'integrity', None) is not None:
+            # 復元で開き直したときは新しい接続で検査する
+            self.integrity.db = self.db
+
+    @staticmethod
+    def _create_schema(conn):
+        cursor = conn.cursor()
 
         cursor.execute('''CREATE TABLE IF NOT EXISTS rooms
                           (
@@ -762,15 +3644,595 @@ class HotelCleaningSystem:
                               room_number
                               TEXT,
                               cleaning_date
-                              DATE,
+                              INTEGER,
                               cleaning_status
                               TEXT
                           )''')
 
-        self.conn.commit()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # 旧形式の 'YYYY-MM-DD' を日数に変換（julianday の 1970-01-01 は 2440587.5）
+            cursor.execute("""UPDATE cleaning_schedule
+                              SET cleaning_date = CAST(julianday(cleaning_date) - 2440587.5 AS INTEGER)
+                              WHERE typeof(cleaning_date) = 'text'""")
+
+        # 日付範囲の一覧（schedule_between）と部屋ごとの読み込みを索引だけで済ませる
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_schedule_date
+                          ON cleaning_schedule (cleaning_date, room_number, cleaning_status)""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_schedule_room
+                          ON cleaning_schedule (room_number, cleaning_date, cleaning_status)""")
+
+        # 整理（C/O済み・空白の部屋の削除）で消す前の部屋を残す履歴
+        cursor.execute('''CREATE TABLE IF NOT EXISTS rooms_history
+                          (
+                              archive_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              room_number TEXT,
+                              guest_name TEXT,
+                              check_in_date DATE,
+                              cleaning_days INTEGER,
+                              is_ecodoor BOOLEAN,
+                              is_ecoplan BOOLEAN,
+                              archived_at TEXT,
+                              reason TEXT
+                          )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS cleaning_schedule_history
+                          (
+                              archive_id INTEGER,
+                              room_number TEXT,
+                              cleaning_date INTEGER,
+                              cleaning_status TEXT
+                          )''')
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_schedule_history_date
+                          ON cleaning_schedule_history (cleaning_date, cleaning_status)""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_schedule_history_archive
+                          ON cleaning_schedule_history (archive_id)""")
+
+        # 日別・ステータス別の部屋数（履歴に移すときに加算する）
+        cursor.execute('''CREATE TABLE IF NOT EXISTS daily_stats
+                          (
+                              stat_date INTEGER,
+                              cleaning_status TEXT,
+                              rooms INTEGER,
+                              ecodoor_rooms INTEGER,
+                              ecoplan_rooms INTEGER,
+                              PRIMARY KEY (stat_date, cleaning_status)
+                          ) WITHOUT ROWID''')
+
+        # エコ票の月別シート（圧縮済みXML）。dirty=1 の月と無い月だけ作り直す
+        cursor.execute('''CREATE TABLE IF NOT EXISTS sheet_cache
+                          (
+                              period INTEGER PRIMARY KEY,
+                              layout INTEGER,
+                              dirty INTEGER,
+                              sheet_xml BLOB,
+                              crc INTEGER,
+                              size INTEGER
+                          )''')
+        mark_day = "UPDATE sheet_cache SET dirty = 1 WHERE period = " + _PERIOD_SQL
+        mark_room = ("UPDATE sheet_cache SET dirty = 1 WHERE period IN (SELECT "
+                     + _PERIOD_SQL.format("cleaning_date")
+                     + " FROM cleaning_schedule WHERE room_number = {})")
+        triggers = {
+            'trg_sheet_schedule_insert': ("AFTER INSERT ON cleaning_schedule",
+                                          mark_day.format("NEW.cleaning_date")),
+            'trg_sheet_schedule_delete': ("AFTER DELETE ON cleaning_schedule",
+                                          mark_day.format("OLD.cleaning_date")),
+            'trg_sheet_schedule_update': ("AFTER UPDATE ON cleaning_schedule",
+                                          mark_day.format("OLD.cleaning_date") + "; "
+                                          + mark_day.format("NEW.cleaning_date")),
+            'trg_sheet_rooms_insert': ("AFTER INSERT ON rooms", mark_room.format("NEW.room_number")),
+            'trg_sheet_rooms_update': ("AFTER UPDATE ON rooms", mark_room.format("NEW.room_number")),
+            'trg_sheet_rooms_delete': ("AFTER DELETE ON rooms", mark_room.format("OLD.room_number")),
+        }
+        for name, (event, body) in triggers.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body}; END")
+
+        # 操作ジャーナルのどの操作までが DB に反映済みか（操作と同じトランザクションで更新する）。
+        # NULL は不明（この版より前の DB）で、起動時にジャーナルの末尾までを反映済みとみなす
+        cursor.execute('''CREATE TABLE IF NOT EXISTS journal_state
+                          (
+                              id INTEGER PRIMARY KEY CHECK (id = 1),
+                              applied_seq INTEGER
+                          )''')
+        cursor.execute("INSERT OR IGNORE INTO journal_state VALUES (1, NULL)")
+
+        if version < SCHEMA_VERSION:
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _attach_sql_trace(self):
+        """トレース有効時のみ、SQL文ごとの時間計測コールバックを接続する"""
+        self.db.set_trace_callback(_tracer.sql_callback if _tracer.enabled else None)
+
+    def query_rooms(self, conn=None, room_number=None):
+        """DBから部屋とスケジュールを読み込み、部屋番号順の dict のリストで返す。
+        スケジュールは年を含む [(日付, ステータス), ...]（サービスモードの一覧用）。"""
+        if conn is None:
+            return self.db.read(lambda conn: self.query_rooms(conn, room_number))
+        cursor = conn.cursor()
+        if room_number is None:
+            cursor.execute("SELECT * FROM rooms ORDER BY CAST(room_number AS INTEGER)")
+        else:
+            cursor.execute("SELECT * FROM rooms WHERE room_number = ?", (room_number,))
+        rooms = []
+        by_room = {}
+        for room, guest, date_str, days, ecodoor, ecoplan in cursor.fetchall():
+            info = {
+                'room': room,
+                'guest': guest,
+                'date': datetime.strptime(date_str, '%Y-%m-%d'),
+                'days': days,
+                'ecodoor': bool(ecodoor),
+                'ecoplan': bool(ecoplan),
+                'schedule': [],
+            }
+            rooms.append(info)
+            by_room[room] = info
+
+        if room_number is None:
+            cursor.execute("SELECT room_number, cleaning_date, cleaning_status FROM cleaning_schedule "
+                           "ORDER BY room_number, cleaning_date")
+        else:
+            cursor.execute("SELECT room_number, cleaning_date, cleaning_status FROM cleaning_schedule "
+                           "WHERE room_number = ? ORDER BY cleaning_date", (room_number,))
+        for room, day, status in cursor.fetchall():
+            if room in by_room:
+                by_room[room]['schedule'].append((_from_day_number(day), status))
+        return rooms
+
+    def schedule_between(self, start, end, conn=None):
+        """start〜end（両端を含む）の全部屋の清掃スケジュールを
+        [(日付, 部屋番号, ステータス), ...] の日付順で返す（索引の範囲走査1回）"""
+        if conn is None:
+            return self.db.read(lambda conn: self.schedule_between(start, end, conn))
+        cursor = conn.execute("SELECT cleaning_date, room_number, cleaning_status FROM cleaning_schedule "
+                              "WHERE cleaning_date BETWEEN ? AND ? ORDER BY cleaning_date",
+                              (_day_number(start), _day_number(end)))
+        return [(_from_day_number(day), room, status) for day, room, status in cursor.fetchall()]
+
+    def schedule_months(self, conn=None):
+        """スケジュールのある (年, 月) を古い順に返す"""
+        if conn is None:
+            return self.db.read(self.schedule_months)
+        cursor = conn.execute("SELECT DISTINCT CAST(strftime('%Y%m', cleaning_date * 86400, 'unixepoch') AS INTEGER) "
+                              "FROM cleaning_schedule ORDER BY 1")
+        return [divmod(ym, 100) for (ym,) in cursor.fetchall()]
+
+    def occupancy_matrix(self, start=None, end=None, conn=None):
+        """部屋 × 日 の OccupancyMatrix（NumPy が無ければ None）"""
+        if conn is None:
+            return self.db.read(lambda conn: self.occupancy_matrix(start, end, conn))
+        return OccupancyMatrix.from_db(conn, start, end, self._room_sort_key)
+
+    def daily_counts(self, start, end, conn=None):
+        """start〜end の日ごとの {'date', 'statuses': {ステータス: 室数}, 'ecodoor_rooms', 'ecoplan_rooms'}
+        のリスト（エコドア・エコプランは中日の部屋数）。NumPy があれば行列の集計で、
+        無ければ SQL の GROUP BY で数える。"""
+        if conn is None:
+            return self.db.read(lambda conn: self.daily_counts(start, end, conn))
+        first, last = _day_number(start), _day_number(end)
+        days = {day: {'date': _from_day_number(day), 'statuses': {}, 'ecodoor_rooms': 0, 'ecoplan_rooms': 0}
+                for day in range(first, last + 1)}
+
+        matrix = OccupancyMatrix.from_db(conn, start, end, self._room_sort_key)
+        if matrix is not None:
+            _, counts = matrix.day_counts()
+            ecodoor = matrix.flag_counts(matrix.ecodoor).tolist()
+            ecoplan = matrix.flag_counts(matrix.ecoplan).tolist()
+            for offset, row in enumerate(counts.tolist()):
+                entry = days[first + offset]
+                entry['statuses'] = {matrix.statuses[code]: n for code, n in enumerate(row)
+                                     if code and n and matrix.statuses[code]}
+                entry['ecodoor_rooms'] = ecodoor[offset]
+                entry['ecoplan_rooms'] = ecoplan[offset]
+            return list(days.values())
+
+        for day, status, rooms, ecodoor, ecoplan in conn.execute(
+                """SELECT s.cleaning_date, s.cleaning_status, COUNT(*), SUM(r.is_ecodoor), SUM(r.is_ecoplan)
+                   FROM cleaning_schedule s JOIN rooms r ON r.room_number = s.room_number
+                   WHERE s.cleaning_date BETWEEN ? AND ?
+                     AND s.cleaning_status IS NOT NULL AND s.cleaning_status != ''
+                   GROUP BY 1, 2""", (first, last)):
+            entry = days[day]
+            entry['statuses'][status] = rooms
+            if status not in ('C/I', 'C/O'):
+                entry['ecodoor_rooms'] += ecodoor
+                entry['ecoplan_rooms'] += ecoplan
+        return list(days.values())
+
+    # 実績レポートでの区分（中日のうち、清掃しない日＝エコ／清掃する日）
+    ECO_STATUSES = ('×', 'エコドア')
+    CLEAN_STATUSES = ('〇',)
+    REPORT_PERIOD_FORMATS = {'month': '%Y-%m', 'year': '%Y'}
+
+    def occupancy_report(self, by='month', start=None, end=None, include_active=True, conn=None):
+        """月別（by='month'）または年別（by='year'）の清掃実績を返す。
+
+        整理で履歴に移した分は daily_stats（日別集計）から読み、include_active=True なら
+        まだ登録中の部屋のスケジュールも加える。各期間は
+        {'period', 'statuses': {ステータス: 室数}, 'stayover', 'eco', 'clean',
+         'eco_rate', 'ecodoor_rooms', 'ecoplan_rooms'} の dict。"""
+        if conn is None:
+            return self.db.read(lambda conn: self.occupancy_report(by, start, end, include_active, conn))
+        fmt = self.REPORT_PERIOD_FORMATS[by]
+        first = _day_number(start) if start else -(1 << 31)
+        last = _day_number(end) if end else 1 << 31
+
+        queries = ["""SELECT strftime(?, stat_date * 86400, 'unixepoch'), cleaning_status,
+                             SUM(rooms), SUM(ecodoor_rooms), SUM(ecoplan_rooms)
+                      FROM daily_stats WHERE stat_date BETWEEN ? AND ?
+                      GROUP BY 1, 2"""]
+        if include_active:
+            queries.append("""SELECT strftime(?, s.cleaning_date * 86400, 'unixepoch'), s.cleaning_status,
+                                     COUNT(*), COALESCE(SUM(r.is_ecodoor), 0), COALESCE(SUM(r.is_ecoplan), 0)
+                              FROM cleaning_schedule s LEFT JOIN rooms r ON r.room_number = s.room_number
+                              WHERE s.cleaning_date BETWEEN ? AND ?
+                                AND s.cleaning_status IS NOT NULL AND s.cleaning_status != ''
+                              GROUP BY 1, 2""")
+
+        periods = {}
+        for sql in queries:
+            for period, status, rooms, ecodoor, ecoplan in conn.execute(sql, (fmt, first, last)):
+                entry = periods.setdefault(period, {'period': period, 'statuses': {},
+                                                    'ecodoor_rooms': 0, 'ecoplan_rooms': 0})
+                entry['statuses'][status] = entry['statuses'].get(status, 0) + rooms
+                if status not in ('C/I', 'C/O'):
+                    entry['ecodoor_rooms'] += ecodoor
+                    entry['ecoplan_rooms'] += ecoplan
+
+        report = []
+        for period in sorted(periods):
+            entry = periods[period]
+            statuses = entry['statuses']
+            entry['stayover'] = sum(n for st, n in statuses.items() if st not in ('C/I', 'C/O'))
+            entry['eco'] = sum(statuses.get(st, 0) for st in self.ECO_STATUSES)
+            entry['clean'] = sum(statuses.get(st, 0) for st in self.CLEAN_STATUSES)
+            entry['eco_rate'] = entry['eco'] / entry['stayover'] if entry['stayover'] else None
+            report.append(entry)
+        return report
 
     def load_data(self):
-        cursor = self.conn.cursor()
+        self.db.read(self._load_data)
+        self._model_loaded = True
+
+    def reload_model(self):
+        """records / existing_rooms を DB から読み直す（復元など DB 全体が入れ替わったとき）"""
+        self.records.clear()
+        self.existing_rooms.clear()
+        self.load_data()
+        self.clear_undo()
+        self._notify_change(None)
+
+    def add_change_listener(self, listener):
+        """変更通知 listener(uow) を登録する。uow は UnitOfWork（None はモデル全体の読み直し）"""
+        self.change_listeners.append(listener)
+
+    def _notify_change(self, uow):
+        for listener in list(self.change_listeners):
+            try:
+                listener(uow)
+            except Exception as e:
+                _tracer.event("change_listener", error=f"{type(e).__name__}: {e}")
+
+    def unit_of_work(self, op, func):
+        """func(uow) を1つのトランザクションで実行する。コミット後に、変わった行だけを
+        メモリ上のモデルへ反映して変更通知を送り、func の戻り値を返す。"""
+        appended = []
+
+        def run(conn):
+            uow = UnitOfWork(conn.cursor(), op)
+            result = func(uow)
+            if uow and self.journal is not None:
+                # コミットの前に書く（コミットされずに終了した操作は次回起動時にやり直す）。
+                # 反映済みの通し番号は同じトランザクションで DB に記録する
+                uow.seq = self.journal.append(uow.to_entry())
+                appended.append(uow.seq)
+                conn.execute("UPDATE journal_state SET applied_seq = ? WHERE id = 1", (uow.seq,))
+            return uow, result
+
+        try:
+            uow, result = self.db.write(run)
+        except BaseException:
+            if appended:
+                # ロールバックされた操作は起動時にやり直さない
+                self.journal.append({'op': 'abort', 'aborted': appended[-1]})
+            raise
+        if uow:
+            with _tracer.span("apply_changes", op=op) as span:
+                rooms, schedule = uow.changed()
+                span.set(rooms=len(rooms), cells=len(schedule))
+                self._apply_changes(rooms, schedule)
+            if op in UNDO_OPS:
+                self.undo_stack.append(uow.to_entry())
+                del self.undo_stack[:-UNDO_DEPTH]
+                self.redo_stack.clear()
+            self._notify_change(uow)
+            self._journal_pending()
+        return result
+
+    # --- 整合性チェック ---
+    def _start_integrity(self):
+        """整合性チェックのスレッドを起動して全件の検査を依頼し、以後は書き込みのたびに
+        変わった部屋だけを検査する（環境変数 ECOROOM_INTEGRITY=0 で無効）"""
+        self.integrity = None
+        if os.environ.get(INTEGRITY_ENV, "1") == "0":
+            return
+        self.integrity = IntegrityChecker(self.db, self._integrity_reported)
+        self.add_change_listener(self._schedule_integrity)
+        self.integrity.schedule()
+
+    def _schedule_integrity(self, uow):
+        if uow is None:
+            self.integrity.schedule()
+            return
+        rooms, schedule = uow.changed()
+        self.integrity.schedule(set(rooms) | {room for room, _ in schedule})
+
+    def _integrity_reported(self, issues):
+        """検査結果が変わったとき（検査スレッドから呼ばれる）"""
+        _tracer.event("integrity", issues=len(issues))
+        if not self.headless:
+            self._call_in_ui(self.update_integrity_display)
+
+    def integrity_issues(self, wait=None):
+        """整合性の問題の一覧。wait 秒まで実行中の検査の完了を待つ（無効時はその場で全件検査）"""
+        if self.integrity is None:
+            return self.db.read(IntegrityChecker.find_issues)
+        self.integrity.wait(wait)
+        return self.integrity.issues()
+
+    def close(self):
+        """整合性チェックを止め、ジャーナルに起点を書いて DB を閉じる"""
+        if self.integrity is not None:
+            self.integrity.close()
+        if self.journal is not None:
+            self.journal.checkpoint()
+        self.db.close()
+
+    # --- 元に戻す／やり直す ---
+    def undo(self):
+        """直前の操作の変更前の値を1つのトランザクションで書き戻し、その操作名を返す（無ければ None）"""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack[-1]
+        self._step_entry(entry, forward=False)
+        self.redo_stack.append(self.undo_stack.pop())
+        return entry['op']
+
+    def redo(self):
+        """元に戻した操作をもう一度適用し、その操作名を返す（無ければ None）"""
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack[-1]
+        self._step_entry(entry, forward=True)
+        self.undo_stack.append(self.redo_stack.pop())
+        return entry['op']
+
+    def _step_entry(self, entry, forward):
+        """entry の差分を forward=True なら変更後、False なら変更前の値にする。
+        DB がその操作の直後（直前）のままでなければ ValueError"""
+        current = self._compose_entries([entry], forward=not forward)
+        target = self._compose_entries([entry], forward=forward)
+
+        def apply(uow):
+            if not uow.matches(current['rooms'], current['cells']):
+                raise ValueError("この操作の後にデータが変更されているため、元に戻せません")
+            self._apply_composed(uow, target)
+            uow.meta['step'] = entry['op']
+
+        with _tracer.span("undo" if not forward else "redo", op=entry['op'],
+                          rooms=len(target['rooms']), cells=len(target['cells'])):
+            self.unit_of_work("redo" if forward else "undo", apply)
+
+    def clear_undo(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    # --- 操作ジャーナル ---
+    def _open_journal(self):
+        """DB と同じ名前の .journal.jsonl を開き、コミットされていなかった操作をやり直す
+        （環境変数 ECOROOM_JOURNAL=0 で無効）"""
+        self.journal = None
+        self._pending_snapshot = None
+        if os.environ.get(JOURNAL_ENV, "1") == "0":
+            return
+        self.journal = OperationJournal.for_db(self.db_file)
+        applied = self._journal_applied_seq()
+        if applied is None:
+            # 反映済みの記録が無い DB（旧版）は、今あるジャーナルの操作を全て反映済みとみなす
+            self._set_journal_applied_seq(self.journal.seq)
+        else:
+            self.journal.advance(applied)
+        self.replay_journal()
+
+    def _journal_applied_seq(self):
+        return self.db.read(lambda conn: conn.execute(
+            "SELECT applied_seq FROM journal_state WHERE id = 1").fetchone()[0])
+
+    def _set_journal_applied_seq(self, seq):
+        self.db.write(lambda conn: conn.execute(
+            "UPDATE journal_state SET applied_seq = ? WHERE id = 1", (seq,)))
+
+    def replay_journal(self):
+        """DB に反映済みの通し番号（journal_state）より後の操作のうち、最後の起点
+        （checkpoint / restore）より後で、ロールバックされておらず、DB が変更前のままのものを
+        やり直す。やり直した操作の数を返す。"""
+        entries = self.journal.entries()
+        applied = self._journal_applied_seq() or 0
+        start = max((i for i, e in enumerate(entries) if e.get('op') in JOURNAL_CHECKPOINTS), default=-1)
+        aborted = {e.get('aborted') for e in entries if e.get('op') == 'abort'}
+        tail = [e for e in entries[start + 1:]
+                if 'rooms' in e and e['seq'] > applied and e['seq'] not in aborted]
+        if not tail:
+            return 0
+
+        def redo(uow):
+            count = 0
+            for entry in tail:
+                before = self._compose_entries([entry], forward=False)
+                if uow.matches(before['rooms'], before['cells']):
+                    self._apply_composed(uow, self._compose_entries([entry], forward=True))
+                    count += 1
+            return count
+
+        with _tracer.span("replay_journal", entries=len(tail)) as span:
+            count = self.unit_of_work("replay", redo)
+            span.set(redone=count)
+        return count
+
+    @staticmethod
+    def _compose_entries(entries, forward):
+        """ジャーナルの操作を順に（forward=False なら逆順に取り消して）適用した結果の
+        {'rooms': {部屋番号: 行}, 'cells': {(部屋番号, 日数): ステータス}, 'history': {archive_id: 行 or None}}"""
+        rooms, cells, history = {}, {}, {}
+        for entry in (entries if forward else reversed(entries)):
+            for room, old, new in entry.get('rooms', ()):
+                row = new if forward else old
+                rooms[room] = tuple(row) if row is not None else None
+            for room, day, old, new in entry.get('cells', ()):
+                cells[(room, day)] = new if forward else old
+            meta = entry.get('meta', {})
+            added, removed = meta.get('archived'), meta.get('unarchived')
+            if not forward:
+                added, removed = removed, added
+            for rows, present in ((removed, False), (added, True)):
+                if not rows:
+                    continue
+                grouped = {}
+                for row in rows['rooms']:
+                    grouped.setdefault(row[0], {'rooms': [], 'schedule': []})['rooms'].append(row)
+                for row in rows['schedule']:
+                    grouped.setdefault(row[0], {'rooms': [], 'schedule': []})['schedule'].append(row)
+                for archive_id, group in grouped.items():
+                    history[archive_id] = group if present else None
+        return {'rooms': rooms, 'cells': cells, 'history': history}
+
+    def _apply_composed(self, uow, composed):
+        if composed['history']:
+            self._set_history(uow, composed['history'])
+        uow.restore(composed['rooms'], composed['cells'])
+
+    def journal_positions(self):
+        """戻せる位置の一覧 [(通し番号, 日時, 操作, 部屋数, 日数)]（古い順）"""
+        if self.journal is None:
+            return []
+        return [(e['seq'], e.get('ts', ''), e.get('op', ''), len(e.get('rooms', ())), len(e.get('cells', ())))
+                for e in self.journal.entries() if 'rooms' in e or e.get('op') in JOURNAL_CHECKPOINTS]
+
+    def recover_to(self, seq):
+        """ジャーナルの通し番号 seq の操作の直後の状態まで戻す。
+        それより後の操作の変更前の内容を新しい順に書き戻し（1トランザクション）、
+        未保存の新規登録もその時点のものに戻す。戻した操作も1件の操作として記録される。"""
+        entries = self.journal.entries()
+        if not entries or seq < entries[0]['seq']:
+            raise ValueError("この位置より前には戻せません（バックアップからの復元より前です）")
+        later = [e for e in entries if e['seq'] > seq and 'rooms' in e]
+        composed = self._compose_entries(later, forward=False)
+
+        def apply(uow):
+            self._apply_composed(uow, composed)
+            uow.meta['recovered_to'] = seq
+
+        with _tracer.span("recover_to", seq=seq, entries=len(later)):
+            self.unit_of_work("recover", apply)
+            self.clear_undo()
+            # 未保存の新規登録はその時点の最後のスナップショットに戻す
+            snapshot = next((e for e in reversed(entries) if e['seq'] <= seq and e.get('op') == 'pending'), None)
+            self._replace_pending(snapshot.get('records', []) if snapshot else [])
+        return len(later)
+
+    # --- 未保存の新規登録 ---
+    @staticmethod
+    def _record_to_json(record):
+        return {'room': record['room'], 'guest': record['guest'], 'date': record['date'].strftime('%Y-%m-%d'),
+                'days': record['days'], 'ecodoor': bool(record['ecodoor']), 'ecoplan': bool(record['ecoplan']),
+                'schedule': dict(record['schedule'])}
+
+    @staticmethod
+    def _record_from_json(data):
+        return dict(data, date=datetime.strptime(data['date'], '%Y-%m-%d'), is_new=True)
+
+    def _journal_pending(self):
+        """未保存の新規登録（is_new）の一覧が変わっていればジャーナルに書く"""
+        if self.journal is None or not self._model_loaded:
+            return
+        records = [self._record_to_json(r) for r in self.records if r.get('is_new')]
+        if records != self._pending_snapshot:
+            self.journal.append({'op': 'pending', 'records': records})
+            self._pending_snapshot = records
+
+    def restore_pending_from_journal(self):
+        """ジャーナルの最後のスナップショットから、まだDBに無い新規登録を records に戻す。戻した件数を返す"""
+        if self.journal is None:
+            return 0
+        snapshot = next((e for e in reversed(self.journal.entries()) if e.get('op') == 'pending'), None)
+        if not snapshot:
+            return 0
+        self._pending_snapshot = snapshot.get('records', [])
+        return self._replace_pending(self._pending_snapshot)
+
+    def _replace_pending(self, records):
+        """未保存の新規登録を records（JSON の形）に置き換える。DB に既にある部屋は除く"""
+        if not self._model_loaded:
+            return 0
+        stored = self.db.read(lambda conn: {r for (r,) in conn.execute("SELECT room_number FROM rooms")})
+        self.records[:] = [r for r in self.records if r['room'] in stored or not r.get('is_new')]
+        self.existing_rooms.intersection_update(stored)
+        restored = [self._record_from_json(data) for data in records if data['room'] not in stored]
+        self.records.extend(restored)
+        self.existing_rooms.update(r['room'] for r in restored)
+        self._notify_change(None)
+        self._journal_pending()
+        return len(restored)
+
+    def _apply_changes(self, rooms, schedule):
+        """UnitOfWork の差分をメモリ上のモデル（records / existing_rooms）に反映する"""
+        if not self._model_loaded:
+            return
+        by_room = {record['room']: record for record in self.records}
+        removed = set()
+        for room, (_, row) in rooms.items():
+            record = by_room.get(room)
+            if row is None:
+                removed.add(room)
+                self.existing_rooms.discard(room)
+                continue
+            guest, date_str, days, ecodoor, ecoplan = row
+            if record is None:
+                record = by_room[room] = {'room': room, 'schedule': {}}
+                self.records.append(record)
+            record.update({
+                'guest': guest,
+                'date': datetime.strptime(date_str, '%Y-%m-%d'),
+                'days': days,
+                'ecodoor': bool(ecodoor),
+                'ecoplan': bool(ecoplan),
+                'is_new': False,
+            })
+            self.existing_rooms.add(room)
+
+        reordered = set()
+        for (room, day), (_, status) in schedule.items():
+            record = by_room.get(room)
+            if record is None or room in removed:
+                continue
+            label = _day_label(day)
+            if status is None:
+                record['schedule'].pop(label, None)
+            else:
+                if label not in record['schedule']:
+                    reordered.add(room)
+                record['schedule'][label] = status
+            record['is_new'] = False
+        # 日が増えた部屋はスケジュールを日付順に並べ直す
+        for room in reordered:
+            record = by_room[room]
+            record['schedule'] = {f"{d.month}/{d.day}": status for d, status in
+                                  sorted(self._record_schedule_rows(record), key=lambda item: item[0])}
+        if removed:
+            self.records[:] = [record for record in self.records if record['room'] not in removed]
+
+    def _load_data(self, conn):
+        cursor = conn.cursor()
         cursor.execute("SELECT * FROM rooms ORDER BY CAST(room_number AS INTEGER)")
 
         for row in cursor.fetchall():
@@ -792,9 +4254,8 @@ class HotelCleaningSystem:
             cursor.execute(
                 "SELECT cleaning_date, cleaning_status FROM cleaning_schedule WHERE room_number = ? ORDER BY cleaning_date",
                 (room,))
-            for date_str, status in cursor.fetchall():
-                date = datetime.strptime(date_str, '%Y-%m-%d')
-                record['schedule'][f"{date.month}/{date.day}"] = status
+            for day, status in cursor.fetchall():
+                record['schedule'][_day_label(day)] = status
 
             self.records.append(record)
 
@@ -806,6 +4267,8 @@ class HotelCleaningSystem:
             'yoyaku'    : 予約CSV (cp932/shift_jis, 12列以上)
             'unknown'   : 判定不能
         """
+        import csv
+
         # ① まず utf-8 で開けるか試す（部屋状態CSVは数字とASCIIのみ）
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -847,6 +4310,7 @@ class HotelCleaningSystem:
 
         return 'unknown'
 
+    @_profiled('import_csv')
     def import_csv(self):
         """CSVファイルを読み込んでエコ清掃対象部屋を選択するダイアログを表示。
         部屋状態CSV と 予約CSV はどちらの順番で選択しても自動で振り分ける。
@@ -908,67 +4372,128 @@ class HotelCleaningSystem:
         self.last_room_status_csv = room_status_path
 
         try:
-            # 部屋状態CSVを読み込み
-            eco_rooms = []
-            csv_date = None  # CSV 1行目1列目から取得するチェックイン日
-            with open(room_status_path, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                for i, row in enumerate(reader):
-                    # 1行目1列目から YYYYMMDD 形式の日付を抽出
-                    if i == 0 and len(row) >= 1 and row[0].isdigit() and len(row[0]) == 8:
-                        try:
-                            csv_date = datetime.strptime(row[0], '%Y%m%d')
-                        except ValueError:
-                            csv_date = None
-
-                    if len(row) >= 7:
-                        room_number = row[1]  # 2列目：部屋番号
-                        room_status = row[6]  # 7列目：部屋の状態
-
-                        # 状態が'3'（在室・連泊中＝エコ清掃対象）の部屋のみ抽出
-                        # ※ '1'=未チェックイン、'0'=空室、'2'=チェックアウト は対象外
-                        if room_status == '3':
-                            eco_rooms.append({
-                                'room': room_number,
-                                'status': room_status
-                            })
-
-            if not eco_rooms:
-                messagebox.showinfo("情報", "エコ清掃対象の部屋が見つかりませんでした。")
-                return
+            with _tracer.span("import_csv") as run_span:
+                with _tracer.span("parse_room_status"):
+                    eco_rooms, csv_date = self._read_room_status_csv(room_status_path)
+                run_span.set(eco_rooms=len(eco_rooms))
+
+                if not eco_rooms:
+                    messagebox.showinfo("情報", "エコ清掃対象の部屋が見つかりませんでした。")
+                    return
+
+                # 予約CSVから宿泊者名取得（あれば）
+                guest_name_map = {}
+                if yoyaku_path:
+                    with _tracer.span("load_guest_names"):
+                        guest_name_map = self.load_guest_names_from_yoyaku(yoyaku_path)
+
+                # CSVの日付（=清掃日）に基づき、古いC/O部屋等を自動削除
+                # 起動時に既にバックアップ作成済みのため、ここでは作成しない
+                deleted_info = None
+                if csv_date:
+                    # 削除はメモリ上のモデルにも反映される（同番号の再来があれば「未登録」扱いになる）
+                    deleted_info = self.cleanup_checkout_rooms(csv_date)
+                    if deleted_info['total'] > 0:
+                        self.update_room_count_display()
+
+            if deleted_info and deleted_info['total'] > 0:
+                message = f"CSVの日付に基づき、データ整理を実施しました。\n\n"
+                message += f"✓ 削除された部屋: {deleted_info['total']}件\n"
+                if deleted_info['checkout'] > 0:
+                    message += f"  - チェックアウト完了: {deleted_info['checkout']}件\n"
+                if deleted_info['empty'] > 0:
+                    message += f"  - 空白データ: {deleted_info['empty']}件\n"
+                message += f"✓ 清掃日: {csv_date.strftime('%Y年%m月%d日')}"
 
-            # 予約CSVから宿泊者名取得（あれば）
-            guest_name_map = {}
-            if yoyaku_path:
-                guest_name_map = self.load_guest_names_from_yoyaku(yoyaku_path)
-
-            # CSVの日付（=清掃日）に基づき、古いC/O部屋等を自動削除
-            # 起動時に既にバックアップ作成済みのため、ここでは作成しない
-            if csv_date:
-                deleted_info = self.cleanup_checkout_rooms(csv_date)
-                if deleted_info['total'] > 0:
-                    # データ再読み込み（削除を反映 → 同番号の再来があれば「未登録」扱いになる）
-                    self.records.clear()
-                    self.existing_rooms.clear()
-                    self.load_data()
-                    self.update_room_count_display()
-
-                    message = f"CSVの日付に基づき、データ整理を実施しました。\n\n"
-                    message += f"✓ 削除された部屋: {deleted_info['total']}件\n"
-                    if deleted_info['checkout'] > 0:
-                        message += f"  - チェックアウト完了: {deleted_info['checkout']}件\n"
-                    if deleted_info['empty'] > 0:
-                        message += f"  - 空白データ: {deleted_info['empty']}件\n"
-                    message += f"✓ 清掃日: {csv_date.strftime('%Y年%m月%d日')}"
-
-                    messagebox.showinfo("CSV読込時データ整理", message)
+                messagebox.showinfo("CSV読込時データ整理", message)
 
             # 部屋選択ダイアログを表示
-            self.show_csv_room_selection_dialog(eco_rooms, guest_name_map, csv_date)
+            with _tracer.span("build_selection_dialog", rooms=len(eco_rooms)):
+                self.show_csv_room_selection_dialog(eco_rooms, guest_name_map, csv_date)
 
         except Exception as e:
             messagebox.showerror("エラー", f"CSVファイルの読み込みに失敗しました: {e}")
 
+    def _read_room_status_csv(self, room_status_path):
+        """部屋状態CSVから (エコ清掃対象部屋のリスト, CSV日付) を返す。
+        CSV日付は1行目1列目の YYYYMMDD（無ければ None）。"""
+        import csv
+
+        eco_rooms = []
+        csv_date = None  # CSV 1行目1列目から取得するチェックイン日
+        with open(room_status_path, 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            for i, row in enumerate(reader):
+                # 1行目1列目から YYYYMMDD 形式の日付を抽出
+                if i == 0 and len(row) >= 1 and row[0].isdigit() and len(row[0]) == 8:
+                    try:
+                        csv_date = datetime.strptime(row[0], '%Y%m%d')
+                    except ValueError:
+                        csv_date = None
+
+                if len(row) >= 7:
+                    room_number = row[1]  # 2列目：部屋番号
+                    room_status = row[6]  # 7列目：部屋の状態
+
+                    # 状態が'3'（在室・連泊中＝エコ清掃対象）の部屋のみ抽出
+                    # ※ '1'=未チェックイン、'0'=空室、'2'=チェックアウト は対象外
+                    if room_status == '3':
+                        eco_rooms.append({
+                            'room': room_number,
+                            'status': room_status
+                        })
+        return eco_rooms, csv_date
+
+    def run_daily_pipeline(self, room_status_path, yoyaku_path=None, output_dir=None, template_path=None):
+        """画面の「CSV読込 → 部屋登録 → エコ票作成 → アーニング表出力」を確認なしで行う
+        （フォルダ監視からの自動実行用）。
+
+        部屋状態CSVの日付で C/O 済みの部屋を整理し、エコ清掃対象のうち未登録の部屋を
+        CSVの日付をチェックイン日としてスケジュール規則どおりに登録する。
+        出力先は output_dir（省略時はカレントフォルダ）。テンプレートが見つからなければ
+        アーニング表は出さない。戻り値は処理内容の dict。"""
+        with _tracer.span("run_daily_pipeline", room_status=os.path.basename(room_status_path),
+                          yoyaku=os.path.basename(yoyaku_path) if yoyaku_path else None) as span:
+            eco_rooms, csv_date = self._read_room_status_csv(room_status_path)
+            guests = self.load_guest_names_from_yoyaku(yoyaku_path) if yoyaku_path else {}
+            cleanup = self.cleanup_checkout_rooms(csv_date) if csv_date else None
+
+            checkin = csv_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            rules = self._load_schedule_rules()
+
+            def register(uow):
+                existing = {r for (r,) in uow.cursor.execute("SELECT room_number FROM rooms")}
+                rooms = [room for room in dict.fromkeys(r['room'] for r in eco_rooms) if room not in existing]
+                ecodoor_rooms = [room for room in rooms if self.default_ecodoor(guests.get(room, {}), rules)]
+                records = self.build_stay_records(rooms, checkin, guests, ecodoor_rooms, rules)
+                for record in records:
+                    uow.put_room(record, self._record_schedule_rows(record))
+                return [record['room'] for record in records]
+
+            registered = self.unit_of_work("register", register)
+
+            output_dir = output_dir or os.getcwd()
+            os.makedirs(output_dir, exist_ok=True)
+            stamp = checkin.strftime('%Y%m%d')
+            base, ext = os.path.splitext(os.path.basename(self.excel_file))
+            excel_paths = self.generate_excel(os.path.join(output_dir, f"{base}_{stamp}{ext}"))
+
+            earning = None
+            template_path = template_path or self._find_earning_template()
+            if template_path:
+                earning_path = os.path.join(output_dir, f"アーニング表_出力_{stamp}{os.path.splitext(template_path)[1]}")
+                earning = self.export_earning_table(room_status_path, template_path, earning_path)['output_path']
+            span.set(registered=len(registered), excel=len(excel_paths), earning=bool(earning))
+
+        return {
+            'date': csv_date.strftime('%Y-%m-%d') if csv_date else None,
+            'eco_rooms': len(eco_rooms),
+            'registered': registered,
+            'cleanup': cleanup,
+            'excel': excel_paths,
+            'earning': earning,
+        }
+
     # エコプラン判定キーワード（半角カナのまま比較するため変換前のフィールドに対して照合）
     ECO_PLAN_KEYWORDS = ['長期ﾏﾝｽﾘｰ', '長期割/ｳｨｰｸﾘｰ']
 
@@ -988,10 +4513,45 @@ class HotelCleaningSystem:
         'stay':     '○',
     }
 
+    # 出力完了メッセージでの区分名
+    EARNING_LABELS = {
+        'vacant':   '空室',
+        'pre_ci':   '未チェックイン',
+        'checkout': 'チェックアウト',
+        'ecodoor':  'エコドア',
+        'eco':      'エコ清掃',
+        'stay':     '連泊',
+    }
+
     # エコ清掃・連泊の部屋番号セルを塗る背景色（medium sea green #3cb371）
-    EARNING_GREEN_FILL = PatternFill(
-        start_color="FF3CB371", end_color="FF3CB371", fill_type="solid"
-    )
+    # （テンプレートの styles.xml に単色塗りつぶしとして追記する）
+    EARNING_GREEN_COLOR = "FF3CB371"
+
+    # 区分ごとの塗りつぶし色 (部屋番号セル, 記号セル)。None は塗らない
+    #   エコ清掃・連泊は部屋番号セル、エコ清掃・エコドアは記号欄を色付けする
+    EARNING_FILLS = {
+        'eco':     (EARNING_GREEN_COLOR, EARNING_GREEN_COLOR),
+        'stay':    (EARNING_GREEN_COLOR, None),
+        'ecodoor': (None, EARNING_GREEN_COLOR),
+    }
+
+    # 状態コード -> 区分。状態3は DB の登録状況で区分を分ける
+    #   ecodoor     : DB登録あり かつ is_ecodoor=True
+    #   registered  : DB登録あり（エコドア以外）
+    #   unregistered: DB登録なし
+    # ここに無い状態コードは想定外としてスキップする
+    EARNING_STATUS_KEYS = {
+        '0': 'vacant',
+        '1': 'pre_ci',
+        '2': 'checkout',
+        '3': {'ecodoor': 'ecodoor', 'registered': 'eco', 'unregistered': 'stay'},
+    }
+
+    # 施設ごとの区分・記号・色の上書き設定ファイル（テンプレートまたはDBと同じフォルダ）
+    #   {"marks": {"stay": "連泊"}, "fills": {"stay": {"number": "#3cb371", "mark": null}},
+    #    "status_keys": {"4": "vacant"}}
+    # のように、変えたい項目だけを書けばよい
+    EARNING_RULES_NAME = "earning_rules.json"
 
     # アーニング表テンプレートのファイル名（EcoRoomClean.py と同じフォルダに置く）
     # この名前で見つからない場合は、同フォルダ内の .xlsx を走査して
@@ -1012,49 +4572,183 @@ class HotelCleaningSystem:
             return True
         return False
 
-    def load_guest_names_from_yoyaku(self, file_path):
-        """予約CSVから部屋番号→{'name', 'is_ecoplan'} のマッピングを作成"""
-        guest_map = {}
+    # 予約CSVで使う列（11列目：部屋番号、12列目：名前＋プラン情報）
+    YOYAKU_ROOM_COLUMN = 10
+    YOYAKU_NAME_COLUMN = 11
+    # 同じ部屋の予約が複数あるときの規則（YOYAKU_MERGE_RULES のいずれか）
+    YOYAKU_MERGE = 'last'
+
+    # 新規登録する部屋のスケジュールを作る規則の既定値
+    #   default_nights : 予約CSVからC/O日が取れないときの泊数
+    #   max_nights     : 1部屋に作る泊数の上限
+    #   checkout_column: 予約CSVのC/O日の列（0始まり）。null なら使わず default_nights にする
+    #   middle         : 中日のステータス
+    #   ecodoor_middle : エコドア指定の部屋の中日のステータス
+    #   ecodoor_default: 登録画面でエコドアを最初からONにするか
+    #   plans          : プラン名（予約CSVの12列目の '_' より後ろに含まれる語）ごとの規則
+    #                    clean_every: n 泊ごとに中日を「〇」（通常清掃）にする
+    #                    ecodoor    : この部屋のエコドアの既定（ecodoor_default より優先）
+    SCHEDULE_RULES = {
+        'default_nights': 2,
+        'max_nights': 62,
+        'checkout_column': None,
+        'middle': '×',
+        'ecodoor_middle': 'エコドア',
+        'ecodoor_default': False,
+        'plans': {
+            '長期ﾏﾝｽﾘｰ': {'clean_every': 3},
+        },
+    }
+
+    # 施設ごとのスケジュール規則の上書き設定ファイル（DBと同じフォルダ）
+    SCHEDULE_RULES_NAME = "schedule_rules.json"
+
+    def load_guest_names_from_yoyaku(self, file_path, merge=None):
+        """予約CSVから部屋番号→{'name', 'is_ecoplan', 'plan', 'checkout'} のマッピングを作成。
+        checkout はスケジュール規則の checkout_column から読んだC/O日（無ければ None）。
+        同じ部屋の予約が複数あるときは merge（既定は YOYAKU_MERGE）の規則で1件にする。"""
+        merge = merge or self.YOYAKU_MERGE
+        columns = self._yoyaku_columns()
+        if merge not in YOYAKU_MERGE_RULES:
+            raise ValueError(f"merge は {YOYAKU_MERGE_RULES} のいずれかです: {merge}")
         # 複数のエンコーディングを試行
         encodings = ['cp932', 'shift_jis', 'utf-8']
+        fast = os.environ.get(CSV_FAST_ENV, "1") != "0"
 
         for encoding in encodings:
             try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if len(row) >= 12:
-                            room_number = row[10]  # 11列目：部屋番号
-                            name_field = row[11]   # 12列目：名前＋プラン情報
-
-                            # エコプラン判定は変換前のフィールドに対して行う
-                            # （'長期ﾏﾝｽﾘｰ' などの半角カナをそのまま含むため）
-                            is_ecoplan = self._is_ecoplan(name_field)
-
-                            # '_'の手前までが名前
-                            if '_' in name_field:
-                                guest_name = name_field.split('_')[0]
-                            else:
-                                guest_name = name_field
-
-                            # 半角カナを全角カナに変換（可能であれば）
-                            try:
-                                import unicodedata
-                                guest_name = unicodedata.normalize('NFKC', guest_name)
-                            except Exception:
-                                pass
-
-                            guest_map[room_number] = {
-                                'name': guest_name,
-                                'is_ecoplan': is_ecoplan,
-                            }
+                with _tracer.span("load_guest_names", encoding=encoding, fast=fast) as span:
+                    guest_map = None
+                    if fast:
+                        try:
+                            guest_map = self._read_yoyaku_fast(file_path, encoding, columns, merge, span)
+                        except UnicodeDecodeError:
+                            raise
+                        except (OSError, ValueError) as e:
+                            # mmap できないファイルなどは csv モジュールで読む
+                            span.set(fallback=f"{type(e).__name__}: {e}")
+                    if guest_map is None:
+                        rows = self._read_yoyaku_columns(file_path, encoding, columns)
+                        guest_map = _merge_guest_rows(
+                            {}, ((fields[0], self._guest_entry(*fields[1:])) for fields in rows), merge)
+                    span.set(rooms=len(guest_map))
                 return guest_map
             except (UnicodeDecodeError, Exception):
                 continue
 
-        messagebox.showwarning("警告", "予約CSVの読み込みに失敗しました。宿泊者名なしで続行します。")
+        self._notify("warning", "警告", "予約CSVの読み込みに失敗しました。宿泊者名なしで続行します。")
         return {}
 
+    def _yoyaku_columns(self):
+        """予約CSVから読む列（部屋番号, 名前＋プラン情報[, C/O日]）"""
+        columns = (self.YOYAKU_ROOM_COLUMN, self.YOYAKU_NAME_COLUMN)
+        checkout_column = self._load_schedule_rules().get('checkout_column')
+        if checkout_column is not None:
+            columns += (int(checkout_column),)
+        return columns
+
+    def _read_yoyaku_fast(self, file_path, encoding, columns, merge, span):
+        """scan_csv_columns で予約CSVを読む。大きいファイルはレコードの境目で分割し、
+        別プロセスで並行に読んで（正規化とエコプラン判定を含む）、ファイル順に合わせる。"""
+        workers = CSV_PARSE_WORKERS or os.cpu_count() or 1
+        if workers > 1 and os.path.getsize(file_path) >= CSV_PARALLEL_MIN_BYTES:
+            bounds = csv_chunk_bounds(file_path, workers)
+        else:
+            bounds = [(0, None)]
+        jobs = [(file_path, start, end, encoding, columns, merge) for start, end in bounds]
+        span.set(chunks=len(jobs))
+
+        results = None
+        if len(jobs) > 1:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                from concurrent.futures.process import BrokenProcessPool
+
+                with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+                    # map は投入順に結果を返すので、合わせる順序はファイル順になる
+                    results = list(pool.map(_parse_yoyaku_chunk, jobs))
+            except (OSError, BrokenProcessPool) as e:
+                # 別プロセスが使えない環境ではこのプロセスで読む
+                span.set(parallel_fallback=f"{type(e).__name__}: {e}")
+        if results is None:
+            results = [_parse_yoyaku_chunk(job) for job in jobs]
+
+        guest_map = {}
+        for chunk in results:
+            _merge_guest_rows(guest_map, chunk.items(), merge)
+        return guest_map
+
+    def _read_yoyaku_columns(self, file_path, encoding, columns=None):
+        """csv モジュールで予約CSVを読み、columns（既定は部屋番号, 名前＋プラン情報）の
+        値のタプルのリストを返す"""
+        import csv
+
+        columns = columns or (self.YOYAKU_ROOM_COLUMN, self.YOYAKU_NAME_COLUMN)
+        width = max(columns) + 1
+        rows = []
+        with open(file_path, 'r', encoding=encoding) as f:
+            for row in csv.reader(f):
+                if len(row) >= width:
+                    rows.append(tuple(row[c] for c in columns))
+        return rows
+
+    @classmethod
+    def _guest_entry(cls, name_field, checkout_field=None):
+        """12列目（名前＋プラン情報）と C/O日の列から {'name', 'is_ecoplan', 'plan', 'checkout'} を作る。
+        plan は '_' より後ろ（変換前のまま）、checkout は読めなければ None"""
+        import unicodedata
+
+        # エコプラン判定は変換前のフィールドに対して行う
+        # （'長期ﾏﾝｽﾘｰ' などの半角カナをそのまま含むため）
+        is_ecoplan = cls._is_ecoplan(name_field)
+
+        # '_'の手前までが名前、後ろがプラン情報
+        if '_' in name_field:
+            guest_name, plan = name_field.split('_', 1)
+        else:
+            guest_name, plan = name_field, ''
+
+        # 半角カナを全角カナに変換（可能であれば）
+        try:
+            guest_name = unicodedata.normalize('NFKC', guest_name)
+        except Exception:
+            pass
+
+        return {
+            'name': guest_name,
+            'is_ecoplan': is_ecoplan,
+            'plan': plan,
+            'checkout': _parse_csv_date(checkout_field) if checkout_field else None,
+        }
+
+    def _call_in_ui(self, func, *args):
+        self._ui_calls.put((func, args))
+
+    def _drain_ui_calls(self):
+        while True:
+            try:
+                func, args = self._ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                self._notify("error", "エラー", f"処理中にエラーが発生しました: {e}")
+        self.root.after(50, self._drain_ui_calls)
+
+    def _notify(self, kind, title, message):
+        """利用者への通知。画面があればメッセージボックス、ヘッドレス時は標準出力へ"""
+        if self.headless:
+            print(f"[{title}] {message}")
+            _tracer.event("notify", kind=kind, title=title, message=message)
+            return
+        if kind == "error":
+            messagebox.showerror(title, message)
+        elif kind == "warning":
+            messagebox.showwarning(title, message)
+        else:
+            messagebox.showinfo(title, message)
+
     def _fit_toplevel_to_screen(self, win, want_w, want_h,
                                 min_w=480, min_h=360, margin=70):
         """Toplevelウィンドウの初期サイズを画面に収まる範囲に調整して中央寄せする。
@@ -1114,7 +4808,7 @@ class HotelCleaningSystem:
         # 説明
         info_label = ttk.Label(frame,
                                text=f"CSVから{len(eco_rooms)}件のエコ清掃対象部屋が見つかりました。\n"
-                                    "チェックを入れた部屋を2泊宿泊として登録します。",
+                                    "チェックを入れた部屋をスケジュール規則に従って登録します。",
                                font=("", 13), justify=tk.CENTER)
         info_label.pack(pady=(0, 10))
 
@@ -1253,6 +4947,9 @@ class HotelCleaningSystem:
         ttk.Label(header_frame, text="中日ステータス", font=header_font, anchor="w").grid(row=0, column=4, padx=5, sticky="w")
         ttk.Label(header_frame, text="登録状況", font=header_font, anchor="w").grid(row=0, column=5, padx=5, sticky="w")
 
+        # 泊数・中日・エコドアの既定はスケジュール規則から決める
+        schedule_rules = self._load_schedule_rules()
+
         # 部屋ごとのチェックボックス
         for idx, room_info in enumerate(eco_rooms):
             room_number = room_info['room']
@@ -1266,8 +4963,12 @@ class HotelCleaningSystem:
                 guest_name = guest_info or ''
                 is_ecoplan_guest = False
 
-            # 「状態」列の表示：エコプラン該当者は「エコプラン」、非該当者は空欄
+            # 「状態」列の表示：エコプラン該当者は「エコプラン」、非該当者は空欄。
+            # 予約CSVからC/O日が取れた部屋は泊数も出す
             display_status = 'エコプラン' if is_ecoplan_guest else ''
+            if isinstance(guest_info, dict) and guest_info.get('checkout'):
+                nights = self._stay_nights(default_date, guest_info, schedule_rules)
+                display_status = f"{display_status} {nights}泊".strip()
 
             row_frame = ttk.Frame(scrollable_frame)
             row_frame.pack(fill="x", pady=2)
@@ -1290,9 +4991,9 @@ class HotelCleaningSystem:
             ttk.Label(row_frame, text=guest_name, anchor="w", font=row_font).grid(row=0, column=2, padx=5, sticky="w")
             ttk.Label(row_frame, text=display_status, anchor="w", font=row_font).grid(row=0, column=3, padx=5, sticky="w")
 
-            # エコドア指定チェックボックス（デフォルトはOFF＝「×」）
+            # エコドア指定チェックボックス（既定はスケジュール規則。通常はOFF＝「×」）
             # ※コンボボックスはホイールで値が変わる事故があったためチェックボックスに変更
-            ecodoor_var = tk.BooleanVar(value=False)
+            ecodoor_var = tk.BooleanVar(value=self.default_ecodoor(guest_info, schedule_rules))
             status_vars[room_number] = ecodoor_var
             ecodoor_cb = ttk.Checkbutton(row_frame, text="エコドア", variable=ecodoor_var,
                                          style="Eco.TCheckbutton")
@@ -1315,7 +5016,7 @@ class HotelCleaningSystem:
 
         # ボタン（枠は上部で最下部固定済み。ここでは中身のボタンだけ追加する）
         def register_rooms():
-            """選択された部屋を2泊宿泊として登録"""
+            """選択された部屋をスケジュール規則に従ってまとめて登録"""
             selected_rooms = [room for room, var in check_vars.items() if var.get()]
 
             if not selected_rooms:
@@ -1333,60 +5034,25 @@ class HotelCleaningSystem:
                 messagebox.showerror("エラー", "正しいチェックイン日を入力してください。")
                 return
 
-            registered_count = 0
-
-            for room_number in selected_rooms:
-                # 既存チェック
-                if room_number in self.existing_rooms or any(r['room'] == room_number for r in self.records):
-                    continue
-
-                # 選択されたステータスを取得（チェックボックス: ON=エコドア / OFF=×）
-                is_ecodoor = bool(status_vars[room_number].get())
-                middle_status = "エコドア" if is_ecodoor else "×"
-
-                # 宿泊者名を取得
-                guest_info = guest_name_map.get(room_number, {})
-                if isinstance(guest_info, dict):
-                    guest_name = guest_info.get('name', '')
-                else:
-                    guest_name = guest_info or ''
-
-                # 2泊宿泊として登録
-                record = {
-                    'room': room_number,
-                    'guest': guest_name,
-                    'date': checkin_date,
-                    'days': 2,  # 2泊
-                    'ecodoor': is_ecodoor,
-                    'ecoplan': False,
-                    'schedule': {},
-                    'is_new': True
-                }
-
-                # スケジュール生成（2泊）
-                current = checkin_date
-                for day in range(3):  # 0=C/I, 1=中日, 2=C/O
-                    date_str = f"{current.month}/{current.day}"
-                    if day == 0:
-                        status = "C/I"
-                    elif day == 2:
-                        status = "C/O"
-                    else:
-                        status = middle_status  # 選択されたステータスを使用
-
-                    record['schedule'][date_str] = status
-                    current += timedelta(days=1)
+            # 既存の部屋は除く
+            registered = {r['room'] for r in self.records} | self.existing_rooms
+            new_rooms = [room for room in selected_rooms if room not in registered]
+            # 選択されたステータス（チェックボックス: ON=エコドア / OFF=×）
+            ecodoor_rooms = [room for room in new_rooms if status_vars[room].get()]
 
-                self.records.append(record)
-                self.existing_rooms.add(room_number)
-                registered_count += 1
+            records = self.build_stay_records(new_rooms, checkin_date, guest_name_map,
+                                              ecodoor_rooms, schedule_rules)
+            self.records.extend(records)
+            self.existing_rooms.update(new_rooms)
+            registered_count = len(records)
+            self._journal_pending()
 
             cleanup_bindings()
             dialog.destroy()
 
             if registered_count > 0:
                 messagebox.showinfo("完了",
-                                    f"{registered_count}件の部屋を2泊宿泊として登録しました。\n"
+                                    f"{registered_count}件の部屋を登録しました。\n"
                                     f"チェックイン日: {checkin_date.strftime('%Y年%m月%d日')}\n\n"
                                     "「エコ票作成」ボタンでExcelを生成してください。")
             else:
@@ -1398,6 +5064,95 @@ class HotelCleaningSystem:
         ttk.Button(button_frame, text="キャンセル", style="Eco.TButton",
                    command=lambda: (cleanup_bindings(), dialog.destroy())).pack(side="left", padx=5)
 
+    def _load_schedule_rules(self):
+        """新規登録のスケジュール規則を返す。既定値（SCHEDULE_RULES）に、
+        DBと同じフォルダの schedule_rules.json があればその内容を上書きする
+        （plans はプランごとに上書き）。"""
+        rules = dict(self.SCHEDULE_RULES)
+        rules['plans'] = {plan: dict(rule) for plan, rule in self.SCHEDULE_RULES['plans'].items()}
+        rules['source'] = None
+        path = os.path.join(os.path.dirname(os.path.abspath(self.db_file)), self.SCHEDULE_RULES_NAME)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                custom = json.load(f)
+            for plan, rule in custom.pop('plans', {}).items():
+                rules['plans'].setdefault(plan, {}).update(rule)
+            rules.update(custom)
+            rules['source'] = path
+        return rules
+
+    @staticmethod
+    def _plan_rule(guest, rules):
+        """宿泊者情報のプランに当てはまる規則 (プラン名, 規則)。無ければ (None, {})"""
+        plan = guest.get('plan', '') if isinstance(guest, dict) else ''
+        for name, rule in rules['plans'].items():
+            if name and name in plan:
+                return name, rule
+        return None, {}
+
+    def default_ecodoor(self, guest, rules=None):
+        """登録画面でのエコドアの既定値（プランの規則 → ecodoor_default の順）"""
+        rules = rules or self._load_schedule_rules()
+        return bool(self._plan_rule(guest, rules)[1].get('ecodoor', rules['ecodoor_default']))
+
+    @staticmethod
+    def _stay_nights(checkin_date, guest, rules):
+        """予約のC/O日からの泊数。C/O日が無い・チェックイン日以前なら default_nights"""
+        checkout = guest.get('checkout') if isinstance(guest, dict) else None
+        nights = (checkout.date() - checkin_date.date()).days if checkout else 0
+        if nights <= 0:
+            nights = int(rules['default_nights'])
+        return max(1, min(nights, int(rules['max_nights'])))
+
+    @staticmethod
+    def _stay_pattern(nights, plan_rule, is_ecodoor, rules):
+        """C/I → 中日 → C/O のステータスの並び（nights + 1 日分）。
+        中日はプランの clean_every ごとに「〇」、それ以外はエコドア指定なら
+        ecodoor_middle、指定なしなら middle。"""
+        middle = rules['ecodoor_middle'] if is_ecodoor else rules['middle']
+        clean_every = int(plan_rule.get('clean_every') or 0)
+        pattern = ["C/I"]
+        for night in range(1, nights):
+            pattern.append("〇" if clean_every and night % clean_every == 0 else middle)
+        pattern.append("C/O")
+        return tuple(pattern)
+
+    def build_stay_records(self, rooms, checkin_date, guest_map=None, ecodoor_rooms=(), rules=None):
+        """選択した部屋の新規レコードを、スケジュール規則からまとめて作る。
+        泊数は予約CSVのC/O日（無ければ default_nights）、中日はプランとエコドア指定で決める。
+        日付ラベルとステータスの並びは（泊数, プラン, エコドア）ごとに1回だけ作って使い回す。"""
+        rules = rules or self._load_schedule_rules()
+        guest_map = guest_map or {}
+        ecodoor_rooms = set(ecodoor_rooms)
+        first_day = _day_number(checkin_date)
+        labels = [_day_label(first_day + i) for i in range(int(rules['max_nights']) + 1)]
+        patterns = {}
+
+        records = []
+        for room_number in rooms:
+            guest = guest_map.get(room_number) or {}
+            if not isinstance(guest, dict):
+                # 後方互換：名前だけの文字列
+                guest = {'name': guest}
+            plan, plan_rule = self._plan_rule(guest, rules)
+            nights = self._stay_nights(checkin_date, guest, rules)
+            is_ecodoor = room_number in ecodoor_rooms
+            key = (nights, plan, is_ecodoor)
+            pattern = patterns.get(key)
+            if pattern is None:
+                pattern = patterns[key] = self._stay_pattern(nights, plan_rule, is_ecodoor, rules)
+            records.append({
+                'room': room_number,
+                'guest': guest.get('name', ''),
+                'date': checkin_date,
+                'days': nights,
+                'ecodoor': is_ecodoor,
+                'ecoplan': bool(guest.get('is_ecoplan', False)),
+                'schedule': dict(zip(labels, pattern)),
+                'is_new': True
+            })
+        return records
+
     def create_schedule(self):
         """シンプル化されたエコ票作成"""
         if not self.records:
@@ -1405,120 +5160,219 @@ class HotelCleaningSystem:
             return
 
         try:
-            # 新しいレコードをデータベース保存
-            new_records = [r for r in self.records if r.get('is_new', True)]
-
-            cursor = self.conn.cursor()
-            for record in new_records:
-                cursor.execute('''INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?, ?, ?)''',
-                               (record['room'], record['guest'], record['date'].strftime('%Y-%m-%d'),
-                                record['days'], record['ecodoor'], record['ecoplan']))
-
-                cursor.execute("DELETE FROM cleaning_schedule WHERE room_number = ?", (record['room'],))
-                for date_str, status in record['schedule'].items():
-                    month, day = map(int, date_str.split('/'))
-                    year = record['date'].year
-                    if month < record['date'].month:
-                        year += 1
-                    cleaning_date = datetime(year, month, day)
-                    cursor.execute("INSERT INTO cleaning_schedule VALUES (?, ?, ?)",
-                                   (record['room'], cleaning_date.strftime('%Y-%m-%d'), status))
-
-            self.conn.commit()
-
-            # Excel生成
-            self.generate_excel()
-
-            # データ再読み込み
-            self.records.clear()
-            self.existing_rooms.clear()
-            self.load_data()
-
-            # 新しいレコードのフラグをクリア
-            for record in self.records:
-                record['is_new'] = False
+            with _tracer.span("create_schedule") as run_span:
+                # 新しいレコードをデータベース保存
+                new_records = [r for r in self.records if r.get('is_new', True)]
+                run_span.set(new_records=len(new_records), records=len(self.records))
 
-            self.update_room_count_display()
+                with _tracer.span("save_records"):
+                    def save(uow):
+                        for record in new_records:
+                            uow.put_room(record, self._record_schedule_rows(record))
+
+                    # 保存した行はそのままメモリ上のレコードに反映される（読み直しはしない）
+                    self.unit_of_work("register", save)
 
-            messagebox.showinfo("完了", f"エコ票を作成しました。\n新規登録: {len(new_records)}件")
+                # 新しいレコードのフラグをクリア（変更の無かったレコードも保存済みになる）
+                for record in new_records:
+                    record['is_new'] = False
+                self._journal_pending()
 
-            # Excel ファイルを開く
-            self.open_excel()
+            self.update_room_count_display()
+            self.status_var.set("エコ票を作成しています...")
 
-            # 続けてアーニング表も自動出力する（直前のCSV読込で使った部屋状態CSVを再利用）。
-            # 部屋状態CSVのパスが無い場合は、output_earning_table 内で選択ダイアログが出る。
-            self.output_earning_table(self.last_room_status_csv)
+            # Excel生成（保存後のDBから月ごとに読み込む）は書き出しキューで行い、画面は止めない
+            # プロファイルは時間のかかる書き出し側（キューで動く generate_excel）を対象にする
+            self.launcher.submit(self._profiled_job('create_schedule', self.generate_excel),
+                                 lambda paths, error: self._schedule_generated(len(new_records), paths, error))
 
         except Exception as e:
             messagebox.showerror("エラー", f"処理中にエラーが発生しました: {e}")
 
-    def generate_excel(self):
-        wb = openpyxl.Workbook()
-        wb.remove(wb.active)
-
-        # ソート
-        self.records.sort(key=lambda x: int(x['room']) if x['room'].isdigit() else float('inf'))
+    def _schedule_generated(self, new_count, excel_paths, error):
+        """エコ票の書き出しが終わったとき（Tk のスレッドで呼ばれる）"""
+        self.update_room_count_display()
+        if error is not None:
+            messagebox.showerror("エラー", f"処理中にエラーが発生しました: {error}")
+            return
 
-        # 全レコードから使用されている月を収集
-        months_used = set()
-        for record in self.records:
-            for date_str in record['schedule'].keys():
-                month = int(date_str.split('/')[0])
-                months_used.add(month)
+        message = f"エコ票を作成しました。\n新規登録: {new_count}件"
+        if len(excel_paths) > 1:
+            message += "\n\n四半期ごとに分割しました:\n" + "\n".join(os.path.basename(p) for p in excel_paths)
+        messagebox.showinfo("完了", message)
 
-        # 月ごとにシートを作成
-        for month in sorted(months_used):
-            month_name = f"{month}月"
-            ws = wb.create_sheet(title=month_name)
+        # Excel ファイルを開く（分割したときは保存先のフォルダを開く）。開き終わるのは待たない
+        if len(excel_paths) > 1:
+            self.open_file(os.path.dirname(os.path.abspath(excel_paths[0])))
+        else:
+            self.open_file(excel_paths[0])
+
+        # 続けてアーニング表も自動出力する（直前のCSV読込で使った部屋状態CSVを再利用）。
+        # 部屋状態CSVのパスが無い場合は、output_earning_table 内で選択ダイアログが出る。
+        self.output_earning_table(self.last_room_status_csv)
+
+    def generate_excel(self, path=None, records=None, split=None):
+        """エコ票を出力し、書き出したファイルのパスのリストを返す（path の既定は excel_file）。
+        records を省略すると DB から作成し、前回から変更の無い月は sheet_cache の
+        シートをそのまま使う。records（"M/D" キーのメモリ上のレコード）を渡すと
+        キャッシュを使わずにそれを出力する。
+        split='quarter'（省略時は self.excel_split）なら四半期ごとに別ブックにして
+        「<名前>_<年>Q<n>.xlsx」へ並行して書き出す。"""
+        split = self.excel_split if split is None else split
+        with _tracer.span("generate_excel", from_db=records is None, split=split) as span:
+            if records is None:
+                sheets = self._cached_month_sheets()
+            else:
+                sheets = [(key, _render_month_sheet((*key, rows)))
+                          for key, rows in self._record_month_sheets(records)]
+            span.set(sheets=len(sheets))
+            return self._generate_excel(path or self.excel_file, sheets, split)
 
-            # ヘッダー
-            ws.cell(3, 1, "氏名")
-            ws.cell(3, 3, "部屋番号")
+    @staticmethod
+    def _room_sort_key(room):
+        return int(room) if room.isdigit() else float('inf')
+
+    def _cached_month_sheets(self):
+        """全ての月のシートを [((年, 月), (圧縮済みXML, CRC, サイズ)), ...] で返す。
+        変更のあった月（dirty）とキャッシュに無い月だけ作り直して sheet_cache に保存する。
+          1) 書き込みスレッドで、作り直す月の行を読み込み dirty=2（作成中）にする
+          2) シートを作る（月が多ければ別プロセスで並行に）
+          3) 書き込みスレッドで、作成中に変更されなかった月（dirty=2 のまま）だけ保存する
+        作成中に編集が入った月は dirty=1 に戻るので、古い内容が保存されることはない。"""
+        months, sheets, pending = self.db.write(self._claim_month_sheets)
+
+        if pending:
+            keys = list(pending)
+            jobs = [(year, month, pending[(year, month)]) for year, month in keys]
+            with _tracer.span("build_month_sheets", months=len(jobs)):
+                rendered = None
+                if len(jobs) >= SHEET_PARALLEL_MIN_MONTHS:
+                    try:
+                        from concurrent.futures import ProcessPoolExecutor
 
-            # その月の日数を取得
+                        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+                            rendered = list(pool.map(_render_month_sheet, jobs))
+                    except Exception as e:
+                        # 別プロセスが使えない環境ではこのプロセスで作る
+                        _tracer.event("build_month_sheets", fallback=f"{type(e).__name__}: {e}")
+                if rendered is None:
+                    rendered = [_render_month_sheet(job) for job in jobs]
+            built = dict(zip(keys, rendered))
+            sheets.update(built)
+
+            def store(conn):
+                for (year, month), sheet in built.items():
+                    conn.execute("UPDATE sheet_cache SET layout = ?, dirty = 0, sheet_xml = ?, crc = ?, size = ? "
+                                 "WHERE period = ? AND dirty = 2",
+                                 (SHEET_LAYOUT_VERSION,) + sheet + (year * 100 + month,))
+            self.db.write(store)
+
+        _tracer.event("sheet_cache", rebuilt=len(pending), reused=len(months) - len(pending))
+        return [(key, sheets[key]) for key in months]
+
+    def _claim_month_sheets(self, conn):
+        """(全ての月, 使えるキャッシュ {(年, 月): シート}, 作り直す月 {(年, 月): 行}) を返す"""
+        months = self.schedule_months(conn)
+        cached = {period: (xml, crc, size) for period, xml, crc, size in conn.execute(
+            "SELECT period, sheet_xml, crc, size FROM sheet_cache WHERE dirty = 0 AND layout = ?",
+            (SHEET_LAYOUT_VERSION,))}
+
+        stale = [(year, month) for year, month in months if year * 100 + month not in cached]
+        # 作り直す月の期間をまとめて1つの行列に読み込み、月ごとの行はその切り出しで作る
+        # （NumPy が無ければ月ごとに schedule_between で読む）
+        matrix = None
+        if stale:
             import calendar
-            year = self.records[0]['date'].year if self.records else datetime.now().year
-            days_in_month = calendar.monthrange(year, month)[1]
 
-            # 日付ヘッダー
-            for day in range(1, days_in_month + 1):
-                ws.cell(3, 3 + day, str(day))
+            last_year, last_month = stale[-1]
+            matrix = OccupancyMatrix.from_db(
+                conn, datetime(*stale[0], 1),
+                datetime(last_year, last_month, calendar.monthrange(last_year, last_month)[1]),
+                self._room_sort_key)
+
+        rooms = None
+        sheets = {}
+        pending = {}
+        for year, month in months:
+            period = year * 100 + month
+            if period in cached:
+                sheets[(year, month)] = cached[period]
+                continue
+            if matrix is not None:
+                pending[(year, month)] = matrix.month_rows(year, month)
+            else:
+                if rooms is None:
+                    rooms = {room: (guest, bool(ecoplan)) for room, guest, ecoplan in conn.execute(
+                        "SELECT room_number, guest_name, is_ecoplan FROM rooms")}
+                pending[(year, month)] = self._month_rows(conn, year, month, rooms)
+            conn.execute("INSERT INTO sheet_cache (period, layout, dirty) VALUES (?, ?, 2) "
+                         "ON CONFLICT (period) DO UPDATE SET dirty = 2",
+                         (period, SHEET_LAYOUT_VERSION))
+
+        # スケジュールが無くなった月のキャッシュは捨てる
+        placeholders = ','.join('?' for _ in months)
+        conn.execute(f"DELETE FROM sheet_cache WHERE period NOT IN ({placeholders})",
+                     [y * 100 + m for y, m in months])
+        return months, sheets, pending
+
+    def _month_rows(self, conn, year, month, rooms):
+        """1か月分の行 [(氏名, 部屋番号, エコプラン, {日: ステータス})] を
+        schedule_between でその月の範囲だけ読み込んで作る"""
+        import calendar
+
+        last_day = calendar.monthrange(year, month)[1]
+        days_by_room = {}
+        for date, room, status in self.schedule_between(datetime(year, month, 1),
+                                                        datetime(year, month, last_day), conn):
+            if room in rooms:
+                days_by_room.setdefault(room, {})[date.day] = status
+        return [(rooms[room][0], room, rooms[room][1], days_by_room[room])
+                for room in sorted(days_by_room, key=self._room_sort_key)]
+
+    def _record_month_sheets(self, records):
+        """メモリ上のレコードを _month_rows と同じ形に月ごとにまとめる"""
+        records.sort(key=lambda x: self._room_sort_key(x['room']))
+        months = {}
+        for record in records:
+            for date, status in self._record_schedule_rows(record):
+                rows = months.setdefault((date.year, date.month), {})
+                if record['room'] not in rows:
+                    rows[record['room']] = (record['guest'], record['room'], record['ecoplan'], {})
+                rows[record['room']][3][date.day] = status
+        return [(key, list(months[key].values())) for key in sorted(months)]
+
+    @staticmethod
+    def _sheet_title(year, month, multi_year):
+        """シート名。複数の年にまたがるブックでは年を付ける"""
+        return f"{year}年{month}月" if multi_year else f"{month}月"
+
+    def _generate_excel(self, path, sheets, split=None):
+        """(年, 月) ごとのシートを xlsx に書き出し、書き出したパスのリストを返す"""
+        if split == 'quarter':
+            books = {}
+            for (year, month), sheet in sheets:
+                books.setdefault((year, (month - 1) // 3 + 1), []).append(((year, month), sheet))
+            stem, ext = os.path.splitext(path)
+            jobs = [(f"{stem}_{year}Q{quarter}{ext}", books[(year, quarter)])
+                    for year, quarter in sorted(books)]
+        else:
+            jobs = [(path, sheets)]
+
+        def write(job):
+            book_path, book_sheets = job
+            multi_year = len({year for (year, _), _ in book_sheets}) > 1
+            with _tracer.span("write_workbook", path=os.path.basename(book_path)):
+                _write_eco_workbook(book_path, [(self._sheet_title(year, month, multi_year), sheet)
+                                                for (year, month), sheet in book_sheets])
+            return book_path
 
-            ws.cell(3, 3 + days_in_month + 1, "エコプラン")
+        if len(jobs) == 1:
+            return [write(jobs[0])]
+        # 圧縮とファイル書き込みは GIL を離すので、ブックごとにスレッドで並行に書き出す
+        from concurrent.futures import ThreadPoolExecutor
 
-            # この月にスケジュールがある部屋のみをフィルタ
-            records_this_month = []
-            for record in self.records:
-                has_schedule_this_month = any(
-                    int(date_str.split('/')[0]) == month
-                    for date_str in record['schedule'].keys()
-                )
-                if has_schedule_this_month:
-                    records_this_month.append(record)
-
-            # データ
-            for i, record in enumerate(records_this_month):
-                row = 4 + i
-                ws.cell(row, 1, record['guest'])
-                ws.cell(row, 3, record['room'])
-                ws.cell(row, 3 + days_in_month + 1, "エコプラン" if record['ecoplan'] else "")
-
-                # この月のスケジュールのみ
-                for date_str, status in record['schedule'].items():
-                    if int(date_str.split('/')[0]) == month:
-                        day = int(date_str.split('/')[1])
-                        if day <= days_in_month:
-                            ws.cell(row, 3 + day, status)
-
-            # 列幅調整
-            ws.column_dimensions['A'].width = 12
-            ws.column_dimensions['C'].width = 8
-            for day in range(1, days_in_month + 1):
-                col_letter = openpyxl.utils.get_column_letter(3 + day)
-                ws.column_dimensions[col_letter].width = 6
-
-        wb.save(self.excel_file)
-        wb.close()
+        with ThreadPoolExecutor(max_workers=min(len(jobs), WORKBOOK_WRITE_WORKERS)) as pool:
+            return list(pool.map(write, jobs))
 
     def edit_room(self):
         """部屋の編集"""
@@ -1574,9 +5428,8 @@ class HotelCleaningSystem:
                 return record
 
         # データベースから検索
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM rooms WHERE room_number = ?", (room_number,))
-        row = cursor.fetchone()
+        row = self.db.read(lambda conn: conn.execute(
+            "SELECT * FROM rooms WHERE room_number = ?", (room_number,)).fetchone())
         if row:
             room, guest, date_str, days, ecodoor, ecoplan = row
             return {
@@ -1805,8 +5658,9 @@ class HotelCleaningSystem:
 
                     # 変更用コンボボックス
                     schedule_vars[date_str] = tk.StringVar(value=current_status)
-                    status_combo = ttk.Combobox(row_frame, textvariable=schedule_vars[date_str], width=8)
-                    status_combo['values'] = ('C/I', 'C/O', '〇', '×', 'エコドア')
+                    # 選択肢以外は入力できないようにする（整合性チェックで不正ステータスになるため）
+                    status_combo = ttk.Combobox(row_frame, textvariable=schedule_vars[date_str], width=8,
+                                                values=SCHEDULE_STATUSES, state='readonly')
                     status_combo.grid(row=0, column=2, padx=5, pady=2, sticky="w")
 
                     # C/IとC/Oは固定（変更不可）
@@ -1898,8 +5752,12 @@ class HotelCleaningSystem:
                 'is_new': True
             }
 
-            # 個別に編集されたスケジュールを使用
+            # 個別に編集されたスケジュールを使用（規定外のステータスは保存しない）
             for date_str, var in schedule_vars.items():
+                if var.get() not in SCHEDULE_STATUSES:
+                    messagebox.showerror("エラー", f"{date_str} のステータス「{var.get()}」は使えません。\n"
+                                                 f"{'・'.join(SCHEDULE_STATUSES)} から選んでください")
+                    return
                 updated_record['schedule'][date_str] = var.get()
 
             # メモリ上のレコードを更新
@@ -1910,24 +5768,9 @@ class HotelCleaningSystem:
             else:
                 self.records.append(updated_record)
 
-            # データベースに保存
-            cursor = self.conn.cursor()
-            cursor.execute('''INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?, ?, ?)''',
-                           (updated_record['room'], updated_record['guest'],
-                            updated_record['date'].strftime('%Y-%m-%d'),
-                            updated_record['days'], updated_record['ecodoor'], updated_record['ecoplan']))
-
-            cursor.execute("DELETE FROM cleaning_schedule WHERE room_number = ?", (room_number,))
-            for date_str, status in updated_record['schedule'].items():
-                month, day = map(int, date_str.split('/'))
-                year = updated_record['date'].year
-                if month < updated_record['date'].month:
-                    year += 1
-                cleaning_date = datetime(year, month, day)
-                cursor.execute("INSERT INTO cleaning_schedule VALUES (?, ?, ?)",
-                               (room_number, cleaning_date.strftime('%Y-%m-%d'), status))
-
-            self.conn.commit()
+            # データベースに保存（変わった日の行だけを書き換える）
+            self.unit_of_work("edit", lambda uow: uow.put_room(
+                updated_record, self._record_schedule_rows(updated_record)))
 
             dialog.destroy()
             messagebox.showinfo("成功", f"部屋 {room_number} の情報を更新しました")
@@ -1935,6 +5778,142 @@ class HotelCleaningSystem:
         ttk.Button(button_frame, text="保存", command=save_changes).pack(side="left", padx=5)
         ttk.Button(button_frame, text="キャンセル", command=dialog.destroy).pack(side="left", padx=5)
 
+    @staticmethod
+    def _record_schedule_rows(record):
+        """メモリ上のレコードのスケジュール（"M/D" キー）を [(日付, ステータス), ...] にする。
+        年はチェックイン日の年とし、チェックイン月より前の月は翌年とみなす。"""
+        rows = []
+        for date_str, status in record['schedule'].items():
+            month, day = map(int, date_str.split('/'))
+            year = record['date'].year
+            if month < record['date'].month:
+                year += 1
+            rows.append((datetime(year, month, day), status))
+        return rows
+
+    # 一括変更での部屋の絞り込み（プラン）
+    #   プラン: (rooms テーブルの条件, メモリ上のレコードの判定)
+    BULK_PLAN_FILTERS = {
+        'ecoplan': ("r.is_ecoplan = 1", lambda record: record['ecoplan']),
+        'ecodoor': ("r.is_ecodoor = 1", lambda record: record['ecodoor']),
+        'normal': ("r.is_ecoplan = 0 AND r.is_ecodoor = 0", lambda record: not (record['ecoplan'] or record['ecodoor'])),
+    }
+
+    @staticmethod
+    def _room_floor(room_number):
+        """部屋番号の階（下2桁より上）。数字でない部屋番号は None"""
+        return int(room_number) // 100 if str(room_number).isdigit() else None
+
+    def select_rooms(self, conn=None, floor=None, plan=None, start=None, end=None, rooms=None):
+        """条件に合う登録済みの部屋番号のリスト。
+        floor は階（int または int の集合）、plan は BULK_PLAN_FILTERS のキー、
+        start〜end はその期間にスケジュールがある部屋、rooms は部屋番号の候補。"""
+        if conn is None:
+            return self.db.read(lambda c: self.select_rooms(c, floor, plan, start, end, rooms))
+        # 書き込み中のトランザクションからはカーソルを渡してもよい
+        where, params = [], []
+        if floor is not None:
+            floors = [floor] if isinstance(floor, int) else list(floor)
+            where.append(f"CAST(r.room_number AS INTEGER) / 100 IN ({','.join('?' * len(floors))})"
+                         " AND r.room_number <> '' AND r.room_number NOT GLOB '*[^0-9]*'")
+            params.extend(floors)
+        if plan:
+            if plan not in self.BULK_PLAN_FILTERS:
+                raise ValueError(f"plan は {tuple(self.BULK_PLAN_FILTERS)} のいずれかです: {plan}")
+            where.append(self.BULK_PLAN_FILTERS[plan][0])
+        if start is not None or end is not None:
+            # idx_schedule_room（部屋番号, 日付）の範囲検索で判定する
+            where.append("EXISTS (SELECT 1 FROM cleaning_schedule s WHERE s.room_number = r.room_number"
+                         " AND s.cleaning_date BETWEEN ? AND ?)")
+            params.extend((_day_number(start) if start else -(1 << 31),
+                           _day_number(end) if end else 1 << 31))
+        if rooms is not None:
+            rooms = [str(r) for r in rooms]
+            if not rooms:
+                return []
+            where.append(f"r.room_number IN ({','.join('?' * len(rooms))})")
+            params.extend(rooms)
+        sql = "SELECT r.room_number FROM rooms r"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY CAST(r.room_number AS INTEGER), r.room_number"
+        return [room for (room,) in conn.execute(sql, params)]
+
+    def bulk_set_status(self, status, start, end, floor=None, plan=None, rooms=None, keep_endpoints=True):
+        """条件に合う部屋のスケジュールのうち start〜end の日を status にまとめて変更する。
+        スケジュールの無い日は増やさず、keep_endpoints なら C/I・C/O の日はそのままにする。
+        DB への書き込みは1つのトランザクションで行い、self.records の該当日も書き換える
+        （未保存の新規レコードはメモリ上だけ変更し、エコ票作成時に保存される）。
+        戻り値は {'rooms': 変更した部屋数, 'days': 変更した日数}。"""
+        if status not in SCHEDULE_STATUSES:
+            raise ValueError(f"status は {SCHEDULE_STATUSES} のいずれかです: {status}")
+        if end < start:
+            raise ValueError("終了日は開始日以降である必要があります")
+        first, last = _day_number(start), _day_number(end)
+        skip = ('C/I', 'C/O') if keep_endpoints else ()
+
+        def apply(uow):
+            cursor = uow.cursor
+            stored = {r for (r,) in cursor.execute("SELECT room_number FROM rooms")}
+            selected = self.select_rooms(cursor, floor, plan, start, end, rooms)
+            if not selected:
+                return [], stored
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_rooms (room_number TEXT PRIMARY KEY)")
+            cursor.execute("DELETE FROM bulk_rooms")
+            cursor.executemany("INSERT OR IGNORE INTO bulk_rooms VALUES (?)", [(r,) for r in selected])
+            sql = ("SELECT s.room_number, s.cleaning_date, s.cleaning_status FROM bulk_rooms b"
+                   " JOIN cleaning_schedule s ON s.room_number = b.room_number"
+                   "  AND s.cleaning_date BETWEEN ? AND ?"
+                   " WHERE s.cleaning_status <> ?")
+            if skip:
+                sql += f" AND s.cleaning_status NOT IN ({','.join('?' * len(skip))})"
+            changed = cursor.execute(sql, (first, last, status) + skip).fetchall()
+            cursor.execute("DELETE FROM bulk_rooms")
+            # 変わった日はメモリ上のレコードにも反映される（再読み込みはしない）
+            uow.change_cells([(room, day, old, status) for room, day, old in changed])
+            return changed, stored
+
+        with _tracer.span("bulk_set_status", status=status) as span:
+            changed, stored = self.unit_of_work("bulk", apply)
+            rooms_changed = {room for room, _, _ in changed}
+            days_changed = len(changed)
+
+            # 未保存の新規レコード（DBにまだ無い部屋）は同じ条件でメモリ上だけ変更する
+            pending = [r for r in self.records if r['room'] not in stored]
+            for record in self._filter_records(pending, floor, plan, rooms):
+                for d, current in self._record_schedule_rows(record):
+                    day = _day_number(d)
+                    if first <= day <= last and current != status and current not in skip:
+                        record['schedule'][_day_label(day)] = status
+                        rooms_changed.add(record['room'])
+                        days_changed += 1
+            self._journal_pending()
+            span.set(rooms=len(rooms_changed), days=days_changed)
+        return {'rooms': len(rooms_changed), 'days': days_changed}
+
+    def bulk_target_rooms(self, floor=None, plan=None, start=None, end=None):
+        """一括変更の対象になる部屋番号（登録済み＋未保存の新規レコード）"""
+        targets = set(self.select_rooms(floor=floor, plan=plan, start=start, end=end))
+        first, last = _day_number(start), _day_number(end)
+        for record in self._filter_records(self.records, floor, plan):
+            if any(first <= _day_number(d) <= last for d, _ in self._record_schedule_rows(record)):
+                targets.add(record['room'])
+        return sorted(targets, key=self._room_sort_key)
+
+    def _filter_records(self, records, floor=None, plan=None, rooms=None):
+        """select_rooms と同じ条件（期間以外）でメモリ上のレコードを絞り込む"""
+        floors = None if floor is None else ({floor} if isinstance(floor, int) else set(floor))
+        wanted = None if rooms is None else {str(r) for r in rooms}
+        match_plan = self.BULK_PLAN_FILTERS[plan][1] if plan else None
+        for record in records:
+            if floors is not None and self._room_floor(record['room']) not in floors:
+                continue
+            if wanted is not None and record['room'] not in wanted:
+                continue
+            if match_plan is not None and not match_plan(record):
+                continue
+            yield record
+
     def get_room_schedule(self, room_number):
         """部屋のスケジュールを取得"""
         # メモリから検索
@@ -1943,14 +5922,12 @@ class HotelCleaningSystem:
                 return record.get('schedule', {})
 
         # データベースから検索
-        cursor = self.conn.cursor()
-        cursor.execute(
+        rows = self.db.read(lambda conn: conn.execute(
             "SELECT cleaning_date, cleaning_status FROM cleaning_schedule WHERE room_number = ? ORDER BY cleaning_date",
-            (room_number,))
+            (room_number,)).fetchall())
         schedule = {}
-        for date_str, status in cursor.fetchall():
-            date = datetime.strptime(date_str, '%Y-%m-%d')
-            schedule[f"{date.month}/{date.day}"] = status
+        for day, status in rows:
+            schedule[_day_label(day)] = status
 
         return schedule
 
@@ -1990,9 +5967,8 @@ class HotelCleaningSystem:
                         continue
                     path = os.path.join(d, fname)
                     try:
-                        wb = openpyxl.load_workbook(path, read_only=True)
-                        shidousho = [s for s in wb.sheetnames if '指示書' in s]
-                        wb.close()
+                        # シート名だけ見ればよいので workbook.xml のみ読む
+                        shidousho = [s for s in _xlsx_sheet_names(path) if '指示書' in s]
                         if len(shidousho) >= 2:
                             return path
                     except Exception:
@@ -2002,7 +5978,7 @@ class HotelCleaningSystem:
 
         return None
 
-    def _load_db_registered_rooms(self):
+    def _load_db_registered_rooms(self, conn=None):
         """DBの rooms テーブルに登録されている部屋番号(int)について
         (登録済み集合, エコドア集合) のタプルを返す。
 
@@ -2010,9 +5986,11 @@ class HotelCleaningSystem:
           「エコドア」か「エコ清掃」、含まれていなければ「○（連泊）」。
           さらに is_ecodoor=True の部屋は「エコドア」、それ以外の
           登録部屋は「エコ清掃」として区別する。"""
+        if conn is None:
+            return self.db.read(self._load_db_registered_rooms)
         registered = set()
         ecodoor = set()
-        cursor = self.conn.cursor()
+        cursor = conn.cursor()
         cursor.execute("SELECT room_number, is_ecodoor FROM rooms")
         for room_number, is_ecodoor in cursor.fetchall():
             try:
@@ -2024,26 +6002,63 @@ class HotelCleaningSystem:
                 ecodoor.add(rn)
         return registered, ecodoor
 
-    def _build_instruction_cell_map(self, wb):
-        """【指示書用】シートを走査し {部屋番号(int): (worksheet, 行, 列)} を返す。
-        シート名に「指示書」を含むシートが対象。列レイアウト(A/D/G)に依存せず、
-        3桁以上の数字セルを部屋番号とみなして検出する。"""
-        cell_map = {}
-        for sheet_name in wb.sheetnames:
-            if '指示書' not in sheet_name:
+    def _load_earning_rules(self, template_path=None):
+        """アーニング表の区分・記号・色の設定を返す。
+        既定値（EARNING_MARKS / EARNING_FILLS / EARNING_STATUS_KEYS）に、
+        テンプレートと同じフォルダ（無ければDBと同じフォルダ）の
+        earning_rules.json があればその内容を上書きする。"""
+        rules = {
+            'marks': dict(self.EARNING_MARKS),
+            'fills': {key: {'number': number, 'mark': mark}
+                      for key, (number, mark) in self.EARNING_FILLS.items()},
+            'status_keys': dict(self.EARNING_STATUS_KEYS),
+            'source': None,
+        }
+        dirs = []
+        if template_path:
+            dirs.append(os.path.dirname(os.path.abspath(template_path)))
+        dirs.append(os.path.dirname(os.path.abspath(self.db_file)))
+        for d in dirs:
+            path = os.path.join(d, self.EARNING_RULES_NAME)
+            if not os.path.exists(path):
                 continue
-            ws = wb[sheet_name]
-            for row in ws.iter_rows():
-                for cell in row:
-                    v = cell.value
-                    rn = None
-                    if isinstance(v, int) and v >= 200:
-                        rn = v
-                    elif isinstance(v, str) and v.strip().isdigit() and len(v.strip()) >= 3:
-                        rn = int(v.strip())
-                    if rn is not None:
-                        cell_map[rn] = (ws, cell.row, cell.column)
-        return cell_map
+            with open(path, 'r', encoding='utf-8') as f:
+                custom = json.load(f)
+            rules['marks'].update(custom.get('marks', {}))
+            for key, fill in custom.get('fills', {}).items():
+                rules['fills'].setdefault(key, {'number': None, 'mark': None}).update(fill)
+            rules['status_keys'].update(custom.get('status_keys', {}))
+            rules['source'] = path
+            break
+        return rules
+
+    @staticmethod
+    def _compile_earning_table(rules):
+        """設定から区分表 {(状態コード, DB登録あり, エコドア): (区分, 記号, 番号セル色, 記号セル色)}
+        を作る。部屋ごとの判定はこの表を1回引くだけになる。"""
+        table = {}
+        for status, rule in rules['status_keys'].items():
+            for registered in (False, True):
+                for ecodoor in (False, True):
+                    if isinstance(rule, dict):
+                        if registered and ecodoor:
+                            key = rule.get('ecodoor', rule.get('registered'))
+                        elif registered:
+                            key = rule.get('registered')
+                        else:
+                            key = rule.get('unregistered')
+                    else:
+                        key = rule
+                    if not key:
+                        continue
+                    fill = rules['fills'].get(key, {})
+                    table[(str(status), registered, ecodoor)] = (
+                        key,
+                        rules['marks'].get(key, ''),
+                        _normalize_argb(fill.get('number')),
+                        _normalize_argb(fill.get('mark')),
+                    )
+        return table
 
     def output_earning_table(self, csv_path=None):
         """部屋状態CSVとアーニング表テンプレートから、【指示書用】シートの
@@ -2087,159 +6102,1325 @@ class HotelCleaningSystem:
             if not template_path:
                 return
 
-        try:
-            # CSV読み込み: 部屋番号(int) -> 状態コード、ファイル日付
-            room_status = {}
-            file_date = None
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                for row in csv.reader(f):
-                    if len(row) < 7:
-                        continue
-                    # 1列目の8桁日付をファイル名用に取得
-                    if file_date is None and row[0].isdigit() and len(row[0]) == 8:
-                        file_date = row[0]
-                    raw_room = row[1].strip()
-                    if not raw_room.isdigit():
-                        continue
-                    room_status[int(raw_room)] = row[6].strip()
+        # 書き出しはキューで行い、終わったら結果を表示して開く
+        self.status_var.set("アーニング表を出力しています...")
+        self.launcher.submit(self._profiled_job('output_earning_table',
+                                                lambda: self.export_earning_table(csv_path, template_path)),
+                             self._earning_exported)
 
-            if not room_status:
-                messagebox.showerror("エラー", "CSVから部屋データを読み込めませんでした。")
-                return
+    def _earning_exported(self, result, error):
+        """アーニング表の書き出しが終わったとき（Tk のスレッドで呼ばれる）"""
+        self.update_room_count_display()
+        if isinstance(error, EarningExportError):
+            messagebox.showerror("エラー", str(error))
+            return
+        if error is not None:
+            messagebox.showerror("エラー", f"アーニング表の出力に失敗しました: {error}")
+            return
 
-            # DBに登録されている部屋（状態3はこれに含まれればエコドアorエコ清掃）
-            db_registered, db_ecodoor = self._load_db_registered_rooms()
+        # 結果メッセージ
+        msg = "アーニング表を出力しました。\n\n"
+        msg += f"出力ファイル: {result['output_path']}\n"
+        msg += f"書き込み: {result['written']}室\n"
+        for key, count in result['counts'].items():
+            label = self.EARNING_LABELS.get(key, key)
+            mark = result['marks'].get(key, '')
+            if mark == label:
+                msg += f"\n  {label}: {count}室"
+            else:
+                msg += f"\n  {mark or '（空欄）'} {label}: {count}室"
+        if result['rules_source']:
+            msg += f"\n\n設定: {os.path.basename(result['rules_source'])}"
+        unmatched = result['unmatched']
+        if unmatched:
+            msg += f"\n\n⚠ テンプレートに無い部屋{len(unmatched)}室はスキップしました:\n  {sorted(unmatched)}"
+
+        messagebox.showinfo("出力完了", msg)
+
+        # 出力ファイルをそのまま開く
+        self.open_file(result['output_path'])
+
+    def export_earning_table(self, csv_path, template_path, output_path=None, conn=None):
+        """アーニング表の出力本体（画面を使わない。サービス／一括処理からも呼ぶ）。
+
+        output_path を省略すると「アーニング表_出力_{CSVの日付}.xlsx(.xlsm)」を
+        カレントフォルダに作る。conn を渡すとDB登録状況の読み込みにその接続を使う。
+        利用者に見せるべき失敗は EarningExportError で通知する。
+        戻り値は出力先・書き込み件数・区分ごとの件数などの dict。"""
+        with _tracer.span("output_earning_table") as run_span:
+            # CSV読み込み: 部屋番号(int) -> 状態コード、ファイル日付
+            with _tracer.span("parse_csv"):
+                room_status, file_date = self._read_earning_csv(csv_path)
+            context = self._earning_context(template_path, conn)
+            result = self._write_earning(context, room_status, file_date, output_path)
+            run_span.set(written=result['written'], unmatched=len(result['unmatched']))
+        return result
 
-            # テンプレート読み込み & 指示書用セルマップ作成
-            # .xlsm（マクロ有効ブック）の場合は keep_vba=True でマクロを保持する
-            template_ext = os.path.splitext(template_path)[1].lower()
-            is_macro = (template_ext == '.xlsm')
-            try:
-                wb = openpyxl.load_workbook(template_path, keep_vba=is_macro)
-            except Exception as load_err:
-                messagebox.showerror(
-                    "エラー",
-                    "アーニング表テンプレートを開けませんでした。\n\n"
-                    f"ファイル: {os.path.basename(template_path)}\n"
-                    f"原因: {load_err}\n\n"
-                    "次の点を確認してください。\n"
-                    "・拡張子が .xlsx または .xlsm のExcelファイルか\n"
-                    "・そのファイルをExcelで開いたままにしていないか\n"
-                    "・.xls（旧形式）や .xlsb（バイナリ形式）ではないか"
-                )
-                return
-            cell_map = self._build_instruction_cell_map(wb)
+    @staticmethod
+    def _read_earning_csv(csv_path):
+        """部屋状態CSVから ({部屋番号(int): 状態コード}, 1列目の8桁日付 or None) を返す"""
+        import csv
+
+        room_status = {}
+        file_date = None
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 7:
+                    continue
+                # 1列目の8桁日付をファイル名用に取得
+                if file_date is None and row[0].isdigit() and len(row[0]) == 8:
+                    file_date = row[0]
+                raw_room = row[1].strip()
+                if not raw_room.isdigit():
+                    continue
+                room_status[int(raw_room)] = row[6].strip()
+
+        if not room_status:
+            raise EarningExportError("CSVから部屋データを読み込めませんでした。")
+        return room_status, file_date
+
+    def _earning_context(self, template_path, conn=None):
+        """CSV によらない出力の準備（DB登録状況・テンプレート・セル位置・区分表）を dict で返す。
+        一括出力ではこれを1回だけ作り、各日の出力で使い回す。"""
+        # DBに登録されている部屋（状態3はこれに含まれればエコドアorエコ清掃）
+        with _tracer.span("load_db_registered"):
+            db_registered, db_ecodoor = self._load_db_registered_rooms(conn)
+
+        # テンプレート読み込み & 指示書用セルマップ作成
+        # 【指示書用】シートの XML だけを解釈し、書き出し時もそのシートだけを
+        # 書き換える（.xlsm のマクロや他シートはそのままコピーされる）
+        try:
+            with _tracer.span("load_template", template=os.path.basename(template_path)) as span:
+                template, reused = EarningTemplate.cached(template_path)
+                span.set(cached=reused)
+        except Exception as load_err:
+            raise EarningExportError(
+                "アーニング表テンプレートを開けませんでした。\n\n"
+                f"ファイル: {os.path.basename(template_path)}\n"
+                f"原因: {load_err}\n\n"
+                "次の点を確認してください。\n"
+                "・拡張子が .xlsx または .xlsm のExcelファイルか\n"
+                "・そのファイルをExcelで開いたままにしていないか\n"
+                "・.xls（旧形式）や .xlsb（バイナリ形式）ではないか"
+            )
+        with _tracer.span("build_cell_map"):
+            cell_map = template.build_cell_map()
 
-            if not cell_map:
-                messagebox.showerror(
-                    "エラー",
-                    "テンプレートから【指示書用】シートの部屋番号を認識できませんでした。\n"
-                    "シート名に「指示書」を含むシートがあるか確認してください。"
-                )
-                wb.close()
-                return
+        if not cell_map:
+            raise EarningExportError(
+                "テンプレートから【指示書用】シートの部屋番号を認識できませんでした。\n"
+                "シート名に「指示書」を含むシートがあるか確認してください。"
+            )
+
+        # 区分表（状態コード・DB登録・エコドア → 区分・記号・色）
+        with _tracer.span("compile_rules"):
+            rules = self._load_earning_rules(template_path)
+            table = self._compile_earning_table(rules)
 
-            # 区分ごとのカウンタ
-            counts = {'vacant': 0, 'pre_ci': 0, 'checkout': 0,
-                      'ecodoor': 0, 'eco': 0, 'stay': 0}
-            unmatched = []   # CSVにあるがテンプレートに無い部屋
-            written = 0
+        return {'template': template, 'cell_map': cell_map, 'rules': rules, 'table': table,
+                'db_registered': db_registered, 'db_ecodoor': db_ecodoor}
 
+    @staticmethod
+    def _write_earning(context, room_status, file_date, output_path=None):
+        """準備済みの context で1日分の区分を判定してアーニング表を書き出す
+        （一括出力の別プロセスからも呼ぶため、self を使わない）"""
+        template, cell_map, rules, table = (context['template'], context['cell_map'],
+                                            context['rules'], context['table'])
+        db_registered, db_ecodoor = context['db_registered'], context['db_ecodoor']
+
+        # 全部屋を一括で区分判定し、テンプレート上の位置をシートごとにまとめる
+        unmatched = []   # CSVにあるがテンプレートに無い部屋
+        by_part = {}     # {シート: [(行, 列, 区分表の値), ...]}
+        with _tracer.span("classify", rooms=len(room_status)):
             for room_int, status in room_status.items():
-                if room_int not in cell_map:
+                pos = cell_map.get(room_int)
+                if pos is None:
                     unmatched.append(room_int)
                     continue
-
-                # 状態コード -> 区分判定
-                if status == '0':
-                    key = 'vacant'
-                elif status == '1':
-                    key = 'pre_ci'
-                elif status == '2':
-                    key = 'checkout'
-                elif status == '3':
-                    # 状態3：DB登録あり → エコドア(is_ecodoor) / エコ清掃、
-                    #        登録なし → ○（連泊）
-                    if room_int in db_registered:
-                        key = 'ecodoor' if room_int in db_ecodoor else 'eco'
-                    else:
-                        key = 'stay'
-                else:
+                entry = table.get((status, room_int in db_registered, room_int in db_ecodoor))
+                if entry is None:
                     # 想定外の状態コードはスキップ
                     continue
+                part, r, c = pos
+                by_part.setdefault(part, []).append((r, c, entry))
+
+        # 区分ごとのカウンタ
+        counts = {key: 0 for key in rules['marks']}
+        for key, *_ in table.values():
+            counts.setdefault(key, 0)
+        written = 0
+
+        # 書き換え内容をシートごとに作る {シート: {(行, 列): 内容}}
+        patches = {}
+        with _tracer.span("build_patches", sheets=len(by_part)):
+            for part, items in by_part.items():
+                cells = patches[part] = {}
+                for r, c, (key, mark, number_fill, mark_fill) in items:
+                    # 番号セルの2つ隣に記号を書き込み、必要なら記号欄も色付け
+                    cell = cells.setdefault((r, c + 2), {'value': _KEEP_VALUE})
+                    cell['value'] = mark
+                    if mark_fill:
+                        cell['fill'] = mark_fill
+                    # 部屋番号セルの色付け
+                    if number_fill:
+                        cells.setdefault((r, c), {'value': _KEEP_VALUE})['fill'] = number_fill
+                    counts[key] += 1
+                    written += 1
+
+        # 出力ファイル名（日付入り）。テンプレートが.xlsmならマクロ保持のため.xlsmで保存
+        date_part = file_date if file_date else datetime.now().strftime('%Y%m%d')
+        if output_path is None:
+            output_path = HotelCleaningSystem._earning_output_name(date_part, template.is_macro)
+        with _tracer.span("write_parts", sheets=len(patches)):
+            template.export(patches, output_path)
+
+        return {
+            'output_path': output_path,
+            'date': date_part,
+            'written': written,
+            'counts': counts,
+            'marks': rules['marks'],
+            'rules_source': rules['source'],
+            'unmatched': unmatched,
+            'is_macro': template.is_macro,
+        }
 
-                ws, r, c = cell_map[room_int]
-                mark_cell = ws.cell(r, c + 2, self.EARNING_MARKS[key])  # 番号セルの2つ隣に書き込み
-
-                # エコ清掃・連泊は部屋番号セルを #3cb371 で色付け
-                if key in ('eco', 'stay'):
-                    ws.cell(r, c).fill = self.EARNING_GREEN_FILL
-                # エコ清掃・エコドアは記号欄（「エコ清掃」「エコドア」）も #3cb371 で色付け
-                if key in ('eco', 'ecodoor'):
-                    mark_cell.fill = self.EARNING_GREEN_FILL
-
-                counts[key] += 1
-                written += 1
-
-            # 出力ファイル名（日付入り）
-            # 出力ファイル名（日付入り）。テンプレートが.xlsmならマクロ保持のため.xlsmで保存
-            date_part = file_date if file_date else datetime.now().strftime('%Y%m%d')
-            out_ext = '.xlsm' if is_macro else '.xlsx'
-            output_path = f"アーニング表_出力_{date_part}{out_ext}"
-            wb.save(output_path)
-            wb.close()
-
-            # 結果メッセージ
-            msg = "アーニング表を出力しました。\n\n"
-            msg += f"出力ファイル: {output_path}\n"
-            msg += f"書き込み: {written}室\n\n"
-            msg += f"  × 空室: {counts['vacant']}室\n"
-            msg += f"  未C/I 未チェックイン: {counts['pre_ci']}室\n"
-            msg += f"  （空欄）チェックアウト: {counts['checkout']}室\n"
-            msg += f"  エコドア: {counts['ecodoor']}室\n"
-            msg += f"  エコ清掃: {counts['eco']}室\n"
-            msg += f"  ○ 連泊: {counts['stay']}室"
-            if unmatched:
-                msg += f"\n\n⚠ テンプレートに無い部屋{len(unmatched)}室はスキップしました:\n  {sorted(unmatched)}"
-
-            messagebox.showinfo("出力完了", msg)
-
-            # 出力ファイルをそのまま開く
-            self.open_file(output_path)
+    @staticmethod
+    def _earning_output_name(date_part, is_macro):
+        return f"アーニング表_出力_{date_part}{'.xlsm' if is_macro else '.xlsx'}"
 
-        except Exception as e:
-            messagebox.showerror("エラー", f"アーニング表の出力に失敗しました: {e}")
+    def room_status_csvs(self, source, start=None, end=None):
+        """source（フォルダ、またはCSVのパスのリスト）の部屋状態CSVを
+        [(日付 YYYYMMDD, パス), ...] の日付順で返す。start〜end（datetime）で絞り込み、
+        同じ日付のCSVが複数あれば更新日時の新しいものを使う。"""
+        import csv
 
-    def open_file(self, path):
-        """指定したファイルを既定のアプリで開く"""
-        try:
-            if platform.system() == "Darwin":
-                subprocess.call(("open", path))
-            elif platform.system() == "Windows":
-                os.startfile(path)
-            else:
-                subprocess.call(("xdg-open", path))
-        except Exception as e:
-            messagebox.showerror("エラー", f"ファイルを開けませんでした: {e}")
+        if isinstance(source, str):
+            paths = sorted(glob.glob(os.path.join(source, "*.csv")) + glob.glob(os.path.join(source, "*.CSV")))
+        else:
+            paths = list(source)
+        first = start.strftime('%Y%m%d') if start else None
+        last = end.strftime('%Y%m%d') if end else None
+        by_date = {}
+        for path in paths:
+            if self.detect_csv_type(path) != 'room_status':
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                date_part = next((row[0] for row in csv.reader(f)
+                                  if row and row[0].isdigit() and len(row[0]) == 8), None)
+            if date_part is None:
+                continue
+            if (first and date_part < first) or (last and date_part > last):
+                continue
+            if date_part not in by_date or os.path.getmtime(path) >= os.path.getmtime(by_date[date_part]):
+                by_date[date_part] = path
+        return sorted(by_date.items())
+
+    def export_earning_batch(self, source, template_path, output_dir=None, start=None, end=None):
+        """複数日の部屋状態CSV（フォルダ、またはパスのリスト）からアーニング表をまとめて出力する。
+        テンプレートの読み込み・セル位置・区分表・DB登録状況は1回だけ準備し、各日の書き出しは
+        日数が多ければ別プロセスで並行に行う。出力先 output_dir（省略時はカレントフォルダ）に
+        各日のファイルと日別件数の集計CSV（アーニング表_集計_{最初の日}_{最後の日}.csv）を作る。
+        戻り値は {'days': [各日の結果], 'errors': [(CSVのパス, メッセージ)], 'summary_path'}。"""
+        days = self.room_status_csvs(source, start, end)
+        if not days:
+            raise EarningExportError("対象の部屋状態CSVが見つかりませんでした。")
+        output_dir = output_dir or os.getcwd()
+        os.makedirs(output_dir, exist_ok=True)
+
+        with _tracer.span("export_earning_batch", days=len(days)) as span:
+            context = self._earning_context(template_path)
+            is_macro = context['template'].is_macro
+            jobs = [(path, os.path.join(output_dir, self._earning_output_name(date_part, is_macro)))
+                    for date_part, path in days]
+
+            workers = min(len(jobs), EARNING_BATCH_WORKERS or os.cpu_count() or 1)
+            results = None
+            if workers > 1 and len(jobs) >= EARNING_BATCH_MIN_DAYS:
+                try:
+                    from concurrent.futures import ProcessPoolExecutor
+                    from concurrent.futures.process import BrokenProcessPool
+
+                    with ProcessPoolExecutor(max_workers=workers, initializer=_init_earning_batch,
+                                             initargs=(context,)) as pool:
+                        results = list(pool.map(_earning_batch_job, jobs))
+                    span.set(workers=workers)
+                except (OSError, BrokenProcessPool) as e:
+                    # 別プロセスが使えない環境ではこのプロセスで書き出す
+                    span.set(parallel_fallback=f"{type(e).__name__}: {e}")
+            if results is None:
+                _init_earning_batch(context)
+                results = [_earning_batch_job(job) for job in jobs]
+
+            done = [result for _, result, _ in results if result is not None]
+            errors = [(path, message) for path, _, message in results if message is not None]
+            summary_path = self._write_earning_summary(output_dir, done)
+            span.set(written=len(done), errors=len(errors))
+        return {'days': done, 'errors': errors, 'summary_path': summary_path}
+
+    def _write_earning_summary(self, output_dir, results):
+        """日別・区分別の件数の集計CSV（Excel で開けるよう BOM 付き UTF-8）を書き、パスを返す"""
+        import csv
+
+        if not results:
+            return None
+        keys = [key for key in self.EARNING_LABELS if any(key in r['counts'] for r in results)]
+        keys += sorted({key for r in results for key in r['counts']} - set(keys))
+        path = os.path.join(output_dir, f"アーニング表_集計_{results[0]['date']}_{results[-1]['date']}.csv")
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["日付"] + [self.EARNING_LABELS.get(key, key) for key in keys]
+                            + ["書き込み", "テンプレートに無い部屋", "出力ファイル"])
+            for r in results:
+                writer.writerow([r['date']] + [r['counts'].get(key, 0) for key in keys]
+                                + [r['written'], len(r['unmatched']), os.path.basename(r['output_path'])])
+            writer.writerow(["合計"] + [sum(r['counts'].get(key, 0) for r in results) for key in keys]
+                            + [sum(r['written'] for r in results), "", ""])
+        return path
+
+    def output_earning_batch(self):
+        """フォルダ内の部屋状態CSVからアーニング表をまとめて出力する（画面用）"""
+        folder = filedialog.askdirectory(title="部屋状態CSVのフォルダを選択")
+        if not folder:
+            return
+        template_path = self._find_earning_template() or filedialog.askopenfilename(
+            title="アーニング表テンプレートを選択")
+        if not template_path:
+            return
+        output_dir = os.path.join(folder, "アーニング表_出力")
+        self.status_var.set("アーニング表を一括出力しています...")
+        self.launcher.submit(lambda: self.export_earning_batch(folder, template_path, output_dir),
+                             self._earning_batch_exported)
+
+    def _earning_batch_exported(self, result, error):
+        """一括出力が終わったとき（Tk のスレッドで呼ばれる）"""
+        self.update_room_count_display()
+        if error is not None:
+            messagebox.showerror("エラー", str(error) if isinstance(error, EarningExportError)
+                                 else f"アーニング表の一括出力に失敗しました: {error}")
+            return
+        msg = f"アーニング表を{len(result['days'])}日分出力しました。"
+        if result['summary_path']:
+            msg += f"\n\n集計: {os.path.basename(result['summary_path'])}"
+        if result['errors']:
+            msg += f"\n\n⚠ 出力できなかったCSV {len(result['errors'])}件:"
+            for path, message in result['errors'][:5]:
+                msg += f"\n  {os.path.basename(path)}: {message.splitlines()[0]}"
+        messagebox.showinfo("一括出力完了", msg)
+        if result['summary_path']:
+            self.open_file(os.path.dirname(result['summary_path']))
+
+    # 列指向エクスポートでの清掃ステータス → アーニング表の区分（EARNING_MARKS のキー）
+    EXPORT_EARNING_KEYS = {'C/I': 'pre_ci', 'C/O': 'checkout', 'エコドア': 'ecodoor', '×': 'eco', '〇': 'stay'}
+
+    def export_columnar(self, output_dir, fmt=None, start=None, end=None, chunk_rows=COLUMNAR_CHUNK_ROWS):
+        """部屋・清掃スケジュール・日ごとのアーニング区分を、分析用の列指向ファイルに書き出す。
+
+        形式は parquet（pyarrow）／npz（NumPy）／csv で、省略すると使えるものを選ぶ。
+        履歴テーブルに移した過去の部屋も archived=True として含め、start〜end（datetime、
+        省略可）の日だけを出す。DB からは chunk_rows 行ずつ読んで書き足すため、
+        期間が長くてもメモリ使用量は一定。複数施設の出力をまとめやすいよう、
+        各行に施設名（DBファイル名）を付け、ファイル名も「<施設名>_<表>.<拡張子>」にする。
+        戻り値は {'format', 'files': {表: パス}, 'rows': {表: 行数}}。"""
+        fmt = _columnar_format(fmt)
+        sink_class, ext = _COLUMNAR_SINKS[fmt]
+        prop = os.path.splitext(os.path.basename(self.db_file))[0]
+        first = _day_number(start) if start else -(1 << 31)
+        last = _day_number(end) if end else (1 << 31) - 1
+        check_in = "CAST(julianday(check_in_date) - 2440587.5 AS INTEGER)"
+        case = " ".join("WHEN ? THEN ?" for _ in self.EXPORT_EARNING_KEYS)
+        case_params = [v for item in self.EXPORT_EARNING_KEYS.items() for v in item]
+
+        tables = {
+            'rooms': (
+                [('property', 'str'), ('room_number', 'str'), ('guest_name', 'str'), ('check_in_date', 'day'),
+                 ('cleaning_days', 'int'), ('is_ecodoor', 'bool'), ('is_ecoplan', 'bool'), ('archived', 'bool')],
+                f"""SELECT * FROM (
+                        SELECT ?, room_number, guest_name, {check_in} AS day, cleaning_days,
+                               is_ecodoor, is_ecoplan, 0 FROM rooms
+                        UNION ALL
+                        SELECT ?, room_number, guest_name, {check_in}, cleaning_days,
+                               is_ecodoor, is_ecoplan, 1 FROM rooms_history)
+                    WHERE day + cleaning_days >= ? AND day <= ?""",
+                [prop, prop, first, last]),
+            'schedule': (
+                [('property', 'str'), ('room_number', 'str'), ('cleaning_date', 'day'),
+                 ('cleaning_status', 'str'), ('archived', 'bool')],
+                """SELECT ?, room_number, cleaning_date, cleaning_status, 0 FROM cleaning_schedule
+                   WHERE cleaning_date BETWEEN ? AND ?
+                   UNION ALL
+                   SELECT ?, room_number, cleaning_date, cleaning_status, 1 FROM cleaning_schedule_history
+                   WHERE cleaning_date BETWEEN ? AND ?""",
+                [prop, first, last, prop, first, last]),
+            'earning': (
+                [('property', 'str'), ('date', 'day'), ('room_number', 'str'), ('earning_class', 'str')],
+                f"""SELECT ?, cleaning_date, room_number, CASE cleaning_status {case} END FROM cleaning_schedule
+                    WHERE cleaning_date BETWEEN ? AND ?
+                    UNION ALL
+                    SELECT ?, cleaning_date, room_number, CASE cleaning_status {case} END
+                    FROM cleaning_schedule_history WHERE cleaning_date BETWEEN ? AND ?""",
+                [prop] + case_params + [first, last, prop] + case_params + [first, last]),
+        }
+
+        os.makedirs(output_dir, exist_ok=True)
+        files, counts = {}, {}
+        with _tracer.span("export_columnar", format=fmt) as span:
+            try:
+                for name, (columns, sql, params) in tables.items():
+                    path = os.path.join(output_dir, f"{prop}_{name}{ext}")
+                    files[name] = path
+
+                    def stream(conn):
+                        sink = sink_class(path, columns)
+                        count = 0
+                        try:
+                            cursor = conn.execute(sql, params)
+                            while True:
+                                rows = cursor.fetchmany(chunk_rows)
+                                if not rows:
+                                    break
+                                sink.write(rows)
+                                count += len(rows)
+                        except BaseException:
+                            # 途中で失敗したら閉じるだけにする（後始末のエラーで元の例外を隠さない）
+                            try:
+                                sink.close()
+                            except Exception:
+                                pass
+                            raise
+                        sink.close()
+                        return count
+
+                    with _tracer.span("export_table", table=name):
+                        counts[name] = self.db.read(stream)
+            except BaseException:
+                # 書きかけのファイルとこの回で書き終えた表を消し、
+                # 失敗した書き出しが完了したもののように見えないようにする
+                for path in files.values():
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                raise
+            span.set(**counts)
+        return {'format': fmt, 'files': files, 'rows': counts}
+
+    def open_file(self, path, on_opened=None):
+        """指定したファイルを既定のアプリで開く（起動を待たずに戻る）。
+        開けたら on_opened(path) を呼び、失敗したらエラーを表示する。"""
+        def done(returncode, error):
+            if error is not None:
+                self._notify("error", "エラー", f"ファイルを開けませんでした: {error}")
+            elif on_opened is not None:
+                on_opened(path)
+
+        self.launcher.open(path, done)
 
     def open_excel(self):
         """エクセルファイルを開く"""
-        try:
-            if platform.system() == "Darwin":
-                subprocess.call(("open", self.excel_file))
-            elif platform.system() == "Windows":
-                os.startfile(self.excel_file)
-            else:
-                subprocess.call(("xdg-open", self.excel_file))
-        except Exception as e:
-            messagebox.showerror("エラー", f"ファイルを開けませんでした: {e}")
+        self.open_file(self.excel_file)
 
     def run(self):
         """アプリケーションの実行"""
-        self.root.protocol("WM_DELETE_WINDOW", lambda: (self.conn.close(), self.root.destroy()))
+        self.root.protocol("WM_DELETE_WINDOW", lambda: (self.close(), self.root.destroy()))
         self.root.mainloop()
 
 
+
+# ------------------------------------------------------------
+# サービスモード（ローカル HTTP/JSON API）
+#   フロント・清掃タブレット・PMS連携から同じデータを使えるよう、
+#   エンジン（ヘッドレスの HotelCleaningSystem）を asyncio の HTTP サーバで公開する。
+#     python EcoRoomClean.py --serve [--host 127.0.0.1] [--port 8765]
+#   DBアクセスはエンジンの ConnectionManager 経由（参照は並行・書き込みは直列）。
+#   一覧やエコ票は書き込み世代ごとにキャッシュする。
+# ------------------------------------------------------------
+SERVICE_DEFAULT_PORT = 8765
+SERVICE_WORKERS = 8
+# アップロードできるCSVの上限（予約CSVはチェーン全体だと大きいため余裕を持たせる）
+SERVICE_MAX_BODY = 1024 * 1024 * 1024
+
+_HTTP_REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request",
+                 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+                 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ServiceError(Exception):
+    """HTTP のエラー応答にする例外"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class EcoRoomService:
+    """エンジンを HTTP/JSON で公開するサービス。
+
+    エンドポイント:
+      GET    /api/health                  稼働確認
+      GET    /api/rooms                   部屋とスケジュールの一覧
+      GET    /api/rooms/{部屋番号}         1部屋の詳細
+      PUT    /api/rooms/{部屋番号}         部屋の登録・編集（JSON）
+      DELETE /api/rooms/{部屋番号}         部屋の削除
+      GET    /api/schedules?start=&end=   期間内の清掃スケジュール
+      POST   /api/csv/room-status         部屋状態CSVのアップロード（本文にCSVそのまま）
+      POST   /api/csv/reservation         予約CSVのアップロード（本文にCSVそのまま）
+      GET    /api/eco-rooms               直近の部屋状態CSVのエコ清掃対象部屋
+      POST   /api/rooms/register          エコ清掃対象部屋をスケジュール規則で一括登録（JSON）
+      POST   /api/rooms/bulk              階・プラン・期間で絞り込んだ部屋のステータスを一括変更（JSON）
+      GET    /api/eco-sheet[?split=quarter]  エコ票(xlsx)のダウンロード（分割時は zip）
+      GET    /api/reports?by=month|year   月別・年別の清掃実績（エコ率など）
+      GET    /api/integrity               整合性チェックで見つかった問題の一覧
+      GET    /api/earning                 アーニング表のダウンロード（直近の部屋状態CSVを使用）
+      POST   /api/earning                 本文の部屋状態CSVでアーニング表を作成してダウンロード
+    """
+
+    def __init__(self, db_file=None, template_path=None, workers=SERVICE_WORKERS):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.engine = HotelCleaningSystem(headless=True, db_file=db_file)
+        self.db = self.engine.db
+        self.template_path = template_path
+        self.upload_dir = os.path.join(os.path.dirname(os.path.abspath(self.engine.db_file)), "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # ハンドラはスレッドで実行する（書き込みは ConnectionManager 内で直列化される）
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ecoroom-service")
+        self._generation = 0
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self.last_room_status_csv = None
+        self.last_reservation_csv = None
+        self.server = None
+        self.loop = None
+
+        self.routes = [
+            ("GET", r"/api/health", self.health, False),
+            ("GET", r"/api/rooms", self.list_rooms, False),
+            ("POST", r"/api/rooms/register", self.register_rooms, True),
+            ("POST", r"/api/rooms/bulk", self.bulk_update, True),
+            ("POST", r"/api/undo", self.undo, True),
+            ("POST", r"/api/redo", self.redo, True),
+            ("GET", r"/api/rooms/(?P<room>[^/]+)", self.get_room, False),
+            ("PUT", r"/api/rooms/(?P<room>[^/]+)", self.put_room, True),
+            ("DELETE", r"/api/rooms/(?P<room>[^/]+)", self.delete_room, True),
+            ("GET", r"/api/schedules", self.list_schedules, False),
+            ("POST", r"/api/csv/room-status", self.upload_room_status, True),
+            ("POST", r"/api/csv/reservation", self.upload_reservation, True),
+            ("GET", r"/api/eco-rooms", self.eco_rooms, False),
+            ("GET", r"/api/eco-sheet", self.eco_sheet, False),
+            ("GET", r"/api/reports", self.reports, False),
+            ("GET", r"/api/integrity", self.integrity, False),
+            ("GET", r"/api/earning", self.earning, False),
+            ("POST", r"/api/earning", self.earning, False),
+        ]
+        self.routes = [(m, re.compile(p + r"$"), h, w) for m, p, h, w in self.routes]
+
+    # --- 起動・停止 ---
+    async def start(self, host="127.0.0.1", port=SERVICE_DEFAULT_PORT):
+        import asyncio
+
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle_client, host, port)
+        # 起動直後の一覧要求が速いよう、キャッシュを温めておく
+        await self.loop.run_in_executor(self._workers, self._cached, "rooms", self._load_rooms_json)
+        return self.server.sockets[0].getsockname()[1]
+
+    def serve_forever(self, host="127.0.0.1", port=SERVICE_DEFAULT_PORT):
+        import asyncio
+
+        async def main():
+            bound = await self.start(host, port)
+            print(f"EcoRoom サービス起動: http://{host}:{bound}/api/health")
+            async with self.server:
+                await self.server.serve_forever()
+
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def start_background(self, host="127.0.0.1", port=0):
+        """別スレッドでサービスを起動し、待ち受けポート番号を返す（ローカル検証用）"""
+        import asyncio
+
+        ready = threading.Event()
+        state = {}
+
+        def run():
+            async def main():
+                state['port'] = await self.start(host, port)
+                ready.set()
+                async with self.server:
+                    try:
+                        await self.server.serve_forever()
+                    except asyncio.CancelledError:
+                        pass
+            asyncio.run(main())
+
+        thread = threading.Thread(target=run, name="ecoroom-service", daemon=True)
+        thread.start()
+        ready.wait(10)
+        return state.get('port')
+
+    def stop(self):
+        if self.server is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    def close(self):
+        self.stop()
+        self._workers.shutdown(wait=True)
+        self.engine.close()
+
+    # --- HTTP 処理 ---
+    async def _handle_client(self, reader, writer):
+        import asyncio
+        from urllib.parse import urlsplit, parse_qs, unquote
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line or not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {'error': "不正なリクエストです"}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == "HTTP/1.1"
+                              and headers.get("connection", "").lower() != "close")
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._send(writer, 400, {'error': "Content-Length が不正です"}, False)
+                    break
+                if length > SERVICE_MAX_BODY:
+                    await self._send(writer, 413, {'error': "アップロードが大きすぎます"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                url = urlsplit(target)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                status, payload, extra = await self._dispatch(method.upper(), unquote(url.path),
+                                                              query, body)
+                await self._send(writer, status, payload, keep_alive, extra)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, query, body):
+        path_matched = False
+        for route_method, pattern, handler, is_write in self.routes:
+            m = pattern.match(path)
+            if not m:
+                continue
+            path_matched = True
+            if route_method != method:
+                continue
+            try:
+                with _tracer.span("service", method=method, path=path):
+                    result = await self.loop.run_in_executor(
+                        self._workers, functools.partial(handler, query=query, body=body, **m.groupdict()))
+            except ServiceError as e:
+                return e.status, {'error': e.message}, None
+            except EarningExportError as e:
+                return 409, {'error': str(e)}, None
+            except Exception as e:
+                return 500, {'error': f"{type(e).__name__}: {e}"}, None
+            if is_write:
+                self._invalidate()
+            if isinstance(result, tuple):
+                return result
+            return 200, result, None
+        if path_matched:
+            return 405, {'error': "このメソッドは使えません"}, None
+        return 404, {'error': "見つかりません"}, None
+
+    @staticmethod
+    async def _send(writer, status, payload, keep_alive, extra=None):
+        headers = dict(extra or {})
+        if isinstance(payload, (bytes, bytearray)):
+            data = bytes(payload)
+            headers.setdefault("Content-Type", "application/octet-stream")
+        elif payload is None:
+            data = b""
+        else:
+            data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json; charset=utf-8")
+        headers["Content-Length"] = str(len(data))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        head = f"HTTP/1.1 {status} {_HTTP_REASONS.get(status, 'OK')}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
+
+    # --- キャッシュ ---
+    def _cached(self, key, loader):
+        """書き込み世代が変わるまで loader の結果を使い回す"""
+        with self._cache_lock:
+            generation = self._generation
+            hit = self._cache.get(key)
+            if hit and hit[0] == generation:
+                return hit[1]
+        value = loader()
+        with self._cache_lock:
+            if self._generation == generation:
+                self._cache[key] = (generation, value)
+        return value
+
+    def _invalidate(self):
+        with self._cache_lock:
+            self._generation += 1
+            self._cache.clear()
+
+    # --- 変換 ---
+    @staticmethod
+    def _room_json(info):
+        return {
+            'room': info['room'],
+            'guest': info['guest'],
+            'checkin': info['date'].strftime('%Y-%m-%d'),
+            'checkout': (info['date'] + timedelta(days=info['days'])).strftime('%Y-%m-%d'),
+            'days': info['days'],
+            'ecodoor': info['ecodoor'],
+            'ecoplan': info['ecoplan'],
+            'schedule': [{'date': d.strftime('%Y-%m-%d'), 'status': s} for d, s in info['schedule']],
+        }
+
+    @staticmethod
+    def _parse_date(value, name):
+        try:
+            return datetime.strptime(str(value), '%Y-%m-%d')
+        except (TypeError, ValueError):
+            raise ServiceError(400, f"{name} は YYYY-MM-DD 形式で指定してください")
+
+    @staticmethod
+    def _json_body(body):
+        try:
+            return json.loads(body.decode("utf-8")) if body else {}
+        except (UnicodeDecodeError, ValueError):
+            raise ServiceError(400, "本文が JSON ではありません")
+
+    def _load_rooms_json(self):
+        return self.db.read(lambda conn: [self._room_json(i) for i in self.engine.query_rooms(conn)])
+
+    def _save_upload(self, body, kind):
+        if not body:
+            raise ServiceError(400, "CSVが空です")
+        path = os.path.join(self.upload_dir, f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.csv")
+        with open(path, 'wb') as f:
+            f.write(body)
+        return path
+
+    # --- エンドポイント ---
+    def health(self, query, body):
+        return {'status': 'ok', 'db': os.path.abspath(self.engine.db_file), 'generation': self._generation}
+
+    def list_rooms(self, query, body):
+        return {'rooms': self._cached("rooms", self._load_rooms_json)}
+
+    def get_room(self, query, body, room):
+        infos = self.db.read(lambda conn: self.engine.query_rooms(conn, room))
+        if not infos:
+            raise ServiceError(404, f"部屋番号 {room} は登録されていません")
+        return self._room_json(infos[0])
+
+    def put_room(self, query, body, room):
+        data = self._json_body(body)
+        checkin = self._parse_date(data.get('checkin'), 'checkin')
+        if 'checkout' in data:
+            days = (self._parse_date(data['checkout'], 'checkout') - checkin).days
+        else:
+            try:
+                days = int(data.get('days', 0))
+            except (TypeError, ValueError):
+                raise ServiceError(400, "days は整数で指定してください")
+        if days <= 0:
+            raise ServiceError(400, "チェックアウト日はチェックイン日より後である必要があります")
+
+        if 'schedule' in data:
+            rows = self._schedule_rows(data['schedule'], checkin, days)
+        else:
+            # スケジュール省略時は C/I・中日(×/エコドア)・C/O を自動作成
+            middle = "エコドア" if data.get('ecodoor') else "×"
+            rows = [(checkin + timedelta(days=i),
+                     "C/I" if i == 0 else "C/O" if i == days else middle) for i in range(days + 1)]
+        record = {
+            'room': room,
+            'guest': str(data.get('guest', '')),
+            'date': checkin,
+            'days': days,
+            'ecodoor': bool(data.get('ecodoor', False)),
+            'ecoplan': bool(data.get('ecoplan', False)),
+        }
+        self.engine.unit_of_work("edit", lambda uow: uow.put_room(record, rows))
+        return 200, {'room': room, 'saved': True, 'days': days, 'schedule_rows': len(rows)}, None
+
+    def _schedule_rows(self, items, checkin, days):
+        """PUT の schedule を [(日付, ステータス), ...] にする。ステータスが規定外のものや、
+        C/I〜C/O の各日をちょうど1回ずつ含まないものは 400"""
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ServiceError(400, "schedule は {\"date\", \"status\"} のリストで指定してください")
+        rows = []
+        for item in items:
+            status = item.get('status')
+            if status not in SCHEDULE_STATUSES:
+                raise ServiceError(400, f"schedule.status は {'・'.join(SCHEDULE_STATUSES)}"
+                                        f" のいずれかです: {status!r}")
+            rows.append((self._parse_date(item.get('date'), 'schedule.date'), status))
+        dates = [date for date, _ in rows]
+        expected = [checkin + timedelta(days=i) for i in range(days + 1)]
+        if len(set(dates)) != len(dates):
+            raise ServiceError(400, "schedule に同じ日付が複数あります")
+        if sorted(dates) != expected:
+            raise ServiceError(400, f"schedule はチェックイン日 {expected[0]:%Y-%m-%d} から"
+                                    f"チェックアウト日 {expected[-1]:%Y-%m-%d} までの各日を含めてください")
+        return rows
+
+    def delete_room(self, query, body, room):
+        if not self.engine.unit_of_work("delete", lambda uow: uow.delete_rooms([room])):
+            raise ServiceError(404, f"部屋番号 {room} は登録されていません")
+        return {'room': room, 'deleted': True}
+
+    def list_schedules(self, query, body):
+        start = self._parse_date(query['start'], 'start') if 'start' in query else datetime(1970, 1, 1)
+        end = self._parse_date(query['end'], 'end') if 'end' in query else datetime(9999, 12, 31)
+
+        def load():
+            return [{'room': room, 'date': date.strftime('%Y-%m-%d'), 'status': status}
+                    for date, room, status in self.engine.schedule_between(start, end)]
+
+        key = ("schedules", query.get('start'), query.get('end'))
+        return {'schedules': self._cached(key, load)}
+
+    def reports(self, query, body):
+        by = query.get('by', 'month')
+        if by not in HotelCleaningSystem.REPORT_PERIOD_FORMATS:
+            raise ServiceError(400, "by は month または year を指定してください")
+        start = self._parse_date(query['start'], 'start') if 'start' in query else None
+        end = self._parse_date(query['end'], 'end') if 'end' in query else None
+        key = ("reports", by, query.get('start'), query.get('end'), query.get('active', '1'))
+        return {'by': by, 'periods': self._cached(key, lambda: self.engine.occupancy_report(
+            by, start, end, include_active=query.get('active', '1') == '1'))}
+
+    def integrity(self, query, body):
+        # 書き込み直後でも結果に反映されるよう、実行中の検査を少し待つ
+        issues = self.engine.integrity_issues(wait=10)
+        return {'count': len(issues), 'issues': [
+            {'kind': i['kind'], 'label': INTEGRITY_KINDS.get(i['kind'], i['kind']), 'room': i['room'],
+             'date': _from_day_number(i['day']).strftime('%Y-%m-%d') if i['day'] is not None else None,
+             'detail': i['detail']} for i in issues]}
+
+    def upload_room_status(self, query, body):
+        path = self._save_upload(body, "room_status")
+        if self.engine.detect_csv_type(path) != 'room_status':
+            os.remove(path)
+            raise ServiceError(400, "部屋状態CSVではないようです")
+        self.last_room_status_csv = path
+        eco_rooms, csv_date = self.engine._read_room_status_csv(path)
+        deleted = None
+        if csv_date and query.get('cleanup') == '1':
+            # 画面のCSV読込と同じく、CSVの日付でC/O済みの部屋を整理する
+            deleted = self.engine.cleanup_checkout_rooms(csv_date)
+        return 201, {'path': os.path.basename(path),
+                     'date': csv_date.strftime('%Y-%m-%d') if csv_date else None,
+                     'eco_rooms': len(eco_rooms), 'cleanup': deleted}, None
+
+    def upload_reservation(self, query, body):
+        path = self._save_upload(body, "reservation")
+        if self.engine.detect_csv_type(path) != 'yoyaku':
+            os.remove(path)
+            raise ServiceError(400, "予約CSVではないようです")
+        self.last_reservation_csv = path
+        guests = self.engine.load_guest_names_from_yoyaku(path)
+        return 201, {'path': os.path.basename(path), 'guests': len(guests)}, None
+
+    def _guest_map(self):
+        if not self.last_reservation_csv:
+            return {}
+        return self._cached("guests", lambda: self.engine.load_guest_names_from_yoyaku(
+            self.last_reservation_csv))
+
+    def eco_rooms(self, query, body):
+        if not self.last_room_status_csv:
+            raise ServiceError(409, "部屋状態CSVがまだアップロードされていません")
+        eco_rooms, csv_date = self.engine._read_room_status_csv(self.last_room_status_csv)
+        registered = self.db.read(lambda conn: {r for (r,) in conn.execute("SELECT room_number FROM rooms")})
+        guests = self._guest_map()
+        return {
+            'date': csv_date.strftime('%Y-%m-%d') if csv_date else None,
+            'rooms': [{'room': r['room'],
+                       'guest': guests.get(r['room'], {}).get('name', ''),
+                       'ecoplan': guests.get(r['room'], {}).get('is_ecoplan', False),
+                       'registered': r['room'] in registered} for r in eco_rooms],
+        }
+
+    def register_rooms(self, query, body):
+        data = self._json_body(body)
+        checkin = self._parse_date(data.get('checkin'), 'checkin')
+        guests = self._guest_map()
+        rules = self.engine._load_schedule_rules()
+        if 'ecodoor' in data:
+            ecodoor_rooms = {str(r) for r in data['ecodoor']}
+        else:
+            # 指定が無ければスケジュール規則のエコドアの既定に従う
+            ecodoor_rooms = {str(r) for r in data.get('rooms', [])
+                             if self.engine.default_ecodoor(guests.get(str(r), {}), rules)}
+
+        def register(uow):
+            cursor = uow.cursor
+            cursor.execute("SELECT room_number FROM rooms")
+            existing = {r for (r,) in cursor.fetchall()}
+            rooms = [room for room in dict.fromkeys(str(r) for r in data.get('rooms', []))
+                     if room not in existing]
+            records = self.engine.build_stay_records(rooms, checkin, guests, ecodoor_rooms, rules)
+            for record in records:
+                uow.put_room(record, self.engine._record_schedule_rows(record))
+            return [record['room'] for record in records]
+
+        registered = self.engine.unit_of_work("register", register)
+        return 201, {'registered': registered}, None
+
+    def bulk_update(self, query, body):
+        data = self._json_body(body)
+        start = self._parse_date(data.get('start'), 'start')
+        end = self._parse_date(data.get('end', data.get('start')), 'end')
+        floor = data.get('floor')
+        try:
+            if floor is not None:
+                floor = [int(f) for f in floor] if isinstance(floor, list) else int(floor)
+            return self.engine.bulk_set_status(
+                data.get('status'), start, end, floor=floor, plan=data.get('plan'),
+                rooms=data.get('rooms'), keep_endpoints=bool(data.get('keep_endpoints', True)))
+        except (TypeError, ValueError) as e:
+            raise ServiceError(400, str(e))
+
+    def undo(self, query, body):
+        return self._step(self.engine.undo)
+
+    def redo(self, query, body):
+        return self._step(self.engine.redo)
+
+    def _step(self, step):
+        try:
+            op = step()
+        except ValueError as e:
+            raise ServiceError(409, str(e))
+        if op is None:
+            raise ServiceError(409, "戻せる操作がありません")
+        return {'op': op, 'undo': len(self.engine.undo_stack), 'redo': len(self.engine.redo_stack)}
+
+    def eco_sheet(self, query, body):
+        def build():
+            import tempfile
+
+            if not self.engine.schedule_months():
+                raise ServiceError(409, "登録されている部屋がありません")
+            with tempfile.TemporaryDirectory() as tmp:
+                paths = self.engine.generate_excel(os.path.join(tmp, name), split=split)
+                if len(paths) == 1:
+                    with open(paths[0], 'rb') as f:
+                        return (f.read(), os.path.basename(paths[0]),
+                                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                # 分割したブックは zip にまとめて返す
+                buffer = io.BytesIO()
+                with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+                    for path in paths:
+                        zf.write(path, os.path.basename(path))
+                return buffer.getvalue(), os.path.splitext(name)[0] + ".zip", "application/zip"
+
+        split = query.get('split') or None
+        if split not in (None, 'quarter'):
+            raise ServiceError(400, "split は quarter のみ指定できます")
+        name = os.path.basename(self.engine.excel_file)
+        data, filename, content_type = self._cached(("eco-sheet", split), build)
+        return 200, data, {
+            "Content-Type": content_type,
+            "Content-Disposition": f"attachment; filename=\"{filename}\"",
+        }
+
+    def earning(self, query, body):
+        import tempfile
+        from urllib.parse import quote
+
+        if body:
+            csv_path = self._save_upload(body, "room_status")
+            if self.engine.detect_csv_type(csv_path) != 'room_status':
+                os.remove(csv_path)
+                raise ServiceError(400, "部屋状態CSVではないようです")
+        elif self.last_room_status_csv:
+            csv_path = self.last_room_status_csv
+        else:
+            raise ServiceError(409, "部屋状態CSVがまだアップロードされていません")
+        template_path = self.template_path or self.engine._find_earning_template()
+        if not template_path:
+            raise ServiceError(409, "アーニング表テンプレートが見つかりません（--template で指定してください）")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ext = os.path.splitext(template_path)[1].lower()
+            path = os.path.join(tmp, "earning" + ext)
+            result = self.db.read(lambda conn: self.engine.export_earning_table(
+                csv_path, template_path, path, conn=conn))
+            with open(path, 'rb') as f:
+                data = f.read()
+        filename = f"アーニング表_出力_{result['date']}{ext}"
+        content_type = ("application/vnd.ms-excel.sheet.macroEnabled.12" if result['is_macro']
+                        else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        return 200, data, {
+            "Content-Type": content_type,
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+            "X-Earning-Counts": json.dumps(result['counts'], ensure_ascii=True),
+        }
+
+
+# ---------------------------------------------------------------------------
+# フォルダ監視モード
+# ---------------------------------------------------------------------------
+
+# 書き込み中のファイルを読まないよう、サイズ・更新時刻がこの秒数変わらなくなってから読む
+WATCH_SETTLE_SECONDS = 5.0
+# inotify が使えないときのフォルダ走査の間隔（秒）
+WATCH_POLL_SECONDS = 2.0
+# 部屋状態CSVが届いてから、同じ日付の予約CSVを待つ秒数（過ぎたら予約CSVなしで処理する）
+WATCH_PAIR_SECONDS = 300.0
+# 処理に失敗した日を再度試すまでの秒数
+WATCH_RETRY_SECONDS = 600.0
+# 処理済みのファイルを記録する監視フォルダ内のファイル
+WATCH_STATE_NAME = ".ecoroom_watch.json"
+
+# inotify のイベント（<sys/inotify.h>）
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_EVENT = struct.Struct("iIII")
+
+
+class _InotifyWatch:
+    """Linux の inotify（ctypes で libc を直接呼ぶ）でフォルダ内の変更を待つ"""
+
+    def __init__(self, folder):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 に失敗しました")
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(folder), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch に失敗しました: {folder}")
+
+    def wait(self, timeout):
+        """timeout 秒まで待ち、変更のあったファイル名の集合を返す"""
+        import select
+
+        names = set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return names
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + _IN_EVENT.size <= len(data):
+            _, _, _, length = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingWatch:
+    """inotify が使えない環境向け。一定間隔でフォルダを走査する"""
+
+    def __init__(self, folder, interval=WATCH_POLL_SECONDS):
+        self.folder = folder
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return {entry.name for entry in os.scandir(self.folder) if entry.is_file()}
+
+    def close(self):
+        pass
+
+
+class WatchFolderDaemon:
+    """監視フォルダに置かれた部屋状態CSV・予約CSVを自動で取り込む常駐処理。
+
+    CSV の種別は detect_csv_type で判定し、部屋状態CSVは1行目の日付、予約CSVは
+    ファイル名の8桁の日付（無ければ更新日）で組にする。組がそろうか、部屋状態CSVが
+    届いてから pair_seconds 過ぎたら run_daily_pipeline で登録・出力する。
+    処理に成功したファイルだけを監視フォルダの .ecoroom_watch.json に記録し、再起動しても
+    同じファイルを二度処理しない。失敗した日は retry_seconds ごとに試し直し、
+    組を待っている途中で止めた日は、再起動時に記録の無いファイルから組み直す。"""
+
+    def __init__(self, folder, output_dir=None, db_file=None, template_path=None,
+                 settle=WATCH_SETTLE_SECONDS, pair_seconds=WATCH_PAIR_SECONDS, polling=None,
+                 retry_seconds=WATCH_RETRY_SECONDS):
+        self.folder = os.path.abspath(folder)
+        self.output_dir = output_dir or os.path.join(self.folder, "output")
+        self.template_path = template_path
+        self.settle = settle
+        self.pair_seconds = pair_seconds
+        self.retry_seconds = retry_seconds
+        self.engine = HotelCleaningSystem(headless=True, db_file=db_file)
+        self.state_path = os.path.join(self.folder, WATCH_STATE_NAME)
+        self.done = self._load_state()
+        # ファイル名 -> (サイズ, 更新時刻ns, 最後に変わった時刻)
+        self._changes = {}
+        # 日付 -> パス（種別ごと）と、部屋状態CSVが届いた時刻・失敗後に試し直す時刻
+        self._room_status = {}
+        self._yoyaku = {}
+        self._arrived = {}
+        self._retry_at = {}
+        # 処理待ちのファイル名 -> (判定したときの (サイズ, 更新時刻ns), 日付)（処理に成功したら done に移す）
+        self._queued = {}
+        self._watch = self._open_watch(polling)
+
+    def _open_watch(self, polling):
+        if polling is None:
+            polling = platform.system() != "Linux"
+        if not polling:
+            try:
+                return _InotifyWatch(self.folder)
+            except (OSError, AttributeError) as e:
+                _tracer.event("watch_folder", fallback="polling", error=str(e))
+        return _PollingWatch(self.folder)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return {name: tuple(sig) for name, sig in json.load(f).get("done", {}).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"done": self.done}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def _note(self, names, now):
+        """変更のあったファイルのサイズ・更新時刻を記録する（変わっていれば待ち直し）"""
+        for name in names:
+            if not name.lower().endswith(".csv"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                self._changes.pop(name, None)
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            if self.done.get(name) == sig:
+                continue
+            previous = self._changes.get(name)
+            if previous is None or previous[:2] != sig:
+                self._changes[name] = sig + (now,)
+
+    def _settled(self, now):
+        """書き込みが落ち着いたファイル名を返し、待ちの一覧から外す"""
+        ready = [name for name, (_, _, changed) in self._changes.items() if now - changed >= self.settle]
+        for name in ready:
+            del self._changes[name]
+        return ready
+
+    @staticmethod
+    def _file_date(path):
+        match = re.search(r"(20\d{2})(\d{2})(\d{2})", os.path.basename(path))
+        if match:
+            try:
+                return datetime(*map(int, match.groups())).strftime('%Y-%m-%d')
+            except ValueError:
+                pass
+        return datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d')
+
+    def _classify(self, name, now):
+        path = os.path.join(self.folder, name)
+        kind = self.engine.detect_csv_type(path)
+        st = os.stat(path)
+        sig = (st.st_size, st.st_mtime_ns)
+        if kind == 'room_status':
+            _, csv_date = self.engine._read_room_status_csv(path)
+            day = csv_date.strftime('%Y-%m-%d') if csv_date else self._file_date(path)
+            self._room_status[day] = path
+            self._queued[name] = (sig, day)
+            # 予約CSVを待つ時間はファイルが置かれた時刻から数える（再起動しても延びないように）
+            self._arrived.setdefault(day, now - max(0.0, time.time() - st.st_mtime))
+        elif kind == 'yoyaku':
+            day = self._file_date(path)
+            self._yoyaku[day] = path
+            self._queued[name] = (sig, day)
+        else:
+            # 取り込めないファイルは次から見ない
+            self.done[name] = sig
+        _tracer.event("watch_folder", file=name, kind=kind)
+        print(f"[監視] {name}: {kind}")
+
+    def _run_ready(self, now):
+        """組がそろった日付（または予約CSVを待ち切った日付）を処理する"""
+        results = []
+        for day in sorted(self._room_status):
+            if day not in self._yoyaku and now - self._arrived[day] < self.pair_seconds:
+                continue
+            if now < self._retry_at.get(day, now):
+                continue
+            room_status = self._room_status[day]
+            yoyaku = self._yoyaku.get(day)
+            try:
+                result = self.engine.run_daily_pipeline(room_status, yoyaku, self.output_dir, self.template_path)
+            except Exception as e:
+                # 処理済みにはせず、組のまま残して後で試し直す（再起動しても試し直される）
+                self._retry_at[day] = now + self.retry_seconds
+                _tracer.event("watch_folder", day=day, error=f"{type(e).__name__}: {e}")
+                print(f"[監視] {day} の処理に失敗しました（{self.retry_seconds:.0f}秒後に再試行）: {e}")
+                continue
+            del self._room_status[day]
+            self._yoyaku.pop(day, None)
+            self._arrived.pop(day, None)
+            self._retry_at.pop(day, None)
+            # 組にした2つと、同じ日付で置き換えられた古いファイルを処理済みにする
+            for name in [n for n, (_, queued_day) in self._queued.items() if queued_day == day]:
+                self.done[name] = self._queued.pop(name)[0]
+            self._save_state()
+            results.append(result)
+            print(f"[監視] {day}: 新規登録 {len(result['registered'])}件 / "
+                  f"エコ票 {', '.join(os.path.basename(p) for p in result['excel'])}"
+                  + (f" / アーニング表 {os.path.basename(result['earning'])}" if result['earning'] else ""))
+        return results
+
+    def poll(self, timeout=None, now=None):
+        """変更を1回待って処理する。処理した日の結果のリストを返す"""
+        names = self._watch.wait(self.settle / 2 if timeout is None else timeout)
+        now = time.monotonic() if now is None else now
+        self._note(names, now)
+        ready = self._settled(now)
+        for name in ready:
+            try:
+                self._classify(name, now)
+            except OSError as e:
+                _tracer.event("watch_folder", file=name, error=str(e))
+        results = self._run_ready(now)
+        if ready:
+            self._save_state()
+        return results
+
+    def run_forever(self):
+        print(f"[監視] {self.folder} を監視しています（出力先: {self.output_dir}、"
+              f"{'inotify' if isinstance(self._watch, _InotifyWatch) else 'ポーリング'}）。Ctrl+C で終了します。")
+        # 停止中に置かれたファイルも処理する
+        self._note(os.listdir(self.folder), time.monotonic())
+        try:
+            while True:
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self._watch.close()
+        self.engine.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="エコ清掃管理システム")
+    parser.add_argument("--serve", action="store_true", help="画面を出さずに HTTP/JSON サービスとして起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVICE_DEFAULT_PORT)
+    parser.add_argument("--db", default=None, help="使用するデータベースファイル（既定: hotel_cleaning.db）")
+    parser.add_argument("--template", default=None, help="アーニング表テンプレートのパス")
+    parser.add_argument("--watch", metavar="FOLDER", default=None,
+                        help="画面を出さずにフォルダを監視し、置かれたCSVを自動で取り込んで出力する")
+    parser.add_argument("--output", default=None,
+                        help="フォルダ監視・一括出力での出力先（既定: 監視フォルダ/output・カレントフォルダ）")
+    parser.add_argument("--polling", action="store_true", help="フォルダ監視で inotify を使わずに走査する")
+    parser.add_argument("--export", metavar="DIR", default=None,
+                        help="部屋・スケジュール・アーニング区分を分析用の列指向ファイルとして DIR に書き出す")
+    parser.add_argument("--format", choices=COLUMNAR_FORMATS, default=None,
+                        help="--export の形式（既定: parquet → npz → csv の順に使えるもの）")
+    parser.add_argument("--earning-batch", metavar="FOLDER", default=None,
+                        help="FOLDER の部屋状態CSVからアーニング表をまとめて出力する（--output に出力）")
+    parser.add_argument("--start", default=None, help="--export / --earning-batch の開始日 YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="--export / --earning-batch の終了日 YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    if args.earning_batch:
+        engine = HotelCleaningSystem(headless=True, db_file=args.db)
+        try:
+            template_path = args.template or engine._find_earning_template()
+            if not template_path:
+                parser.error("アーニング表テンプレートが見つかりません（--template で指定してください）")
+            result = engine.export_earning_batch(
+                args.earning_batch, template_path, args.output,
+                datetime.strptime(args.start, '%Y-%m-%d') if args.start else None,
+                datetime.strptime(args.end, '%Y-%m-%d') if args.end else None)
+        except EarningExportError as e:
+            parser.error(str(e))
+        finally:
+            engine.close()
+        for day in result['days']:
+            print(f"{day['date']}: {day['written']}室 → {day['output_path']}")
+        for path, message in result['errors']:
+            print(f"エラー {os.path.basename(path)}: {message}")
+        print(f"集計: {result['summary_path']}")
+        return
+
+    if args.export:
+        engine = HotelCleaningSystem(headless=True, db_file=args.db)
+        try:
+            result = engine.export_columnar(
+                args.export, args.format,
+                datetime.strptime(args.start, '%Y-%m-%d') if args.start else None,
+                datetime.strptime(args.end, '%Y-%m-%d') if args.end else None)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            engine.close()
+        for name, path in result['files'].items():
+            print(f"{name}: {result['rows'][name]}行 → {path}")
+        return
+
+    if args.watch:
+        WatchFolderDaemon(args.watch, args.output, db_file=args.db, template_path=args.template,
+                          polling=args.polling or None).run_forever()
+        return
+    if args.serve:
+        EcoRoomService(db_file=args.db, template_path=args.template).serve_forever(args.host, args.port)
+        return
+    app = HotelCleaningSystem(db_file=args.db)
+    app.run()
+
+
 if __name__ == "__main__":
-    app = HotelCleaningSystem()
-    app.run()
\ No newline at end of file
+    # 実行ファイル化したときに、予約CSVやエコ票の並列処理の子プロセスが正しく起動するように
+    import multiprocessing
+
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,95 @@
+"""部屋 × 日 の清掃ステータス行列（OccupancyMatrix）のベンチマーク。
+
+合成した DB（既定 2,000室 × 365日）で、
+  1) エコ票の月シートの行（12か月分）: 月ごとに schedule_between で読む従来の処理 / 行列の切り出し
+  2) 日ごとのステータス別・エコドア・エコプランの部屋数: SQL の GROUP BY / 行列の np.bincount
+の時間を比べ、両者の結果が一致することを確認する（NumPy が必要）。
+
+使い方:
+    python benchmarks/bench_occupancy_matrix.py [--rooms 2000] [--days 365]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import EcoRoomClean  # noqa: E402
+
+
+def populate(db_file, rooms, days, start):
+    """rooms 室すべてに start から days 日分のスケジュールを入れる"""
+    statuses = EcoRoomClean.SCHEDULE_STATUSES
+    first = EcoRoomClean._day_number(start)
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany("INSERT INTO rooms VALUES (?, ?, ?, ?, ?, ?)",
+                         [(str(201 + i), f"ｹﾞｽﾄ{i}", start.strftime('%Y-%m-%d'), days, i % 3 == 0, i % 5 == 0)
+                          for i in range(rooms)])
+        conn.executemany("INSERT INTO cleaning_schedule (room_number, cleaning_date, cleaning_status) VALUES (?, ?, ?)",
+                         ((str(201 + i), first + d, statuses[(i * 7 + d) % len(statuses)])
+                          for i in range(rooms) for d in range(days) if (i + d) % 11))
+    conn.close()
+
+
+def timed(label, func):
+    t0 = time.perf_counter()
+    result = func()
+    print(f"{label:<40} {(time.perf_counter() - t0) * 1000:9.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    np = EcoRoomClean._numpy()
+    if np is None:
+        print("NumPy が無いため計測できません")
+        return
+
+    start = datetime(2026, 1, 1)
+    end = start + timedelta(days=args.days - 1)
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ[EcoRoomClean.JOURNAL_ENV] = "0"
+        engine = EcoRoomClean.HotelCleaningSystem(headless=True, db_file=os.path.join(work_dir, "bench.db"))
+        try:
+            populate(engine.db_file, args.rooms, args.days, start)
+            months = engine.schedule_months()
+            print(f"{args.rooms}室 × {args.days}日（{len(months)}か月）")
+
+            def legacy_rows(conn):
+                rooms = {room: (guest, bool(ecoplan)) for room, guest, ecoplan in conn.execute(
+                    "SELECT room_number, guest_name, is_ecoplan FROM rooms")}
+                return {key: engine._month_rows(conn, *key, rooms) for key in months}
+
+            def matrix_rows(conn):
+                matrix = engine.occupancy_matrix(start, end, conn)
+                return {key: matrix.month_rows(*key) for key in months}
+
+            slow = timed("月シートの行（月ごとに読み込み）", lambda: engine.db.read(legacy_rows))
+            fast = timed("月シートの行（行列の切り出し）", lambda: engine.db.read(matrix_rows))
+            assert fast == slow, "行列から作った月シートの行が一致しません"
+
+            timed("行列の作成のみ", lambda: engine.occupancy_matrix(start, end))
+            counts_fast = timed("日別の部屋数（行列 + bincount）", lambda: engine.daily_counts(start, end))
+            EcoRoomClean._numpy, numpy_loader = (lambda: None), EcoRoomClean._numpy
+            try:
+                counts_slow = timed("日別の部屋数（SQL GROUP BY）", lambda: engine.daily_counts(start, end))
+            finally:
+                EcoRoomClean._numpy = numpy_loader
+            assert counts_fast == counts_slow, "日別の部屋数が一致しません"
+        finally:
+            engine.db.close()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
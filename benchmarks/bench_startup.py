@@ -0,0 +1,103 @@
+"""起動時間のベンチマーク。
+
+1) python -X importtime で EcoRoomClean の import 時間を計測し、
+   重いモジュール（openpyxl など）が起動時に読み込まれていないことを確認する。
+2) 画面が使える環境では、最初のウィンドウ（起動時データ整理ダイアログ）が
+   表示されるまでの時間を計測し、上限以内であることを確認する。
+
+使い方:
+    python benchmarks/bench_startup.py [--import-budget-ms 300] [--window-budget-ms 2000]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 起動時に読み込まれてはいけないモジュール（使う処理の中で遅延 import する）
+LAZY_MODULES = ('openpyxl', 'csv', 'unicodedata', 'calendar', 'subprocess')
+
+# 最初のウィンドウが出た時点で時間を出力して終了する計測用スクリプト。
+# 起動時データ整理ダイアログの代わりに、ルートウィンドウを描画して即終了する。
+WINDOW_PROBE = r"""
+import os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import EcoRoomClean
+
+def probe(self):
+    self.root.update()
+    print("FIRST_WINDOW_MS", (time.perf_counter() - t0) * 1000.0, flush=True)
+    os._exit(0)
+
+EcoRoomClean.HotelCleaningSystem.show_checkout_cleanup_dialog = probe
+EcoRoomClean.HotelCleaningSystem()
+"""
+
+
+def measure_import():
+    """-X importtime の出力から (EcoRoomClean の累積us, 読み込まれたモジュール名の集合) を返す"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import EcoRoomClean"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True,
+    )
+    pattern = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\s*)(\S+)")
+    cumulative = None
+    modules = set()
+    for line in result.stderr.splitlines():
+        m = pattern.match(line)
+        if not m:
+            continue
+        name = m.group(4)
+        modules.add(name)
+        if name == "EcoRoomClean":
+            cumulative = int(m.group(2))
+    return cumulative, modules
+
+
+def measure_first_window():
+    """最初のウィンドウ表示までの時間(ms)。画面が無い環境では None"""
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        return None
+    # 実DBを触らないよう、空の作業フォルダで起動する
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = subprocess.run(
+            [sys.executable, "-c", WINDOW_PROBE.format(repo=REPO_DIR)],
+            cwd=work_dir, capture_output=True, text=True, timeout=60,
+        )
+    for line in result.stdout.splitlines():
+        if line.startswith("FIRST_WINDOW_MS"):
+            return float(line.split()[1])
+    raise RuntimeError(f"計測に失敗しました:\n{result.stderr}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--import-budget-ms", type=float, default=300.0)
+    parser.add_argument("--window-budget-ms", type=float, default=2000.0)
+    args = parser.parse_args()
+
+    cumulative_us, modules = measure_import()
+    import_ms = cumulative_us / 1000.0
+    eager = sorted(m for m in LAZY_MODULES if m in modules)
+    print(f"import EcoRoomClean: {import_ms:.1f} ms（上限 {args.import_budget_ms:.0f} ms）")
+    print(f"起動時に読み込まれた遅延対象モジュール: {eager or 'なし'}")
+
+    window_ms = measure_first_window()
+    if window_ms is None:
+        print("最初のウィンドウ: 画面が無いため計測をスキップしました")
+    else:
+        print(f"最初のウィンドウ: {window_ms:.1f} ms（上限 {args.window_budget_ms:.0f} ms）")
+
+    assert not eager, f"起動時に読み込まれています: {eager}"
+    assert import_ms <= args.import_budget_ms, "import 時間が上限を超えました"
+    if window_ms is not None:
+        assert window_ms <= args.window_budget_ms, "最初のウィンドウ表示が上限を超えました"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""予約CSV読み込みのベンチマーク。
+
+合成した cp932 の予約CSV（既定 500MB・24列、引用符・カンマ・改行を含むフィールドあり。
+引用符の中の改行の後ろが予約行のように見える、列数の足りない行も混ぜる）を作り、
+  1) mmap + 正規表現の高速経路（scan_csv_columns）
+  2) csv モジュールによる従来の経路
+で11・12列目を読み出す速度（MB/s）を比べ、両者の結果が一致することを確認する。
+さらに load_guest_names_from_yoyaku 全体（NFKC 変換・エコプラン判定込み）の時間を、
+分割して並行に読むプロセス数を変えて計測する（CPU 数までほぼ比例して速くなることを確認する）。
+
+使い方:
+    python benchmarks/bench_yoyaku_csv.py [--size-mb 500] [--file 既存の予約CSV] [--keep]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import EcoRoomClean  # noqa: E402
+
+PLANS = ['素泊まり', '朝食付', '長期ﾏﾝｽﾘｰ', '長期割/ｳｨｰｸﾘｰ', 'ECOプラン', '連泊割']
+NAMES = ['ﾔﾏﾀﾞ ﾀﾛｳ', 'ｽｽﾞｷ ﾊﾅｺ', 'TANAKA JIRO', '佐藤 一郎', 'ﾀｶﾊｼ ｹﾝ']
+
+
+def make_row(rng, i):
+    room = str(rng.randint(201, 1530))
+    if rng.random() < 0.01:
+        # 列数の足りない行（csv モジュールでは読み飛ばされる）。引用符の中の改行で区切ると
+        # 後半が11・12列目を持つ行に見えてしまう
+        return f'ﾒﾓ,"複数行の\n,,,,,,,,,,{room},ﾀﾞﾐｰ_素泊まり"\r\n'
+    name = f"{rng.choice(NAMES)}_{rng.choice(PLANS)}"
+    memo = rng.random()
+    if memo < 0.05:
+        note = '"備考に,カンマ"'
+    elif memo < 0.07:
+        note = '"複数行の\r\n備考 ""引用"""'
+    else:
+        note = '備考なし'
+    fields = [f"R{i:09d}", "20261019", "20261021", "2", "1", "0", "ｼﾝｸﾞﾙ", "WEB", note, "0",
+              room, name, "090-0000-0000", "東京都新宿区西新宿1-1-1", "", "12000", "0", "12000",
+              "現金", "ﾎﾃﾙ直販", "", "", "20261001", "ｵﾝﾗｲﾝ予約"]
+    return ",".join(fields) + "\r\n"
+
+
+def generate(path, size_mb, seed=1):
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    i = 0
+    with open(path, 'w', encoding='cp932', newline='') as f:
+        while written < target:
+            block = "".join(make_row(rng, i + k) for k in range(5000))
+            i += 5000
+            f.write(block)
+            written += len(block.encode('cp932'))
+    return os.path.getsize(path)
+
+
+def timed(label, size, func):
+    t0 = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<34} {elapsed:8.2f} s  {size / elapsed / 1024 / 1024:8.1f} MB/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=500)
+    parser.add_argument("--file", help="合成せずに既存の予約CSVを使う")
+    parser.add_argument("--keep", action="store_true", help="合成したファイルを削除しない")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    path = args.file or os.path.join(work_dir, "yoyaku_synthetic.csv")
+    if not args.file:
+        print(f"合成中: {args.size_mb} MB → {path}")
+        generate(path, args.size_mb)
+    size = os.path.getsize(path)
+    print(f"ファイルサイズ: {size / 1024 / 1024:.1f} MB")
+
+    engine = EcoRoomClean.HotelCleaningSystem(headless=True, db_file=os.path.join(work_dir, "bench.db"))
+    columns = (engine.YOYAKU_ROOM_COLUMN, engine.YOYAKU_NAME_COLUMN)
+    try:
+        fast = timed("mmap + 正規表現（列の取り出し）", size,
+                     lambda: list(EcoRoomClean.scan_csv_columns(path, columns, 'cp932')))
+        slow = timed("csv モジュール（列の取り出し）", size,
+                     lambda: engine._read_yoyaku_columns(path, 'cp932'))
+        assert fast == slow, "高速経路と csv モジュールの結果が一致しません"
+        print(f"一致: {len(fast)} 行")
+
+        os.environ[EcoRoomClean.CSV_FAST_ENV] = "1"
+        guests_fast = timed("load_guest_names（高速経路）", size,
+                            lambda: engine.load_guest_names_from_yoyaku(path))
+        os.environ[EcoRoomClean.CSV_FAST_ENV] = "0"
+        guests_slow = timed("load_guest_names（csv モジュール）", size,
+                            lambda: engine.load_guest_names_from_yoyaku(path))
+        assert guests_fast == guests_slow
+
+        # プロセス数ごとの並列読み込み（1 は分割せずにこのプロセスで読む）
+        os.environ[EcoRoomClean.CSV_FAST_ENV] = "1"
+        counts = sorted({1, 2, 4, os.cpu_count() or 1})
+        for workers in counts:
+            EcoRoomClean.CSV_PARSE_WORKERS = workers
+            guests = timed(f"load_guest_names（{workers} プロセス）", size,
+                           lambda: engine.load_guest_names_from_yoyaku(path))
+            assert guests == guests_slow, f"{workers} プロセスの結果が一致しません"
+    finally:
+        engine.db.close()
+        if not args.file and not args.keep:
+            os.remove(path)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()